@@ -70,7 +70,9 @@ EXEC_LOGGING_CONFIG = {
     'max_bytes': 262144,
     'backup_count': 30,
     'when': 'd',
-    'interval': 1
+    'interval': 1,
+    'tracing': None  # records execution spans and logs them at EVENT level (see ohmpi.tracing and plot_exec_log),
+    # if None, tracing is enabled when log_file_logging_level lets EVENT messages through (i.e. logging.DEBUG)
 }
 
 # Data logging configuration
@@ -52,7 +52,8 @@ SPECS = {'ctl': {'model': {'default': 'unknown CTL hardware'},
                  'latency': {'default': 0.},
                  'voltage_max': {'default': 0.},
                  'bias': {'default': 0.},
-                 'vmn_hardware_offset': {'default': 0.}}
+                 'vmn_hardware_offset': {'default': 0.},
+                 'n_channels': {'default': 1}}  # number of MN dipoles read at each sample
         }
 
 
@@ -122,6 +123,8 @@ class PwrAbstract(ABC):
         self.connection = kwargs['connection']
         self._battery_voltage = np.nan
         self._pwr_discharge_latency = np.nan
+        self._pwr_discharge_mode = 'fixed'  # 'fixed': waits for the latency, 'feedback': waits for the voltage to drop
+        self._pwr_discharge_tolerance = np.nan
         self.connect = kwargs['connect']
         self.specs = kwargs
 
@@ -163,6 +166,21 @@ class PwrAbstract(ABC):
     def reload_settings(self):
         pass
 
+    def _retrieve_voltage(self, since=None):
+        """Reads the output voltage into self._voltage
+
+        Parameters
+        ----------
+        since: float, optional
+            time.perf_counter() time after which the voltage should have been read
+
+        Returns
+        -------
+        float
+            time.perf_counter() time of the reading, None if the output voltage cannot be read
+        """
+        return None
+
     @property
     @abstractmethod
     def voltage(self):
@@ -237,11 +255,21 @@ class MuxAbstract(ABC):
         assert isinstance(value, Barrier)
         self._barrier = value
 
+    @property
+    def bus(self):
+        """Bus the board is connected to, boards on different buses can be operated concurrently"""
+        return self.connection
+
     @abstractmethod
     def reset(self):
         pass
 
-    def switch(self, elec_dict=None, state='off', bypass_check=False, bypass_ab_check=False):  # TODO: generalize for other roles
+    def fast_reset(self):
+        """Switches all relays off. Boards able to do it without being re-initialized should override this method,
+        by default it calls reset."""
+        self.reset()
+
+    def switch(self, elec_dict=None, state='off', bypass_check=False, bypass_ab_check=False, validated=False):  # TODO: generalize for other roles
         """Switch a given list of electrodes with different roles.
         Electrodes with a value of 0 will be ignored.
 
@@ -255,12 +283,16 @@ class MuxAbstract(ABC):
             Bypasses checks for A==M or A==M or B==M or B==N (i.e. used for rs-check)
         bypass_ab_check: bool, optional
             Bypasses checks for A==B (i.e. used for testing r_shunt). Should be used with caution.
+        validated: bool, optional
+            Skips the checks above for quadrupoles already validated with their sequence (see
+            ohmpi.sequence.validate_sequence).
         """
         status = True
         if elec_dict is not None:
             self.exec_logger.debug(f'Switching {self.model} ')
+            # NOTE: the roles of validated quadrupoles were already checked for the whole sequence
             # check to prevent A == B (SHORT-CIRCUIT)
-            if 'A' in elec_dict.keys() and 'B' in elec_dict.keys():
+            if not validated and 'A' in elec_dict.keys() and 'B' in elec_dict.keys():
                 if bypass_ab_check:
                     self.exec_logger.warning(f'Bypassing AB check: {bypass_ab_check}')
                 else:
@@ -268,13 +300,14 @@ class MuxAbstract(ABC):
                     if out.any() and state == 'on':  # noqa
                         self.exec_logger.error('Trying to switch on some electrodes with both A and B roles. '
                                                'This would create a short-circuit! Switching aborted.')
+                        self.barrier.abort()
                         status = False
                         return status
 
             # check that none of M or N are the same as A or B
             # as to prevent burning the MN part which cannot take
             # the full voltage of the DPS
-            if 'A' in elec_dict.keys() and 'B' in elec_dict.keys() and 'M' in elec_dict.keys() \
+            if not validated and 'A' in elec_dict.keys() and 'B' in elec_dict.keys() and 'M' in elec_dict.keys() \
                     and 'N' in elec_dict.keys():
                 if bypass_check:
                     self.exec_logger.debug(f'Bypassing :{bypass_check}')
@@ -292,16 +325,19 @@ class MuxAbstract(ABC):
             self.exec_logger.debug(f'{self.board_id} waiting to switch.')
             try:
                 self.barrier.wait()
+                relays = []
                 for role in elec_dict:
                     for elec in elec_dict[role]:
                         if elec > 0:  # Is this condition related to electrodes to infinity?
                             if (elec, role) in self.cabling.keys():
-                                self.switch_one(elec, role, state)
+                                relays.append((elec, role))
                                 status &= True
                             else:
                                 self.exec_logger.debug(f'{self.board_id} skipping switching {(elec, role)} because it '
                                                        f'is not in board cabling.')
                                 status = False
+                if len(relays) > 0:
+                    self.switch_many(relays, state)
                 self.exec_logger.debug(f'{self.board_id} switching done.')
             except BrokenBarrierError:
                 self.exec_logger.debug(f'Barrier error {self.board_id} switching aborted.')
@@ -328,6 +364,20 @@ class MuxAbstract(ABC):
         """
         self.exec_logger.debug(f'switching {state} electrode {elec} with role {role}')
 
+    def switch_many(self, relays, state=None):
+        """Switches a list of relays. Boards able to switch several relays at once should override this method,
+        by default relays are switched one by one.
+
+        Parameters
+        ----------
+        relays : list
+            List of (electrode, role) tuples.
+        state : str, optional
+            Either 'on' or 'off'.
+        """
+        for elec, role in relays:
+            self.switch_one(elec, role, state)
+
     def test(self, elec_dict, activation_time=1.):
         """Method to test the multiplexer.
 
@@ -377,6 +427,7 @@ class TxAbstract(ABC):
         self.connect = kwargs['connect']
         self.specs = kwargs
         self._measuring = 'off'
+        self.switching = False  # True while polarity relays are switching within a waveform program
 
 
     @property
@@ -441,6 +492,43 @@ class TxAbstract(ABC):
             time.sleep(injection_duration)
             self.tx_sync.clear()
 
+    def inject_program(self, durations, polarities, on_segment=None):
+        """Runs a waveform program, i.e. a train of segments of given polarities and durations, in a single
+        deadline-driven timing loop. tx_sync is set during the whole program so that a single sampler can record
+        the whole train. Polarity is switched at scheduled monotonic times.
+
+        Parameters
+        ----------
+        durations: list, np.ndarray
+            Duration of each segment in seconds.
+        polarities: list, np.ndarray
+            Polarity of each segment, either 1, 0 or -1.
+        on_segment: callable, optional
+            Function called with the segment index right before switching the polarity of a segment.
+
+        Returns
+        -------
+        np.ndarray
+            Timing jitter of the start of each segment in seconds (delay relative to its scheduled time).
+        """
+        durations = np.asarray(durations, dtype=float)
+        assert len(polarities) == len(durations)
+        deadlines = np.cumsum(durations)  # end of each segment relative to program start
+        starts = deadlines - durations
+        jitter = np.zeros(len(durations))
+        self.tx_sync.set()
+        t0 = time.perf_counter()
+        for i, polarity in enumerate(polarities):
+            jitter[i] = time.perf_counter() - t0 - starts[i]
+            self.switching = True
+            if on_segment is not None:
+                on_segment(i)
+            self.polarity = polarity
+            self.switching = False
+            time.sleep(np.max([0., t0 + deadlines[i] - time.perf_counter()]))
+        self.tx_sync.clear()
+        return jitter
+
     @property
     def injection_duration(self):
         return self._injection_duration
@@ -471,16 +559,66 @@ class TxAbstract(ABC):
     def measuring(self, mode="off"):
         self._measuring = mode
 
-    def discharge_pwr(self, latency=None):
+    def _wait_discharge(self, latency, target=None, tolerance=None):
+        """Waits for the pwr to discharge. In 'feedback' discharge mode, the pwr output voltage is polled until it
+        drops below target + tolerance, latency being then used as a timeout. Otherwise, waits for latency.
+
+        Parameters
+        ----------
+        latency: float
+            Discharge duration [s] (timeout in 'feedback' mode)
+        target: float, optional
+            Target voltage [V] in 'feedback' mode, defaults to pwr voltage_min. Ignored in 'fixed' mode (the default),
+            in which the pwr is discharged for the whole latency whatever the target.
+        tolerance: float, optional
+            Tolerance on the target voltage [V], defaults to pwr _pwr_discharge_tolerance
+
+        Returns
+        -------
+        float
+            Actual discharge duration [s]
+        """
+        t0 = time.perf_counter()
+        if self.pwr._pwr_discharge_mode == 'feedback':
+            if target is None:
+                target = self.pwr._voltage_min
+            if tolerance is None:
+                tolerance = self.pwr._pwr_discharge_tolerance
+            since = t0
+            while time.perf_counter() - t0 < latency:
+                since = self.pwr._retrieve_voltage(since=since)
+                if since is None:  # voltage cannot be read, falls back to a fixed discharge
+                    break
+                if self.pwr._voltage <= target + tolerance:
+                    discharge_time = time.perf_counter() - t0
+                    self.exec_logger.debug(f'Pwr discharged to {self.pwr._voltage:.2f} V in {discharge_time:.3f} s')
+                    return discharge_time
+            else:
+                self.exec_logger.debug(f'Pwr voltage still at {self.pwr._voltage:.2f} V after {latency} s of discharge'
+                                       f' (target: {target:.2f} V)')
+                return time.perf_counter() - t0
+        time.sleep(max(0., latency - (time.perf_counter() - t0)))
+        return time.perf_counter() - t0
+
+    def discharge_pwr(self, latency=None, target=None, tolerance=None):
+        """Discharges the pwr (see _wait_discharge). The discharge only stops at target in 'feedback' discharge mode.
+
+        Returns
+        -------
+        float
+            Actual discharge duration [s]
+        """
+        discharge_time = 0.
         if self.pwr.voltage_adjustable:
             if latency is None:
                 latency = self.pwr._pwr_discharge_latency
             self.exec_logger.debug(f'Pwr discharge initiated for {latency} s')
 
-            time.sleep(latency)
+            discharge_time = self._wait_discharge(latency, target=target, tolerance=tolerance)
 
         else:
             self.exec_logger.debug(f'Pwr discharge not supported by {self.pwr.model}')
+        return discharge_time
 
     @property
     def polarity(self):
@@ -552,6 +690,19 @@ class TxAbstract(ABC):
     def reset_gain(self):
         self.gain = 1.
 
+    def gain_for(self, current, margin=0.):
+        """Returns the gain that gain_auto would set for an expected current (as read by self.current), with a
+        relative margin, or None if it cannot be predicted
+
+        Parameters
+        ----------
+        current: float
+            expected peak current
+        margin: float, optional
+            relative margin on the expected current
+        """
+        return None
+
 
 class RxAbstract(ABC):
     """RXAbstract Class
@@ -575,9 +726,15 @@ class RxAbstract(ABC):
         self._latency = kwargs['latency']
         self._bias = kwargs['bias']
         self._vmn_hardware_offset = kwargs['vmn_hardware_offset']
+        self._n_channels = kwargs['n_channels']
         self.connect = kwargs['connect']
         self.specs = kwargs
 
+    @property
+    def n_channels(self):
+        """ Gets the number of MN channels read by the Rx """
+        return self._n_channels
+
     @property
     def bias(self):
         """ Gets the RX bias """
@@ -623,6 +780,19 @@ class RxAbstract(ABC):
     def reset_gain(self):
         self.gain = 1.
 
+    def gain_for(self, voltage, margin=0.):
+        """Returns the gain that gain_auto would set for an expected voltage (as read by self.voltage), with a
+        relative margin, or None if it cannot be predicted
+
+        Parameters
+        ----------
+        voltage: float
+            expected peak voltage
+        margin: float, optional
+            relative margin on the expected voltage
+        """
+        return None
+
     @property
     def sampling_rate(self):
         return self._sampling_rate
@@ -648,3 +818,8 @@ class RxAbstract(ABC):
     def voltage(self):
         """ Gets the voltage VMN in Volts """
         pass
+
+    @property
+    def voltages(self):
+        """ Gets the voltage VMN of each channel, the first channel being the one read by self.voltage """
+        return (self.voltage,)
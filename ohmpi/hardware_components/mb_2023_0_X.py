@@ -1,4 +1,3 @@
-import datetime
 import adafruit_ads1x15.ads1115 as ads  # noqa
 from adafruit_ads1x15.analog_in import AnalogIn  # noqa
 from adafruit_ads1x15.ads1x15 import Mode  # noqa
@@ -11,6 +10,7 @@ import os
 import numpy as np
 from ohmpi.hardware_components import TxAbstract, RxAbstract
 from ohmpi.utils import enforce_specs
+from ohmpi.tracing import tracer
 from ohmpi.tests import test_i2c_devices_on_bus
 
 # hardware characteristics and limitations
@@ -41,6 +41,9 @@ SPECS = {'rx': {'model': {'default': os.path.basename(__file__).rstrip('.py')},
 
 # TODO: move low_battery spec in pwr
 
+# Full scale range of the ADS1115 in V for each gain
+_ADS1115_PGA_RANGE = {2 / 3: 6.144, 1: 4.096, 2: 2.048, 4: 1.024, 8: 0.512, 16: 0.256}
+
 
 def _ads_1115_gain_auto(channel):  # Make it a class method ?
     """Automatically sets the gain on a channel
@@ -68,6 +71,89 @@ def _ads_1115_gain_auto(channel):  # Make it a class method ?
     return gain
 
 
+def _ads_1115_gain_for(voltage, margin=0.):
+    """Returns the gain _ads_1115_gain_auto would select for a voltage, with a relative margin
+
+    Parameters
+    ----------
+    voltage : float
+        Expected voltage on the ADS1115 input [V].
+    margin : float, optional
+        Relative margin on the voltage.
+
+    Returns
+    -------
+    gain : float, None
+        Gain to be applied on ADS1115, None if the voltage is out of the full scale range.
+    """
+    voltage = abs(voltage) * (1. + margin)
+    for gain in [16, 8, 4, 2, 2 / 3]:
+        if voltage < _ADS1115_PGA_RANGE[gain]:
+            return gain
+    return None
+
+
+class Ads1115Channel:
+    """Cached ADS1115 channel.
+    In continuous mode, reads the conversion register directly and converts raw counts to mV with a factor
+    precomputed for the gain. The ADS1115 configuration is only written when gain, data rate or mode change.
+
+    Parameters
+    ----------
+    connection: busio.I2C
+        I2C connection of the ADS1115
+    address: int
+        I2C address of the ADS1115
+    pins: tuple
+        Pin(s) of the channel, e.g. (ads.P0,) or (ads.P0, ads.P1) for a differential channel
+    """
+    def __init__(self, connection, address, pins=(ads.P0,)):
+        self._connection = connection
+        self._address = address
+        self._pins = pins
+        self._settings = None
+        self._mv_per_count = 0.
+        self.ads = None
+        self.channel = None
+        self.armed = False  # True when the conversion register holds conversions of this channel
+
+    def configure(self, gain=2 / 3, data_rate=860, mode=Mode.CONTINUOUS):
+        """Configures the ADS1115 if gain, data rate or mode changed. Returns True if the ADS1115 was configured"""
+        if self.ads is not None and self._settings == (gain, data_rate, mode):
+            return False
+        self.ads = ads.ADS1115(self._connection, gain=gain, data_rate=data_rate, address=self._address)
+        self.ads.mode = mode
+        self.channel = AnalogIn(self.ads, *self._pins)
+        self._mv_per_count = _ADS1115_PGA_RANGE[gain] * 1000. / 32767
+        self._settings = (gain, data_rate, mode)
+        self.armed = False
+        return True
+
+    def share(self, channel):
+        """Reads this channel with the ADS1115 instance (and settings) of another channel of the same ADS1115.
+        Channels sharing an ADS1115 should be disarmed before being read in turn, so that the mux is switched."""
+        self.ads = channel.ads
+        self.channel = AnalogIn(self.ads, *self._pins)
+        self._mv_per_count = channel._mv_per_count
+        self._settings = channel._settings
+        self.armed = False
+
+    @property
+    def raw(self):
+        """Gets the last conversion in counts"""
+        if self.armed and self.ads.mode == Mode.CONTINUOUS:
+            value = self.ads.get_last_result(True)
+            return value - 0x10000 if value & 0x8000 else value
+        value = self.channel.value  # writes the config (mux) and reads a first conversion
+        self.armed = True
+        return value
+
+    @property
+    def voltage(self):
+        """Gets the channel voltage in mV"""
+        return self.raw * self._mv_per_count
+
+
 class Tx(TxAbstract):
     """Tx Class
         """
@@ -80,7 +166,7 @@ class Tx(TxAbstract):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\ttx_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'tx_init')
         assert isinstance(self.connection, I2C)
         kwargs.update({'pwr': kwargs.pop('pwr', SPECS['tx']['compatible_power_sources']['default'][0])})
         if kwargs['pwr'] not in SPECS['tx']['compatible_power_sources']['default']:
@@ -112,11 +198,11 @@ class Tx(TxAbstract):
         self._ads_current_address = kwargs['ads_address']
         self._ads_current_data_rate = kwargs['data_rate']
         self._adc_gain = 2 / 3
+        self._adc_current = Ads1115Channel(self.connection, self._ads_current_address, pins=(ads.P0,))
         if test_i2c_devices_on_bus(self._ads_current_address, self.connection):
             if self.connect:
                 try:
                     self.reset_ads()
-                    self._ads_current.mode = Mode.CONTINUOUS
                     self.soh_logger.info(colored(
                         f'TX: ADS1115 current ({hex(self._ads_current_address)}) found on I2C bus...OK', 'green'))
                 except Exception as e:
@@ -141,7 +227,7 @@ class Tx(TxAbstract):
             self.gain = 2 / 3
 
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\ttx_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'tx_init')
 
     @property
     def gain(self):
@@ -151,18 +237,15 @@ class Tx(TxAbstract):
     def gain(self, value):
         assert value in [2/3, 2, 4, 8, 16]
         self._adc_gain = value
-        self._ads_current = ads.ADS1115(self.connection, gain=self._adc_gain,
-                                        data_rate=SPECS['tx']['data_rate']['default'],
-                                        address=self._ads_current_address)
-        self._ads_current.mode = Mode.CONTINUOUS
-        self.exec_logger.debug(f'Setting TX ADC gain to {value}')
+        if self._adc_current.configure(gain=self._adc_gain, data_rate=SPECS['tx']['data_rate']['default']):
+            self.exec_logger.debug(f'Setting TX ADC gain to {value}')
 
     def _adc_gain_auto(self):
-        self.exec_logger.event(f'{self.model}\ttx_adc_auto_gain\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
-        gain = _ads_1115_gain_auto(AnalogIn(self._ads_current, ads.P0))
+        tracer.begin(self.model, 'tx_adc_auto_gain')
+        gain = _ads_1115_gain_auto(self._adc_current.channel)
         self.exec_logger.debug(f'Setting TX ADC gain automatically to {gain}')
         self.gain = gain
-        self.exec_logger.event(f'{self.model}\ttx_adc_auto_gain\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end(self.model, 'tx_adc_auto_gain')
 
     def current_pulse(self, **kwargs):
         TxAbstract.current_pulse(self, **kwargs)
@@ -172,7 +255,7 @@ class Tx(TxAbstract):
     def current(self):
         """ Gets the current IAB in Amps
         """
-        iab = AnalogIn(self._ads_current, ads.P0).voltage * 1000. / (50 * self._r_shunt)  # measure current
+        iab = self._adc_current.voltage / (50 * self._r_shunt)  # measure current
         self.exec_logger.debug(f'Reading TX current: {iab} mA')
         return iab
 
@@ -184,6 +267,9 @@ class Tx(TxAbstract):
     def gain_auto(self):
         self._adc_gain_auto()
 
+    def gain_for(self, current, margin=0.):
+        return _ads_1115_gain_for(current * 50 * self._r_shunt / 1000., margin=margin)  # current in mA
+
     def inject(self, polarity=1, injection_duration=None, switch_pwr=False):
         self.polarity = polarity
         TxAbstract.inject(self, polarity=polarity, injection_duration=injection_duration, switch_pwr=switch_pwr)
@@ -217,10 +303,13 @@ class Tx(TxAbstract):
     # def turn_on(self):
     #     self.pwr.turn_on(self)
 
+    @property
+    def _ads_current(self):
+        return self._adc_current.ads
+
     def reset_ads(self, mode=Mode.CONTINUOUS):
-        self._ads_current = ads.ADS1115(self.connection, gain=self._adc_gain, data_rate=self._ads_current_data_rate,
-                                    address=self._ads_current_address)
-        self._ads_current.mode = mode
+        self._adc_current.ads = None  # forces configuration
+        self._adc_current.configure(gain=self._adc_gain, data_rate=self._ads_current_data_rate, mode=mode)
 
     def reset_gain(self):
         self.exec_logger.debug('resetting tx gain to 2/3')
@@ -250,7 +339,7 @@ class Tx(TxAbstract):
         polarity: 1,0,-1
             Polarity of the pulse
         """
-        self.exec_logger.event(f'{self.model}\ttx_voltage_pulse\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin(self.model, 'tx_voltage_pulse')
         # self.exec_logger.info(f'injection_duration: {length}')  # TODO: delete me
         if length is None:
             length = self.injection_duration
@@ -258,7 +347,7 @@ class Tx(TxAbstract):
             self.pwr.voltage = voltage
         self.exec_logger.debug(f'Voltage pulse of {polarity*self.pwr.voltage:.3f} V for {length:.3f} s')
         self.inject(polarity=polarity, injection_duration=length)
-        self.exec_logger.event(f'{self.model}\ttx_voltage_pulse\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end(self.model, 'tx_voltage_pulse')
 
     def test_ads(self, nsample=100, channel=0):
         samples = []
@@ -270,6 +359,7 @@ class Tx(TxAbstract):
         }
         for i in range(nsample):
             samples.append(AnalogIn(self._ads_current, pindic[channel]).voltage)
+        self._adc_current.armed = False  # the ADS1115 mux may have changed
         std = np.std(samples)
         ok = bool(std < 1)
         res = {
@@ -296,6 +386,9 @@ class Tx(TxAbstract):
 
 class Rx(RxAbstract):
     """RX class"""
+    _adc_voltage_pins = (ads.P0, ads.P1)  # differential channel used to measure vmn
+    _adc_extra_voltage_pins = [(ads.P2, ads.P3)]  # spare differential channel(s) used to measure other MN dipoles
+
     def __init__(self, **kwargs):
         if 'model' not in kwargs.keys():
             for key in SPECS['rx'].keys():
@@ -305,13 +398,21 @@ class Rx(RxAbstract):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\trx_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'rx_init')
         assert isinstance(self.connection, I2C)
 
         # ADS1115 for voltage measurement (MN)
         self._ads_voltage_address = kwargs['ads_address']
         self._ads_voltage_data_rate = kwargs['data_rate']
         self._adc_gain = 2/3
+        self._adc_voltage = Ads1115Channel(self.connection, self._ads_voltage_address, pins=self._adc_voltage_pins)
+        if self._n_channels > 1 + len(self._adc_extra_voltage_pins):
+            self.exec_logger.warning(f'{self.model} can read up to {1 + len(self._adc_extra_voltage_pins)} MN '
+                                     f'channel(s), ignoring the other ones.')
+            self._n_channels = 1 + len(self._adc_extra_voltage_pins)
+        self._adc_voltages = [self._adc_voltage] + [
+            Ads1115Channel(self.connection, self._ads_voltage_address, pins=pins)
+            for pins in self._adc_extra_voltage_pins[:self._n_channels - 1]]
         if test_i2c_devices_on_bus(self._ads_voltage_address, self.connection):
             if self.connect:
                 try:
@@ -330,7 +431,7 @@ class Rx(RxAbstract):
         self._sampling_rate = kwargs['sampling_rate']
         self._bias = kwargs['bias']
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\trx_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'rx_init')
 
     @property
     def gain(self):  # TODO: should be in abstract_hardware_components
@@ -340,40 +441,63 @@ class Rx(RxAbstract):
     def gain(self, value):
         assert value in [2/3, 2, 4, 8, 16]
         self._adc_gain = value
-        self._ads_voltage = ads.ADS1115(self.connection, gain=self._adc_gain,
-                                        data_rate=SPECS['rx']['data_rate']['default'],
-                                        address=self._ads_voltage_address)
-        self._ads_voltage.mode = Mode.CONTINUOUS
-        self.exec_logger.debug(f'Setting RX ADC gain to {value}')
+        if self._adc_voltage.configure(gain=self._adc_gain, data_rate=SPECS['rx']['data_rate']['default']):
+            self._share_adc_voltage()
+            self.exec_logger.debug(f'Setting RX ADC gain to {value}')
 
     def _adc_gain_auto(self):
-        self.exec_logger.event(f'{self.model}\trx_adc_auto_gain\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
-        gain = _ads_1115_gain_auto(AnalogIn(self._ads_voltage, ads.P0, ads.P1))
+        tracer.begin(self.model, 'rx_adc_auto_gain')
+        gain = _ads_1115_gain_auto(self._adc_voltage.channel)
         self.exec_logger.debug(f'Setting RX ADC gain automatically to {gain}')
         self._adc_gain = gain
-        self.exec_logger.event(f'{self.model}\trx_adc_auto_gain\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end(self.model, 'rx_adc_auto_gain')
 
     def gain_auto(self):
         self._adc_gain_auto()
 
+    def gain_for(self, voltage, margin=0.):
+        return _ads_1115_gain_for((abs(voltage) + abs(self.bias)) / self._coef_p2 / 1000., margin=margin)  # in mV
+
     def reset_gain(self):
         self.exec_logger.debug('resetting rx gain to 2/3')
         self.gain = 2/3
 
+    @property
+    def _ads_voltage(self):
+        return self._adc_voltage.ads
+
     def reset_ads(self, mode=Mode.CONTINUOUS):
-        self._ads_voltage = ads.ADS1115(self.connection, gain=self._adc_gain, data_rate=self._ads_voltage_data_rate,
-                                    address=self._ads_voltage_address)
-        self._ads_voltage.mode = mode
+        self._adc_voltage.ads = None  # forces configuration
+        self._adc_voltage.configure(gain=self._adc_gain, data_rate=self._ads_voltage_data_rate, mode=mode)
+        self._share_adc_voltage()
+
+    def _share_adc_voltage(self):
+        for channel in self._adc_voltages[1:]:  # NOTE: all channels are read with the gain of the first one
+            channel.share(self._adc_voltage)
 
     @property
     def voltage(self):
         """ Gets the voltage VMN in Volts
         """
-        self.exec_logger.event(f'{self.model}\trx_voltage\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
-        u = AnalogIn(self._ads_voltage, ads.P0, ads.P1).voltage * self._coef_p2 * 1000. - self.bias  # TODO: check if it should be negated
-        self.exec_logger.event(f'{self.model}\trx_voltage\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin(self.model, 'rx_voltage')
+        u = self._adc_voltage.voltage * self._coef_p2 - self.bias  # TODO: check if it should be negated
+        tracer.end(self.model, 'rx_voltage')
         return u
 
+    @property
+    def voltages(self):
+        """ Gets the voltage VMN of each channel in mV
+        """
+        if len(self._adc_voltages) == 1:
+            return (self.voltage,)
+        tracer.begin(self.model, 'rx_voltages')
+        u = []
+        for channel in self._adc_voltages:
+            channel.armed = False  # the ADS1115 mux is switched to each channel in turn
+            u.append(channel.voltage * self._coef_p2 - self.bias)
+        tracer.end(self.model, 'rx_voltages')
+        return tuple(u)
+
     def test_ads(self, nsample=100, channel=0):
         samples = []
         pindic = {
@@ -384,6 +508,7 @@ class Rx(RxAbstract):
         }
         for i in range(nsample):
             samples.append(AnalogIn(self._ads_voltage, pindic[channel]).voltage)
+        self._adc_voltage.armed = False  # the ADS1115 mux may have changed
         std = np.std(samples)
         res = {
             'name': 'test_ads_voltage_' + str(channel),
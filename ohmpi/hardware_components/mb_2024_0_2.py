@@ -1,4 +1,3 @@
-import datetime
 import adafruit_ads1x15.ads1115 as ads  # noqa
 from adafruit_ads1x15.analog_in import AnalogIn  # noqa
 from adafruit_ads1x15.ads1x15 import Mode  # noqa
@@ -9,6 +8,7 @@ import os
 import time
 from termcolor import colored
 from ohmpi.utils import enforce_specs
+from ohmpi.tracing import tracer
 from ohmpi.hardware_components.mb_2023_0_X import Tx as Tx_mb_2023
 from ohmpi.hardware_components.mb_2023_0_X import Rx as Rx_mb_2023
 from ohmpi.tests import test_i2c_devices_on_bus
@@ -81,7 +81,7 @@ class Tx(Tx_mb_2023):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\ttx_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'tx_init')
 
         # Initialize LEDs
         if self.connect:
@@ -104,7 +104,7 @@ class Tx(Tx_mb_2023):
             self.pin3.value = False
 
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\ttx_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'tx_init')
 
     @property
     def measuring(self):
@@ -124,6 +124,12 @@ class Tx(Tx_mb_2023):
         Tx_mb_2023.inject(self, polarity=polarity, injection_duration=injection_duration)
         self.pin6.value = False
 
+    def inject_program(self, durations, polarities, on_segment=None):
+        self.pin6.value = True
+        jitter = Tx_mb_2023.inject_program(self, durations, polarities, on_segment=on_segment)
+        self.pin6.value = False
+        return jitter
+
     @property
     def pwr_state(self):
         return self._pwr_state
@@ -138,7 +144,7 @@ class Tx(Tx_mb_2023):
                 'on', 'off'
             """
         if state == 'on':
-            self.exec_logger.event(f'{self.model}\ttx_pwr_state_on\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'tx_pwr_state_on')
             self.pin2.value = True
             self.pin3.value = True
             self.exec_logger.debug(f'Switching DPH on')
@@ -146,7 +152,7 @@ class Tx(Tx_mb_2023):
             time.sleep(self.pwr._pwr_latency) # from pwr specs
             self.pwr.pwr_state = 'off'
             self.pwr.reload_settings()
-            self.exec_logger.event(f'{self.model}\ttx_pwr_state_on\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'tx_pwr_state_on')
             self.pwr.battery_voltage()
             if self.pwr.voltage_adjustable:
                 if self.pwr._battery_voltage < 11.8:
@@ -155,13 +161,13 @@ class Tx(Tx_mb_2023):
                     self.exec_logger.info(f'TX Battery voltage from {self.pwr.model} = {self.pwr._battery_voltage} V')
 
         elif state == 'off':
-            self.exec_logger.event(f'{self.model}\ttx_pwr_state_off\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'tx_pwr_state_off')
             self.pwr.pwr_state = 'off'
             self.pin2.value = False
             self.pin3.value = False
             self.exec_logger.debug(f'Switching DPH off')
             self._pwr_state = 'off'
-            self.exec_logger.event(f'{self.model}\ttx_pwr_state_off\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'tx_pwr_state_off')
 
     def current_pulse(self, current=None, length=None, polarity=1):
         """ Generates a square current pulse. Currently no DPS can handle this...
@@ -175,7 +181,7 @@ class Tx(Tx_mb_2023):
         polarity: 1,0,-1
             Polarity of the pulse.
         """
-        self.exec_logger.event(f'{self.model}\ttx_current_pulse\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin(self.model, 'tx_current_pulse')
         # self.exec_logger.info(f'injection_duration: {length}')  # TODO: delete me
         if length is None:
             length = self.injection_duration
@@ -183,7 +189,7 @@ class Tx(Tx_mb_2023):
             self.pwr.current = current
         self.exec_logger.debug(f'Current pulse of {polarity*self.pwr.current:.3f} V for {length:.3f} s')
         self.inject(polarity=polarity, injection_duration=length)
-        self.exec_logger.event(f'{self.model}\ttx_current_pulse\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end(self.model, 'tx_current_pulse')
 
     @property
     def polarity(self):
@@ -258,9 +264,9 @@ class Tx(Tx_mb_2023):
 
             # measure
             r_shunt_computeds = []
+            since = None
             for i in range(10):
-                self.pwr._retrieve_current()  # needed otherwise it's set value
-                self.pwr._retrieve_voltage()
+                since = self.pwr._retrieve_telemetry(since=since)  # needed otherwise it's set value
                 vab = self.pwr.voltage
                 current_expected = self.pwr.current/1000
                 current_observed = self.current/1000
@@ -307,6 +313,9 @@ class Tx(Tx_mb_2023):
 
 class Rx(Rx_mb_2023):
     """RX Class"""
+    _adc_voltage_pins = (ads.P0,)
+    _adc_extra_voltage_pins = []  # vmn offset and DG411 gain are only wired on P0
+
     def __init__(self, **kwargs):
         if 'model' not in kwargs.keys():
             for key in SPECS['rx'].keys():
@@ -316,7 +325,7 @@ class Rx(Rx_mb_2023):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\trx_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'rx_init')
         # I2C connection to MCP23008, for voltage
         self._mcp_address = kwargs['mcp_address']
         if test_i2c_devices_on_bus(self._mcp_address, self.connection):
@@ -353,14 +362,14 @@ class Rx(Rx_mb_2023):
             self.gain = self._adc_gain * self._dg411_gain_ratio  # 1/3 by default since self._adc_gain is equal to 2/3 and self._dg411_gain_ratio to 1/2 by default
 
         if not subclass_init:  # TODO: try to only log this event and not the one created by super()
-            self.exec_logger.event(f'{self.model}\trx_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'rx_init')
 
     def _adc_gain_auto(self):
-        self.exec_logger.event(f'{self.model}\trx_adc_auto_gain\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
-        gain = _ads_1115_gain_auto(AnalogIn(self._ads_voltage, ads.P0))
+        tracer.begin(self.model, 'rx_adc_auto_gain')
+        gain = _ads_1115_gain_auto(self._adc_voltage.channel)
         self.exec_logger.debug(f'Setting RX ADC gain automatically to {gain}')
         self._adc_gain = gain
-        self.exec_logger.event(f'{self.model}\trx_adc_auto_gain\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end(self.model, 'rx_adc_auto_gain')
 
     def _dg411_gain_auto(self):
         if -0.8 * self._vmn_hardware_offset < self.voltage + self.bias < 0.8 * self._vmn_hardware_offset:
@@ -388,6 +397,11 @@ class Rx(Rx_mb_2023):
         self._dg411_gain_auto()
         self.exec_logger.debug(f'Setting RX gain automatically to {self.gain}')
 
+    def gain_for(self, voltage, margin=0.):
+        if (abs(voltage) + abs(self.bias)) * (1. + margin) < 0.8 * self._vmn_hardware_offset:  # see _dg411_gain_auto
+            return self._adc_gain
+        return self._adc_gain * self._dg411_gain_ratio
+
     def reset_gain(self):
         self.gain = self._adc_gain * self._dg411_gain_ratio  # 1/3 by default since self._adc_gain is equal to 2/3 and self._dg411_gain_ratio to 1/2 by default
 
@@ -398,9 +412,9 @@ class Rx(Rx_mb_2023):
     def voltage(self):
         """ Gets the voltage VMN in Volts
         """
-        self.exec_logger.event(f'{self.model}\trx_voltage\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
-        u = (AnalogIn(self._ads_voltage, ads.P0).voltage * self._coef_p2 * 1000. - self._vmn_hardware_offset) / self._dg411_gain - self.bias  # TODO: check how to handle bias and _vmn_hardware_offset
-        self.exec_logger.event(f'{self.model}\trx_voltage\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin(self.model, 'rx_voltage')
+        u = (self._adc_voltage.voltage * self._coef_p2 - self._vmn_hardware_offset) / self._dg411_gain - self.bias  # TODO: check how to handle bias and _vmn_hardware_offset
+        tracer.end(self.model, 'rx_voltage')
         return u
 
     def test_ads(self, nsample=100, channel=0):
@@ -415,6 +429,7 @@ class Rx(Rx_mb_2023):
         }
         for i in range(nsample):
             samples.append(AnalogIn(self._ads_voltage, pindic[channel]).voltage)
+        self._adc_voltage.armed = False  # the ADS1115 mux may have changed
         std = np.std(samples)
         avg = np.mean(samples)
         ok = False
@@ -1,4 +1,3 @@
-import datetime
 import adafruit_ads1x15.ads1115 as ads  # noqa
 from adafruit_ads1x15.analog_in import AnalogIn  # noqa
 from adafruit_ads1x15.ads1x15 import Mode  # noqa
@@ -8,6 +7,7 @@ from busio import I2C  # noqa
 import os
 import time
 from ohmpi.utils import enforce_specs
+from ohmpi.tracing import tracer
 from ohmpi.hardware_components.mb_2024_0_2 import Tx as Tx_mb_2024_0_2
 from ohmpi.hardware_components.mb_2024_0_2 import Rx as Rx_mb_2024_0_2
 
@@ -78,7 +78,7 @@ class Tx(Tx_mb_2024_0_2):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\ttx_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'tx_init')
 
         if self.connect:
             self.pin5 = self.mcp_board.get_pin(5)  # power_discharge_relay
@@ -86,7 +86,7 @@ class Tx(Tx_mb_2024_0_2):
             self.pin5.value = False
 
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\ttx_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'tx_init')
 
     @property
     def measuring(self):
@@ -96,24 +96,25 @@ class Tx(Tx_mb_2024_0_2):
     def measuring(self, mode="off"):
         self._measuring = mode
 
-    def discharge_pwr(self, latency=None):
+    def discharge_pwr(self, latency=None, target=None, tolerance=None):
+        discharge_time = 0.
         if self.pwr.voltage_adjustable:
             if latency is None:
                 latency = self.pwr._pwr_discharge_latency
             self.exec_logger.debug(f'Pwr discharge initiated for {latency} s')
 
-            self.exec_logger.event(f'{self.model}\tpwr_discharge\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'pwr_discharge')
             self.pin5.value = True
             time.sleep(self._activation_delay)
-
-            time.sleep(latency)
-
-            if self.pwr.voltage_adjustable:
+            try:
+                discharge_time = self._wait_discharge(latency, target=target, tolerance=tolerance)
+            finally:
                 self.pin5.value = False
                 time.sleep(self._release_delay)
-            self.exec_logger.event(f'{self.model}\tpwr_discharge\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'pwr_discharge')
         else:
             self.exec_logger.debug(f'Pwr discharge not supported by {self.pwr.model}')
+        return discharge_time
 
 
 class Rx(Rx_mb_2024_0_2):
@@ -127,7 +128,7 @@ class Rx(Rx_mb_2024_0_2):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\trx_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'rx_init')
 
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\trx_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'rx_init')
@@ -0,0 +1,62 @@
+class Mcp23017Port:
+    """Mcp23017Port class.
+    Keeps a shadow copy of the IODIR and GPIO (GPIOA/GPIOB) registers of an MCP23017 so that relays can be switched
+    with a single 16-bit port write instead of a read-modify-write of IODIR and GPIO per pin.
+    Pin directions are set once when the port is created: output latches are cleared first, then pins are turned into
+    outputs so that all relays are off.
+
+    Parameters
+    ----------
+    mcp: MCP23017
+        MCP23017 instance (adafruit_mcp230xx)
+    outputs: int, optional
+        Bit mask of the pins used as outputs
+    """
+    def __init__(self, mcp, outputs=0xFFFF):
+        self.mcp = mcp
+        self.mcp.gpio = 0x0000  # clears the output latches before enabling the outputs
+        self.gpio = 0x0000
+        self.iodir = ~outputs & 0xFFFF
+        self.mcp.iodir = self.iodir
+
+    @staticmethod
+    def mask(pins):
+        """Returns the bit mask of a list of pins"""
+        mask = 0
+        for pin in pins:
+            mask |= 1 << pin
+        return mask
+
+    def write(self, value, force=False):
+        """Writes the GPIO port if its value differs from the shadow copy
+
+        Parameters
+        ----------
+        value: int
+            16-bit value of the GPIO port (GPIOA on the low byte, GPIOB on the high byte)
+        force: bool, optional
+            Writes the port even if its value equals the shadow copy
+
+        Returns
+        -------
+        bool
+            True if the port was written
+        """
+        value &= 0xFFFF
+        if value == self.gpio and not force:
+            return False
+        self.mcp.gpio = value
+        self.gpio = value  # NOTE: shadow only updated once the write succeeded
+        return True
+
+    def set(self, pins, value=True):
+        """Sets a list of pins high (value=True) or low (value=False) with a single port write"""
+        mask = self.mask(pins)
+        if value:
+            return self.write(self.gpio | mask)
+        else:
+            return self.write(self.gpio & ~mask)
+
+    def clear(self, force=False):
+        """Sets all pins low"""
+        return self.write(0x0000, force=force)
@@ -1,12 +1,12 @@
 import os
 import numpy as np
-import datetime
 from ohmpi.hardware_components import MuxAbstract
-import adafruit_tca9548a  # noqa
+from ohmpi.hardware_components.mcp23017_port import Mcp23017Port
+from ohmpi.hardware_components.tca9548a_cache import get_tca
 from adafruit_mcp230xx.mcp23017 import MCP23017  # noqa
-from digitalio import Direction  # noqa
 from busio import I2C  # noqa
 from ohmpi.utils import enforce_specs
+from ohmpi.tracing import tracer
 from termcolor import colored
 
 # TODO: manage the case when a tca is added to handle more mux_2023 boards
@@ -72,7 +72,7 @@ class Mux(MuxAbstract):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}: {self.board_id}\tmux_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(f'{self.model}: {self.board_id}', 'mux_init')
 
         self._connection = kwargs['connection']
         self.connection = None
@@ -116,8 +116,10 @@ class Mux(MuxAbstract):
         self._i2c_ext_tca_channel = kwargs['i2c_ext_tca_channel']
         self._mcp_addresses = ['0x20'] * 4  # TODO: add assert on valid addresses..
         self._i2c_ext_tca = None
+        self._tca_mux = None  # TCA9548A remembering its selected channel
         self._tca = None
         self._mcp = [None, None, None, None]
+        self._port = [None, None, None, None]  # shadowed GPIO ports of the MCPs
         if self.connect:
             try:
                 self.reset_i2c_ext_tca()
@@ -134,7 +136,7 @@ class Mux(MuxAbstract):
             self._get_addresses()
         self.exec_logger.debug(f'{self.board_id} addresses: {self.addresses}')
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}: {self.board_id}\tmux_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(f'{self.model}: {self.board_id}', 'mux_init')
 
     def _get_addresses(self):
         """ Converts inner cabling addressing into (electrodes, role) addressing """
@@ -151,6 +153,7 @@ class Mux(MuxAbstract):
             self.reset_tca()
         try:
             self._mcp[0] = MCP23017(self._tca[0])
+            self._port[0] = Mcp23017Port(self._mcp[0])
             self.soh_logger.info(colored(
                 f'MUX: MCP23017 ({self._mcp_addresses[0]}) I2C0...OK', 'green'))
         except Exception as e:
@@ -158,6 +161,7 @@ class Mux(MuxAbstract):
                 f'MUX: MCP23017 ({self._mcp_addresses[0]}) I2C0...NOT FOUND', 'red'))
         try:
             self._mcp[1] = MCP23017(self._tca[1])
+            self._port[1] = Mcp23017Port(self._mcp[1])
             self.soh_logger.info(colored(
                 f'MUX: MCP23017 ({self._mcp_addresses[1]}) I2C1...OK', 'green'))
         except Exception as e:
@@ -165,6 +169,7 @@ class Mux(MuxAbstract):
                 f'MUX: MCP23017 ({self._mcp_addresses[1]}) I2C1...NOT FOUND', 'red'))
         try:
             self._mcp[2] = MCP23017(self._tca[2])
+            self._port[2] = Mcp23017Port(self._mcp[2])
             self.soh_logger.info(colored(
                 f'MUX: MCP23017 ({self._mcp_addresses[2]}) I2C2...OK', 'green'))
         except Exception as e:
@@ -172,36 +177,72 @@ class Mux(MuxAbstract):
                 f'MUX: MCP23017 ({self._mcp_addresses[2]}) I2C2...NOT FOUND', 'red'))
         try:
             self._mcp[3] = MCP23017(self._tca[3])
+            self._port[3] = Mcp23017Port(self._mcp[3])
             self.soh_logger.info(colored(
                 f'MUX: MCP23017 ({self._mcp_addresses[3]}) I2C3...OK', 'green'))
         except Exception as e:
             self.soh_logger.info(colored(
                 f'MUX: MCP23017 ({self._mcp_addresses[3]}) I2C3...NOT FOUND', 'red'))
 
+    @property
+    def bus(self):
+        return self._connection
+
+    def fast_reset(self):
+        """Switches all relays off with one write of zeros to the GPIO output latches of each MCP.
+        MCPs are only re-instantiated (full reset) if they were not initialized or after an I2C error."""
+        try:
+            if self._tca_mux is None:
+                raise ValueError('TCA not initialized')
+            with self._tca_mux.batch():
+                for i in sorted(range(len(self._port)), key=lambda i: self._tca_channels[i]):
+                    if self._port[i] is None:
+                        raise ValueError(f'MCP {i} not initialized')
+                    self._port[i].clear(force=True)
+        except Exception as e:
+            self.exec_logger.warning(f'{self.board_id} fast reset failed ({e}), resetting MCPs...')
+            self.reset()
+
     def reset_one(self, which=0):
         self._mcp[which] = MCP23017(self._tca[which])
+        self._port[which] = Mcp23017Port(self._mcp[which])
 
     def reset_i2c_ext_tca(self):
         if self._i2c_ext_tca_address is None:
             self.connection = self._connection
         else:
-            self.connection = adafruit_tca9548a.TCA9548A(self._connection, self._i2c_ext_tca_address)[self._i2c_ext_tca_channel]
+            self.connection = get_tca(self._connection, self._i2c_ext_tca_address)[self._i2c_ext_tca_channel]
 
     def reset_tca(self):
         if self.connection is None:
             self.reset_i2c_ext_tca()
-        self._tca = [adafruit_tca9548a.TCA9548A(self.connection, self._tca_address)[tca_channel] for tca_channel in self._tca_channels]
+        self._tca_mux = get_tca(self.connection, self._tca_address)
+        self._tca = [self._tca_mux[tca_channel] for tca_channel in self._tca_channels]
 
     def switch_one(self, elec=None, role=None, state=None):
         MuxAbstract.switch_one(self, elec=elec, role=role, state=state)
-
-        def activate_relay(mcp, mcp_pin, value=True):
-            pin_enable = mcp.get_pin(mcp_pin)
-            pin_enable.direction = Direction.OUTPUT
-            pin_enable.value = value
-
         d = self.addresses[elec, role]
-        if state == 'on':
-            activate_relay(self._mcp[d['MCP']], d['MCP_GPIO'], True)
-        if state == 'off':
-            activate_relay(self._mcp[d['MCP']], d['MCP_GPIO'], False)
+        if state in ['on', 'off']:
+            self._port[d['MCP']].set([d['MCP_GPIO']], state == 'on')
+
+    def switch_many(self, relays, state=None):
+        """Switches a list of relays with one GPIO port write per MCP
+
+        Parameters
+        ----------
+        relays : list
+            List of (electrode, role) tuples.
+        state : str, optional
+            Either 'on' or 'off'.
+        """
+        self.exec_logger.debug(f'switching {state} {relays}')
+        if state not in ['on', 'off']:
+            return
+        pins = {}
+        for elec, role in relays:
+            d = self.addresses[elec, role]
+            pins.setdefault(d['MCP'], []).append(d['MCP_GPIO'])
+        # MCPs are written ordered by TCA channel, each channel being selected only once
+        with self._tca_mux.batch():
+            for mcp in sorted(pins.keys(), key=lambda i: self._tca_channels[i]):
+                self._port[mcp].set(pins[mcp], state == 'on')
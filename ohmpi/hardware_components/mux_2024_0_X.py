@@ -1,12 +1,12 @@
 import os
-import datetime
 import numpy as np
 from ohmpi.hardware_components import MuxAbstract
-import adafruit_tca9548a  # noqa
+from ohmpi.hardware_components.mcp23017_port import Mcp23017Port
+from ohmpi.hardware_components.tca9548a_cache import get_tca
 from adafruit_mcp230xx.mcp23017 import MCP23017  # noqa
-from digitalio import Direction  # noqa
 from busio import I2C  # noqa
 from ohmpi.utils import enforce_specs
+from ohmpi.tracing import tracer
 from termcolor import colored
 
 # hardware characteristics and limitations
@@ -69,7 +69,7 @@ class Mux(MuxAbstract):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}: {self.board_id}\tmux_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(f'{self.model}: {self.board_id}', 'mux_init')
         self._connection = kwargs['connection']
         self.connection = None
         assert isinstance(self._connection, I2C)
@@ -143,6 +143,7 @@ class Mux(MuxAbstract):
         for addr in self._mcp_addresses:
             assert addr in ['0x20', '0x21', '0x22', '0x23', '0x24', '0x25', '0x26', '0x27']
         self._mcp = [None, None]
+        self._port = [None, None]  # shadowed GPIO ports of the MCPs
         if self.connect:
             self.reset()
 
@@ -151,7 +152,7 @@ class Mux(MuxAbstract):
 
         self.exec_logger.debug(f'{self.board_id} addresses: {self.addresses}')
         if not subclass_init:  # TODO: try to only log this event and not the one created by super()
-            self.exec_logger.event(f'{self.model}: {self.board_id}\tmux_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(f'{self.model}: {self.board_id}', 'mux_init')
 
     def _get_addresses(self):
         """ Converts inner cabling addressing into (electrodes, role) addressing """
@@ -167,11 +168,13 @@ class Mux(MuxAbstract):
             self.reset_i2c_ext_tca()
         try:
             self._mcp[0] = MCP23017(self.connection, address=int(self._mcp_addresses[0], 16))
+            self._port[0] = Mcp23017Port(self._mcp[0])
             self.soh_logger.info(colored(f'MCP23017 ({self._mcp_addresses[0]})...OK', 'green'))
         except Exception as e:
             self.soh_logger.info(colored(f'MCP23017 ({self._mcp_addresses[0]})...NOT FOUND', 'red'))
         try:
             self._mcp[1] = MCP23017(self.connection, address=int(self._mcp_addresses[1], 16))
+            self._port[1] = Mcp23017Port(self._mcp[1])
             self.soh_logger.info(colored(f'MCP23017 ({self._mcp_addresses[1]})...OK', 'green'))
         except Exception as e:
             self.soh_logger.info(colored(f'MCP23017 ({self._mcp_addresses[1]})...NOT FOUND', 'red'))
@@ -180,25 +183,53 @@ class Mux(MuxAbstract):
         if self._i2c_ext_tca_address is None:
             self.connection = self._connection
         else:
-            self.connection = adafruit_tca9548a.TCA9548A(self._connection, self._i2c_ext_tca_address)[self._i2c_ext_tca_channel]
+            self.connection = get_tca(self._connection, self._i2c_ext_tca_address)[self._i2c_ext_tca_channel]
+
+    @property
+    def bus(self):
+        return self._connection
+
+    def fast_reset(self):
+        """Switches all relays off with one write of zeros to the GPIO output latches of each MCP.
+        MCPs are only re-instantiated (full reset) if they were not initialized or after an I2C error."""
+        try:
+            for i, port in enumerate(self._port):
+                if port is None:
+                    raise ValueError(f'MCP {i} not initialized')
+                port.clear(force=True)
+        except Exception as e:
+            self.exec_logger.warning(f'{self.board_id} fast reset failed ({e}), resetting MCPs...')
+            self.reset()
 
     def reset_one(self, which=0):
         self._mcp[which] = MCP23017(self.connection, address=int(self._mcp_addresses[which], 16))
+        self._port[which] = Mcp23017Port(self._mcp[which])
 
     def switch_one(self, elec=None, role=None, state=None):
         MuxAbstract.switch_one(self, elec=elec, role=role, state=state)
-        def activate_relay(mcp, mcp_pin, value=True):
-            pin_enable = mcp.get_pin(mcp_pin)
-            pin_enable.direction = Direction.OUTPUT
-            pin_enable.value = value
-
         d = self.addresses[elec, role]
-        if state == 'on':
-            activate_relay(self._mcp[d['MCP']], d['MCP_GPIO'], True)
-            # time.sleep(MUX_CONFIG['activation_delay'])  # NOTE: moved to MuxAbstract switch
-        if state == 'off':
-            activate_relay(self._mcp[d['MCP']], d['MCP_GPIO'], False)
-            # time.sleep(MUX_CONFIG['release_delay'])  # NOTE: moved to MuxAbstract switch
+        if state in ['on', 'off']:
+            self._port[d['MCP']].set([d['MCP_GPIO']], state == 'on')
+
+    def switch_many(self, relays, state=None):
+        """Switches a list of relays with one GPIO port write per MCP
+
+        Parameters
+        ----------
+        relays : list
+            List of (electrode, role) tuples.
+        state : str, optional
+            Either 'on' or 'off'.
+        """
+        self.exec_logger.debug(f'switching {state} {relays}')
+        if state not in ['on', 'off']:
+            return
+        pins = {}
+        for elec, role in relays:
+            d = self.addresses[elec, role]
+            pins.setdefault(d['MCP'], []).append(d['MCP_GPIO'])
+        for mcp, mcp_pins in pins.items():
+            self._port[mcp].set(mcp_pins, state == 'on')
 
     def _mcp_jumper_pos_to_addr(self):
         d = {'up': 0, 'down': 1}
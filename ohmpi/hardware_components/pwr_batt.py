@@ -1,8 +1,8 @@
 from ohmpi.hardware_components.abstract_hardware_components import PwrAbstract
 import numpy as np
-import datetime
 import os
 from ohmpi.utils import enforce_specs
+from ohmpi.tracing import tracer
 
 # hardware characteristics and limitations
 SPECS = {'model': {'default': os.path.basename(__file__).rstrip('.py')},
@@ -26,12 +26,12 @@ class Pwr(PwrAbstract):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\tpwr_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'pwr_init')
         self._voltage = kwargs['voltage']
         self._current = np.nan
         # self._state = 'on'
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\tpwr_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'pwr_init')
 
     @property
     def current(self):
@@ -1,10 +1,13 @@
 from ohmpi.hardware_components.abstract_hardware_components import PwrAbstract
 import numpy as np
-import datetime
 import os
 from termcolor import colored
 import time
+from collections import namedtuple
+from contextlib import contextmanager
+from threading import Condition, Event, RLock, Thread
 from ohmpi.utils import enforce_specs
+from ohmpi.tracing import tracer
 from minimalmodbus import Instrument  # noqa
 
 # hardware characteristics and limitations
@@ -19,11 +22,185 @@ SPECS = {'model': {'default': os.path.basename(__file__).rstrip('.py')},
          'current_adjustable': {'default': False},
          'voltage_adjustable': {'default': True},
          'pwr_latency': {'default': 6.},
-         'pwr_discharge_latency': {'default': 1.},
+         'pwr_discharge_latency': {'default': 1.},  # s - discharge duration, or timeout in 'feedback' discharge mode
+         # 'fixed' or 'feedback' (waits for the voltage to drop)
+         # NOTE: 'feedback' polls U-OUT once the output is disabled, which is yet to be validated on hardware
+         'pwr_discharge_mode': {'default': 'fixed'},
+         'pwr_discharge_tolerance': {'default': 1.},  # V - discharge stops when voltage <= target + tolerance
          'pwr_accuracy': {'default': 1},  # V
-         'interface_name': {'default': 'modbus'}
+         'interface_name': {'default': 'modbus'},
+         'telemetry_rate': {'default': 0.},  # Hz - rate of the background telemetry poller, 0 to disable it
+         'telemetry_max_age': {'default': 0.5},  # s - maximum age of telemetry values before waiting for new ones
          }
 
+TelemetrySample = namedtuple('TelemetrySample', ['time', 'voltage', 'current', 'power', 'input_voltage'])
+
+
+class RegisterCache:
+    """RegisterCache class.
+    Keeps the last written value of each holding register of a modbus instrument. Writes that would not change a
+    register are skipped, and within a batch, writes to contiguous registers are coalesced into one transaction.
+
+    Parameters
+    ----------
+    connection: minimalmodbus.Instrument
+        Modbus instrument
+    """
+    def __init__(self, connection, lock=None):
+        self.connection = connection
+        self._lock = lock if lock is not None else RLock()
+        self.registers = {}  # last written raw value by register address
+        self._pending = None  # raw values to write at the end of a batch
+        self.n_transactions = 0
+
+    def write(self, address, value, number_of_decimals=0):
+        """Writes a register, or stages the write within a batch"""
+        raw = int(float(value) * 10 ** number_of_decimals)  # same conversion as minimalmodbus.write_register
+        if self._pending is not None:
+            self._pending[address] = raw
+        else:
+            self._flush({address: raw})
+
+    @contextmanager
+    def batch(self):
+        """Context manager staging register writes and flushing them when leaving"""
+        if self._pending is not None:  # nested batch
+            yield self
+            return
+        self._pending = {}
+        try:
+            yield self
+            pending = self._pending
+        finally:
+            self._pending = None
+        self._flush(pending)
+
+    def invalidate(self, *addresses):
+        """Forgets the values of given registers (all registers if none is given), e.g. after a power cycle"""
+        if len(addresses) == 0:
+            self.registers = {}
+        for address in addresses:
+            self.registers.pop(address, None)
+
+    def _flush(self, raws):
+        changed = {a: r for a, r in raws.items() if self.registers.get(a) != r}
+        runs = []
+        for address in sorted(changed.keys()):
+            if len(runs) > 0 and address == runs[-1][-1] + 1:
+                runs[-1].append(address)
+            else:
+                runs.append([address])
+        for run in runs:
+            values = [changed[a] for a in run]
+            try:
+                with self._lock:
+                    if len(run) == 1:
+                        self.connection.write_register(run[0], values[0], 0)
+                    else:
+                        self.connection.write_registers(run[0], values)
+            except Exception:
+                for address in run:  # register values are unknown
+                    self.registers.pop(address, None)
+                raise
+            self.n_transactions += 1
+            self.registers.update(zip(run, values))
+
+
+class TelemetryPoller:
+    """TelemetryPoller class.
+    Background thread reading the output voltage, output current, output power and input voltage registers
+    (0x0002 to 0x0005) in one transaction at a given rate and publishing them as timestamped TelemetrySample.
+
+    Parameters
+    ----------
+    connection: minimalmodbus.Instrument
+        Modbus instrument
+    lock: threading.RLock
+        Lock serializing the accesses to the serial port
+    rate: float, optional
+        Polling rate [Hz]
+    max_age: float, optional
+        Maximum age [s] of a sample returned without waiting for a new one
+    exec_logger: logging.Logger, optional
+        Logger used to report read errors
+    """
+    def __init__(self, connection, lock, rate=10., max_age=0.5, exec_logger=None):
+        self.connection = connection
+        self._lock = lock
+        self.rate = rate
+        self.max_age = max_age
+        self.exec_logger = exec_logger
+        self.sample = None  # last TelemetrySample
+        self.n_errors = 0
+        self._condition = Condition()
+        self._stop = Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name='dph5005_telemetry', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        period = 1. / self.rate
+        deadline = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                with self._lock:
+                    raw = self.connection.read_registers(0x0002, 4)
+                sample = TelemetrySample(time.perf_counter(), raw[0] / 100., float(raw[1]), raw[2] / 100.,
+                                         raw[3] / 100.)  # current in mA, see Pwr._retrieve_current
+                with self._condition:
+                    self.sample = sample
+                    self._condition.notify_all()
+            except Exception as e:
+                self.n_errors += 1
+                if self.exec_logger is not None:
+                    self.exec_logger.debug(f'Telemetry read failed: {e}')
+            deadline = max(deadline + period, time.perf_counter())
+            self._stop.wait(deadline - time.perf_counter())
+
+    def get(self, since=None, timeout=None):
+        """Returns the last sample, waiting for a new one if it is older than max_age or than since
+
+        Parameters
+        ----------
+        since: float, optional
+            time.perf_counter() time after which the sample should have been read
+        timeout: float, optional
+            Maximum waiting time [s], defaults to max_age plus two polling periods
+
+        Returns
+        -------
+        TelemetrySample
+            Last sample or None if no valid sample was read before timeout
+        """
+        if timeout is None:
+            timeout = self.max_age + 2. / self.rate
+
+        def valid():
+            if self.sample is None:
+                return False
+            if since is not None:
+                return self.sample.time > since
+            return time.perf_counter() - self.sample.time <= self.max_age
+
+        with self._condition:
+            if self._condition.wait_for(valid, timeout):
+                return self.sample
+        return None
+
 
 class Pwr(PwrAbstract):
     def __init__(self, **kwargs):
@@ -35,7 +212,7 @@ class Pwr(PwrAbstract):
             subclass_init = True
         super().__init__(**kwargs)
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\tpwr_init\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.begin(self.model, 'pwr_init')
 
         self._voltage = kwargs['voltage']
         self._current_max = kwargs['current_max']
@@ -48,8 +225,14 @@ class Pwr(PwrAbstract):
         self._current = np.nan
         self._pwr_latency = kwargs['pwr_latency']
         self._pwr_discharge_latency = kwargs['pwr_discharge_latency']
+        self._pwr_discharge_mode = kwargs['pwr_discharge_mode']
+        self._pwr_discharge_tolerance = kwargs['pwr_discharge_tolerance']
         self._pwr_accuracy = kwargs['pwr_accuracy']
         self._pwr_state = 'off'
+        self._modbus_lock = RLock()  # serializes accesses to the serial port
+        self._registers = RegisterCache(self.connection, lock=self._modbus_lock)
+        self._telemetry = TelemetryPoller(self.connection, self._modbus_lock, rate=kwargs['telemetry_rate'],
+                                          max_age=kwargs['telemetry_max_age'], exec_logger=self.exec_logger)
         if self.connect:
             if self.interface_name == 'modbus':
                 try:
@@ -66,11 +249,63 @@ class Pwr(PwrAbstract):
             elif self.interface_name == 'none':
                 raise IOError('dph interface cannot be set to none')
 
+        if self.connect and self._telemetry.rate > 0.:
+            self.start_telemetry()
         if not subclass_init:
-            self.exec_logger.event(f'{self.model}\tpwr_init\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            tracer.end(self.model, 'pwr_init')
 
-    def _retrieve_current(self):
-        self._current = self.connection.read_register(0x0003, 2) * 100  # in mA (not sure why but value from DPS comes in [A*10]
+    def start_telemetry(self, rate=None):
+        """Starts the background telemetry poller, voltage, current and battery voltage are then read from its
+        samples instead of blocking on the serial port
+
+        Parameters
+        ----------
+        rate: float, optional
+            Polling rate [Hz], defaults to telemetry_rate from specs (or 10 Hz if not set)
+        """
+        if rate is not None:
+            self._telemetry.rate = rate
+        if self._telemetry.rate <= 0.:
+            self._telemetry.rate = 10.
+        self._telemetry.start()
+
+    def stop_telemetry(self):
+        """Stops the background telemetry poller"""
+        self._telemetry.stop()
+
+    def _telemetry_sample(self, since=None):
+        """Returns a telemetry sample from the poller if it runs, None otherwise or if no valid sample is available"""
+        if self._telemetry.running:
+            return self._telemetry.get(since=since)
+        return None
+
+    def _retrieve_telemetry(self, since=None):
+        """Retrieves voltage, current and battery voltage from a single telemetry sample (read in one transaction
+        if the poller does not run)
+
+        Returns
+        -------
+        float
+            time.perf_counter() time of the sample
+        """
+        sample = self._telemetry_sample(since=since)
+        if sample is None:
+            with self._modbus_lock:
+                raw = self.connection.read_registers(0x0002, 4)
+            sample = TelemetrySample(time.perf_counter(), raw[0] / 100., float(raw[1]), raw[2] / 100., raw[3] / 100.)
+        self._voltage = sample.voltage
+        self._current = sample.current
+        self._battery_voltage = sample.input_voltage
+        return sample.time
+
+    def _retrieve_current(self, since=None):
+        sample = self._telemetry_sample(since=since)
+        if sample is not None:
+            self._current = sample.current
+            return sample.time
+        with self._modbus_lock:
+            self._current = self.connection.read_register(0x0003, 2) * 100  # in mA (not sure why but value from DPS comes in [A*10]
+        return time.perf_counter()
 
     @property
     def current(self):
@@ -80,8 +315,14 @@ class Pwr(PwrAbstract):
     def current(self, value, **kwargs):
         self.exec_logger.debug(f'Current cannot be set on {self.model}')
 
-    def _retrieve_voltage(self):
-        self._voltage = self.connection.read_register(0x0002, 2)
+    def _retrieve_voltage(self, since=None):
+        sample = self._telemetry_sample(since=since)
+        if sample is not None:
+            self._voltage = sample.voltage
+            return sample.time
+        with self._modbus_lock:
+            self._voltage = self.connection.read_register(0x0002, 2)
+        return time.perf_counter()
 
     @property
     def voltage(self):
@@ -96,19 +337,20 @@ class Pwr(PwrAbstract):
         if value <= self._voltage_min:
             value = self._voltage_min
         assert self._voltage_min <= value <= self._voltage_max
-        self.exec_logger.event(f'{self.model}\tset_voltage\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin(self.model, 'set_voltage')
         if value != self._voltage:
-            self.connection.write_register(0x0000, np.round(value, 2), 2)
+            since = time.perf_counter()
+            self._registers.write(0x0000, np.round(value, 2), 2)
             if self._pwr_state == 'on' and self._pwr_accuracy > 0:
                 for i in range(50):
-                    self._retrieve_voltage()
+                    since = self._retrieve_voltage(since=since)  # waits for a voltage read after the previous one
                     if np.abs(self._voltage - value) < self._pwr_accuracy:  # arbitrary threshold
                         break
-        self.exec_logger.event(f'{self.model}\tset_voltage\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end(self.model, 'set_voltage')
         self._voltage = value
 
     def voltage_default(self, value):  # [A]
-        self.connection.write_register(0x0050, np.round(value, 2), 2)
+        self._registers.write(0x0050, np.round(value, 2), 2)
 
     @property
     def voltage_max(self):
@@ -118,11 +360,16 @@ class Pwr(PwrAbstract):
     def voltage_max(self, value):  # [V]
         if value >= 51.:  # DPS 5005 maximum accepted value
             value = 50.99
-        self.connection.write_register(0x0052, np.round(value, 2), 2)
+        self._registers.write(0x0052, np.round(value, 2), 2)
         self._voltage_max = value
 
     def battery_voltage(self):
-        self._battery_voltage = self.connection.read_register(0x05, 2)
+        sample = self._telemetry_sample()
+        if sample is not None:
+            self._battery_voltage = sample.input_voltage
+        else:
+            with self._modbus_lock:
+                self._battery_voltage = self.connection.read_register(0x05, 2)
         return self._battery_voltage
 
     @property
@@ -133,7 +380,7 @@ class Pwr(PwrAbstract):
     def current_max(self, value):
         new_value = value * (
                     1 + self._current_max_tolerance / 100)  # To set DPS max current slightly above (20% by default) the limit to avoid regulation artefacts
-        self.connection.write_register(0x0001, np.round(new_value, 3), 3)
+        self._registers.write(0x0001, np.round(new_value, 3), 3)
         self._current_max = value
 
     @property
@@ -142,16 +389,16 @@ class Pwr(PwrAbstract):
 
     @current_max.setter
     def current_overload(self, value):
-        self.connection.write_register(0x0053, np.round(value, 3), 3)
+        self._registers.write(0x0053, np.round(value, 3), 3)
         self._current_overload = value
 
     def current_max_default(self, value):  # [A]
         new_value = value * (
                     1 + self._current_max_tolerance / 100)  # To set DPS max current slightly above (20% by default) the limit to avoid regulation artefacts
-        self.connection.write_register(0x0051, np.round((new_value), 3), 3)
+        self._registers.write(0x0051, np.round((new_value), 3), 3)
 
     def power_max(self, value):  # [W]
-        self.connection.write_register(0x0054, np.round(value,1), 1)
+        self._registers.write(0x0054, np.round(value,1), 1)
 
     @property
     def pwr_state(self):
@@ -168,28 +415,35 @@ class Pwr(PwrAbstract):
             """
         if state == 'on':
             if self._pwr_state != 'on':
-                self.exec_logger.event(f'{self.model}\tpwr_state_on\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
-                self.connection.write_register(0x09, 1)
-                self.exec_logger.event(f'{self.model}\tpwr_state_on\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+                tracer.begin(self.model, 'pwr_state_on')
+                with self._modbus_lock:
+                    self.connection.write_register(0x09, 1)
+                tracer.end(self.model, 'pwr_state_on')
                 # self.current_max(self._current_max)
                 self._pwr_state = 'on'
-                # self.exec_logger.event(f'{self.model}\tpwr_latency\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+                # tracer.begin(self.model, 'pwr_latency')
                 # time.sleep(self._pwr_latency)
-                # self.exec_logger.event(f'{self.model}\tpwr_latency\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+                # tracer.end(self.model, 'pwr_latency')
             self.exec_logger.debug(f'{self.model} is on')
 
         elif state == 'off':
             if self._pwr_state != 'off':
-                self.exec_logger.event(f'{self.model}\tpwr_state_off\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
-                self.connection.write_register(0x09, 0)
+                tracer.begin(self.model, 'pwr_state_off')
+                with self._modbus_lock:
+                    self.connection.write_register(0x09, 0)
                 self._pwr_state = 'off'
-                self.exec_logger.event(f'{self.model}\tpwr_state_off\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+                tracer.end(self.model, 'pwr_state_off')
             self.exec_logger.debug(f'{self.model} is off')
 
     def reload_settings(self):
-        self.voltage_default(self._voltage)
-        self.voltage_max = self._voltage_max
-        self.current_max_default(self._current_max)
-        self.current_max = self._current_max
-        self.current_overload = np.max([self._current_max,self._current_overload]) # TODO: np.max could be placed in current_overload setter
-        self.power_max(self._power_max)
+        # NOTE: the DPH reloads its output settings (0x0000 and 0x0001) from the memory group (0x0050 and 0x0051)
+        #  when powered on, the memory group and protection registers (0x0050 to 0x0054) are kept and only written,
+        #  in one transaction, if they changed
+        self._registers.invalidate(0x0000, 0x0001)
+        with self._registers.batch():
+            self.voltage_default(self._voltage)
+            self.voltage_max = self._voltage_max
+            self.current_max_default(self._current_max)
+            self.current_max = self._current_max
+            self.current_overload = np.max([self._current_max,self._current_overload]) # TODO: np.max could be placed in current_overload setter
+            self.power_max(self._power_max)
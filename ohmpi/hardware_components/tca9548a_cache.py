@@ -0,0 +1,141 @@
+import time
+from contextlib import contextmanager
+from threading import Lock, get_ident
+
+_tcas = {}  # TCA9548A instances by (bus, address)
+_tcas_lock = Lock()
+
+
+def get_tca(i2c, address=0x70):
+    """Returns the TCA9548A at a given address on a bus, so that all mux boards share its selected channel
+
+    Parameters
+    ----------
+    i2c: busio.I2C or Tca9548aChannel
+        Bus the TCA9548A is connected to
+    address: int, optional
+        I2C address of the TCA9548A
+
+    Returns
+    -------
+    Tca9548a
+    """
+    with _tcas_lock:
+        key = (id(i2c), address)
+        if key not in _tcas.keys():
+            _tcas[key] = Tca9548a(i2c, address)
+        return _tcas[key]
+
+
+class Tca9548aChannel:
+    """Tca9548aChannel class.
+    I2C proxy to a channel of a TCA9548A, behaving like a busio.I2C (see adafruit_tca9548a.TCA9548A_Channel).
+    Outside a batch, the channel is selected when the bus is locked and deselected when it is unlocked.
+    """
+    def __init__(self, tca, channel):
+        self.tca = tca
+        self.channel = channel
+
+    def try_lock(self):
+        if not self.tca.batching:
+            while not self.tca.i2c.try_lock():
+                time.sleep(0)
+        self.tca.select(self.channel)
+        return True
+
+    def unlock(self):
+        if not self.tca.batching:
+            self.tca.deselect()
+            self.tca.i2c.unlock()
+
+    def _check_address(self, address):
+        if address == self.tca.address:
+            raise ValueError('Device address must be different than TCA9548A address.')
+
+    def readfrom_into(self, address, buffer, **kwargs):
+        self._check_address(address)
+        return self.tca.i2c.readfrom_into(address, buffer, **kwargs)
+
+    def writeto(self, address, buffer, **kwargs):
+        self._check_address(address)
+        return self.tca.i2c.writeto(address, buffer, **kwargs)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, **kwargs):
+        self._check_address(address)
+        return self.tca.i2c.writeto_then_readfrom(address, buffer_out, buffer_in, **kwargs)
+
+    def scan(self):
+        return self.tca.i2c.scan()
+
+    def probe(self, address):
+        if hasattr(self.tca.i2c, 'probe'):
+            return self.tca.i2c.probe(address)
+        return address in self.scan()
+
+
+class Tca9548a:
+    """Tca9548a class.
+    TCA9548A I2C multiplexer remembering its selected channel, so that redundant channel selections are skipped.
+    Devices behind a selected channel are visible on the upstream bus (and may share addresses with other devices),
+    thus a channel is only kept selected between transactions within a batch, during which the upstream bus stays
+    locked.
+
+    Parameters
+    ----------
+    i2c: busio.I2C or Tca9548aChannel
+        Bus the TCA9548A is connected to
+    address: int, optional
+        I2C address of the TCA9548A
+    """
+    def __init__(self, i2c, address=0x70):
+        self.i2c = i2c
+        self.address = address
+        self.selected = None  # selected channel, None if all channels are deselected
+        self._channels = [None] * 8
+        self._batch_thread = None
+
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, channel):
+        if not 0 <= channel <= 7:
+            raise IndexError('Channel must be an integer in the range: 0-7.')
+        if self._channels[channel] is None:
+            self._channels[channel] = Tca9548aChannel(self, channel)
+        return self._channels[channel]
+
+    @property
+    def batching(self):
+        """True if the calling thread is running a batch on this TCA9548A"""
+        return self._batch_thread == get_ident()
+
+    def select(self, channel):
+        """Selects a channel unless it is already selected. The upstream bus should be locked."""
+        if channel != self.selected:
+            self.selected = None  # in case the write fails
+            self.i2c.writeto(self.address, bytes([1 << channel]))
+            self.selected = channel
+
+    def deselect(self):
+        """Deselects all channels. The upstream bus should be locked."""
+        self.selected = None
+        self.i2c.writeto(self.address, b'\x00')
+
+    @contextmanager
+    def batch(self):
+        """Context manager locking the upstream bus and keeping the selected channel between transactions.
+        Channels are deselected and the bus is unlocked when leaving the batch."""
+        if self.batching:  # nested batch
+            yield self
+            return
+        while not self.i2c.try_lock():
+            time.sleep(0)
+        self._batch_thread = get_ident()
+        try:
+            yield self
+        finally:
+            self._batch_thread = None
+            try:
+                self.deselect()
+            finally:
+                self.i2c.unlock()
@@ -23,7 +23,10 @@ except ModuleNotFoundError:
           'If you deleted your config.py file by mistake, you should find a backup in configs/config_backup.py')
     sys.exit(-1)
 from ohmpi.utils import enforce_specs
-from threading import Thread, Event, Barrier, BrokenBarrierError
+from ohmpi.tracing import tracer
+from threading import Thread, Event, Barrier, BrokenBarrierError, RLock
+from contextlib import contextmanager
+from queue import Queue
 import warnings
 
 
@@ -35,6 +38,442 @@ def elapsed_seconds(start_time):
     return lap.total_seconds()
 
 
+def elapsed_nanoseconds(start_time):
+    lap = datetime.datetime.now(datetime.timezone.utc) - start_time
+    return (lap // datetime.timedelta(microseconds=1)) * 1000
+
+
+class SampleBuffer:
+    """SampleBuffer class.
+    A growable, preallocated column store for the full waveform dataset acquired by the RX.
+    Samples are appended in place and columns are exposed as views on the buffer (no copy).
+
+    Parameters
+    ----------
+    capacity: int, optional
+        number of samples initially allocated. The capacity is doubled each time the buffer is full
+    n_channels: int, optional
+        number of MN channels read at each sample. The vmn of the first channel is stored in column 'vmn', the ones of
+        the other channels in columns 'vmn_1', 'vmn_2', ...
+    """
+    dtype = np.dtype([('time_ns', np.int64), ('pulse', np.int32), ('polarity', np.int8), ('iab', np.float64),
+                      ('vmn', np.float64)])
+
+    def __init__(self, capacity=4096, n_channels=1):
+        self.n_channels = max(int(n_channels), 1)
+        if self.n_channels > 1:
+            self.dtype = np.dtype(self.dtype.descr + [(f'vmn_{i}', np.float64) for i in range(1, self.n_channels)])
+        self._data = np.zeros(max(int(capacity), 1), dtype=self.dtype)
+        self._n = 0
+        self._array = None  # cached (time [s], pulse, polarity, iab, vmn, vmn_1, ...) float array
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, column):
+        return self._data[column][:self._n]
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def clear(self):
+        self._n = 0
+        self._array = None
+
+    def _reserve(self, n):
+        if n > len(self._data):
+            data = np.zeros(max(n, 2 * len(self._data)), dtype=self.dtype)
+            data[:self._n] = self._data[:self._n]
+            self._data = data
+
+    def append(self, time_ns, pulse, polarity, iab, vmn, *vmn_channels):
+        if self._n == len(self._data):
+            self._reserve(self._n + 1)
+        self._data[self._n] = (time_ns, pulse, polarity, iab, vmn, *vmn_channels)
+        self._n += 1
+        self._array = None
+
+    def vmn_column(self, channel=0):
+        """Returns the name of the vmn column of a channel"""
+        return 'vmn' if channel == 0 else f'vmn_{channel}'
+
+    def from_array(self, readings):
+        """Loads a full waveform dataset consisting of [time [s], pulse nr, polarity, iab, vmn, vmn_1, ...] in the
+        buffer"""
+        readings = np.asarray(readings, dtype=float)
+        if readings.size == 0:
+            readings = readings.reshape(0, 4 + self.n_channels)
+        self.clear()
+        self._reserve(len(readings))
+        data = self._data[:len(readings)]
+        data['time_ns'] = np.round(readings[:, 0] * 1e9)
+        data['pulse'] = readings[:, 1]
+        data['polarity'] = readings[:, 2]
+        data['iab'] = readings[:, 3]
+        for channel in range(min(self.n_channels, readings.shape[1] - 4)):
+            data[self.vmn_column(channel)] = readings[:, 4 + channel]
+        self._n = len(readings)
+
+    @property
+    def time(self):
+        """Time since the beginning of the acquisition in seconds"""
+        return self['time_ns'] * 1e-9
+
+    def to_array(self):
+        """Returns the full waveform dataset as a [time [s], pulse nr, polarity, iab, vmn, vmn_1, ...] array"""
+        if self._array is None:
+            columns = ['pulse', 'polarity', 'iab'] + [self.vmn_column(i) for i in range(self.n_channels)]
+            self._array = np.empty((self._n, len(columns) + 1))
+            self._array[:, 0] = self.time
+            for i, column in enumerate(columns):
+                self._array[:, i + 1] = self[column]
+        return self._array
+
+    def to_full_waveform(self, channel=0):
+        """Returns the full waveform dataset of a channel as saved with measurements
+        [time [s], iab * polarity, vmn, polarity]"""
+        full_waveform = np.empty((self._n, 4))
+        full_waveform[:, 0] = self.time
+        full_waveform[:, 1] = self['iab']
+        full_waveform[:, 2] = self[self.vmn_column(channel)]
+        full_waveform[:, 3] = self['polarity']
+        # multiply current by polarity
+        np.multiply(full_waveform[:, 1], full_waveform[:, 3], out=full_waveform[:, 1], where=full_waveform[:, 3] != 0)
+        return full_waveform
+
+
+class PulseStatistics:
+    """PulseStatistics class.
+    Groups the readings by pulse in a single pass and computes all per-pulse and aggregated statistics used to
+    qualify a measurement (vmn, iab, R, SP and the bounds used to find the optimal vab).
+
+    Parameters
+    ----------
+    readings: np.ndarray
+        full waveform dataset consisting of [time, pulse nr, polarity, iab, vmn]
+    delay: float, optional
+        delay in seconds after the start of each pulse before samples are selected
+    sp: float, None, optional
+        self potential in mV. If None, sp is estimated from the mean vmn of positive and negative pulses
+    channel: int, optional
+        MN channel of the statistics, i.e. readings column 4 + channel (for readings of a multichannel RX)
+    """
+
+    def __init__(self, readings, delay=0., sp=None, channel=0):
+        readings = np.asarray(readings, dtype=float)
+        if readings.size == 0:
+            readings = readings.reshape(0, 5 + channel)
+        self.delay = delay
+        self.channel = channel
+        # sort samples by pulse once (stable sort keeps the acquisition order within each pulse)
+        order = np.argsort(readings[:, 1], kind='stable')
+        self.pulses, starts, counts = np.unique(readings[order, 1], return_index=True, return_counts=True)
+        n_pulses = len(self.pulses)
+        group = np.repeat(np.arange(n_pulses), counts)
+        if n_pulses > 0:
+            t_start = np.minimum.reduceat(readings[order, 0], starts)
+            selected = (readings[order, 0] >= t_start[group] + delay) & (readings[order, 2] != 0)
+        else:
+            selected = np.zeros(0, dtype=bool)
+        self.samples = order[selected].astype('int32')
+        group = group[selected]
+        polarity = readings[self.samples, 2]
+        iab = readings[self.samples, 3]
+        vmn = readings[self.samples, 4 + channel]
+
+        # per-pulse statistics
+        self.pulse_n_samples = np.bincount(group, minlength=n_pulses)
+        self.pulse_polarity = np.sign(np.bincount(group, weights=polarity, minlength=n_pulses)).astype(int)
+        self.pulse_iab, self.pulse_iab_std = self._grouped_mean_std(iab, group)
+        self.pulse_vmn, self.pulse_vmn_std = self._grouped_mean_std(vmn * polarity, group)  # vmn * polarity
+        raw_vmn, _ = self._grouped_mean_std(vmn, group)
+
+        # sp from the mean vmn of pairs of positive and negative pulses
+        self.sp = sp
+        if self.sp is None:
+            valid = self.pulse_n_samples > 0
+            vmn_pos = raw_vmn[valid & (self.pulse_polarity == 1)]
+            vmn_neg = raw_vmn[valid & (self.pulse_polarity == -1)]
+            n_pairs = min(len(vmn_pos), len(vmn_neg))
+            if n_pairs > 0:
+                self.sp = np.mean(vmn_pos[:n_pairs] + vmn_neg[:n_pairs]) / 2
+        _sp = 0. if self.sp is None else self.sp
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.pulse_r = (self.pulse_vmn - self.pulse_polarity * _sp) / self.pulse_iab
+
+        # aggregated statistics
+        self.n_samples = len(self.samples)
+        if self.n_samples > 1:
+            vmn_sp = polarity * (vmn - _sp)
+            r = vmn_sp / iab
+            self.vmn = np.mean(vmn_sp)
+            self.vmn_dev = 100. * np.std(vmn_sp) / self.vmn
+            self.iab = np.mean(iab)
+            self.iab_dev = 100. * np.std(iab) / self.iab
+            self.r = np.mean(r)
+            self.r_dev = 100. * np.std(r) / self.r
+        else:
+            self.vmn, self.vmn_dev, self.iab, self.iab_dev, self.r, self.r_dev = [np.nan] * 6
+
+    def _grouped_mean_std(self, x, group):
+        n = self.pulse_n_samples
+        mean = np.divide(np.bincount(group, weights=x, minlength=len(n)), n, out=np.zeros(len(n)), where=n > 0)
+        var = np.divide(np.bincount(group, weights=(x - mean[group]) ** 2, minlength=len(n)), n,
+                        out=np.zeros(len(n)), where=n > 0)
+        return mean, np.sqrt(var)
+
+    @property
+    def insufficient_pulses(self):
+        """Indices of the pulses (except the first one) with not enough samples to estimate R and Rab"""
+        return np.where(self.pulse_n_samples[1:] <= 1)[0] + 1
+
+    def bounds(self, vab, iab_min, vmn_min, n_sigma=2.):
+        """Computes per-pulse bounds on R and Rab from the mean and std of iab and vmn of each pulse.
+        The first pulse and pulses with not enough samples get null bounds.
+
+        Parameters
+        ----------
+        vab: float
+            vab in use in V
+        iab_min: float
+            minimum iab in A
+        vmn_min: float
+            minimum vmn in V
+        n_sigma: float, optional
+            number of standard deviations used to compute the bounds
+
+        Returns
+        -------
+        tuple of np.ndarray
+            r_lower_bound, r_upper_bound, rab_lower_bound, rab_upper_bound
+        """
+        valid = self.pulse_n_samples > 1
+        valid[:1] = False  # NOTE : remove condition on pulse 0 depending on the solution givent to issue#246
+        iab_mean, iab_std = self.pulse_iab / 1000., self.pulse_iab_std / 1000.
+        vmn_mean, vmn_std = self.pulse_vmn / 1000., self.pulse_vmn_std / 1000.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # bounds on iab
+            iab_lower_bound = np.maximum(iab_min, iab_mean - n_sigma * iab_std)
+            iab_upper_bound = np.maximum(iab_min, iab_mean + n_sigma * iab_std)
+            # bounds on vmn
+            vmn_lower_bound = np.maximum(vmn_min, vmn_mean - n_sigma * vmn_std)
+            vmn_upper_bound = np.maximum(vmn_min, vmn_mean + n_sigma * vmn_std)
+            # bounds on r
+            r_lower_bound = np.maximum(0.1, np.abs(vmn_lower_bound / iab_upper_bound))
+            r_upper_bound = np.maximum(0.1, np.abs(vmn_upper_bound / iab_lower_bound))
+            # bounds on rab
+            rab_lower_bound = np.maximum(r_lower_bound, np.abs(vab / iab_upper_bound))
+            rab_upper_bound = np.maximum(r_upper_bound, np.abs(vab / iab_lower_bound))
+        return tuple(np.where(valid, b, 0.) for b in
+                     (r_lower_bound, r_upper_bound, rab_lower_bound, rab_upper_bound))
+
+
+class VabCache:
+    """VabCache class.
+    Keeps the vab found by compute_vab for each quadrupole together with the bounds on Rab and R of the last search
+    step, so that the search can be warm-started from the previous vab when the same sequence is run again
+    (time-lapse).
+    An entry is invalidated when the contact resistance (Rab) measured on the first pulse train drifts beyond
+    drift_threshold (relative change).
+
+    Parameters
+    ----------
+    drift_threshold: float, optional
+        maximum relative change of Rab before an entry is invalidated
+    """
+
+    def __init__(self, drift_threshold=0.2):
+        self.drift_threshold = drift_threshold
+        self._entries = {}
+        self.stats = {}
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.key(key) in self._entries.keys()
+
+    @staticmethod
+    def key(electrodes):
+        """Returns the cache key of a dipole or quadrupole"""
+        return tuple(int(e) for e in electrodes)
+
+    def reset_stats(self):
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, electrodes):
+        """Returns the entry of a dipole or quadrupole (dict with vab, rab_min, rab_max, r_min and r_max), None if
+        there is no entry"""
+        entry = self._entries.get(self.key(electrodes), None)
+        if entry is None:
+            self.stats['misses'] += 1
+        else:
+            self.stats['hits'] += 1
+        return entry
+
+    def peek(self, electrodes):
+        """Returns the entry of a dipole or quadrupole like get(), without counting a hit or a miss"""
+        return self._entries.get(self.key(electrodes), None)
+
+    def update(self, electrodes, vab, rab_min, rab_max, r_min, r_max):
+        self._entries[self.key(electrodes)] = {'vab': float(vab), 'rab_min': float(rab_min),
+                                               'rab_max': float(rab_max), 'r_min': float(r_min),
+                                               'r_max': float(r_max)}
+
+    def drifted(self, electrodes, rab_min, rab_max):
+        """Checks whether Rab drifted beyond drift_threshold since the entry was stored"""
+        entry = self._entries.get(self.key(electrodes), None)
+        if entry is None:
+            return False
+        rab_cached = (entry['rab_min'] + entry['rab_max']) / 2.
+        rab = (rab_min + rab_max) / 2.
+        if not rab_cached > 0.:
+            return True
+        return np.abs(rab / rab_cached - 1.) > self.drift_threshold
+
+    def invalidate(self, electrodes=None):
+        """Removes the entry of a dipole or quadrupole, or all entries if electrodes is None"""
+        if electrodes is None:
+            self._entries.clear()
+        elif self._entries.pop(self.key(electrodes), None) is not None:
+            self.stats['invalidations'] += 1
+
+
+class VabPredictor:
+    """VabPredictor class.
+    Predicts Rab and R of a quadrupole from the measurements made earlier in a sequence, so that the vab search can
+    start close to its solution. Rab only depends on the AB dipole: it is taken from a previous measurement on the same
+    dipole or estimated from the contact resistances of its electrodes (Rab ~ Rc_A + Rc_B, with Rc estimated as half
+    the Rab of the dipoles measured on each electrode). R is scaled from the median apparent resistivity of the
+    previous quadrupoles with the geometric factor (electrodes are assumed evenly spaced on a line).
+
+    Parameters
+    ----------
+    margin: float, optional
+        relative margin applied on the predicted Rab and R to get their bounds
+    """
+
+    def __init__(self, margin=0.5):
+        self.margin = margin
+        self._rab = {}  # last Rab by AB dipole
+        self._rc = {}  # contact resistance estimates by electrode
+        self._rho = []  # apparent resistivities (up to a constant factor)
+        self.stats = {}
+        self.reset()
+
+    def reset(self):
+        self._rab.clear()
+        self._rc.clear()
+        self._rho.clear()
+        self.stats = {'predicted': 0, 'predicted_steps': 0, 'cold': 0, 'cold_steps': 0}
+
+    @staticmethod
+    def geometric_factor(quad):
+        """Geometric factor of a quadrupole of evenly spaced electrodes (unit spacing), nan if undefined"""
+        a, b, m, n = [float(e) for e in quad[:4]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g = 1. / np.abs(a - m) - 1. / np.abs(b - m) - 1. / np.abs(a - n) + 1. / np.abs(b - n)
+            k = 2 * np.pi / g
+        return k if np.isfinite(k) and k != 0. else np.nan
+
+    def update(self, quad, rab, r):
+        """Stores Rab [ohm] and R [ohm] measured on a quadrupole"""
+        ab = tuple(sorted(int(e) for e in quad[:2]))
+        if np.isfinite(rab) and rab > 0.:
+            self._rab[ab] = rab
+            for e in ab:
+                self._rc[e] = np.mean([v / 2. for k, v in self._rab.items() if e in k])
+        k = self.geometric_factor(quad)
+        if np.isfinite(r) and np.isfinite(k):
+            self._rho.append(r * k)
+
+    def predict(self, quad):
+        """Predicts the bounds on Rab and R of a quadrupole
+
+        Returns
+        -------
+        tuple, None
+            rab_min, rab_max, r_min, r_max in ohm, None if no prediction can be made
+        """
+        ab = tuple(sorted(int(e) for e in quad[:2]))
+        if ab in self._rab.keys():
+            rab = self._rab[ab]
+        else:
+            rc = [self._rc[e] for e in ab if e in self._rc.keys()]
+            if len(rc) == 0:
+                return None
+            rab = np.sum(rc) if len(rc) == 2 else 2 * rc[0]
+        k = self.geometric_factor(quad)
+        if len(self._rho) == 0 or not np.isfinite(k):
+            return None
+        r = np.abs(np.median(self._rho) / k)
+        return rab * (1 - self.margin), rab * (1 + self.margin), r * (1 - self.margin), r * (1 + self.margin)
+
+    def record_steps(self, predicted, n_steps):
+        """Records the number of compute_vab steps of a measurement started from a predicted or default vab"""
+        if predicted:
+            self.stats['predicted'] += 1
+            self.stats['predicted_steps'] += n_steps
+        else:
+            self.stats['cold'] += 1
+            self.stats['cold_steps'] += n_steps
+
+    @property
+    def saved_steps(self):
+        """Estimated number of compute_vab steps saved by the predictions (from the mean number of steps of the
+        searches started from the default vab), nan if there is no reference"""
+        if self.stats['cold'] == 0:
+            return np.nan
+        mean_cold_steps = self.stats['cold_steps'] / self.stats['cold']
+        return mean_cold_steps * self.stats['predicted'] - self.stats['predicted_steps']
+
+
+class MuxWorker:
+    """MuxWorker class.
+    Long-lived worker thread executing commands (e.g. switch or reset) on one mux board, fed by a command queue.
+
+    Parameters
+    ----------
+    mux: MuxAbstract
+        mux board operated by the worker
+    exec_logger: logging.Logger, optional
+        logger used to report failed commands
+    """
+    def __init__(self, mux, exec_logger=None):
+        self.mux = mux
+        self.exec_logger = exec_logger if exec_logger is not None else mux.exec_logger
+        self._commands = Queue()
+        self._results = Queue()
+        self._thread = Thread(target=self._run, name=f'mux_worker_{mux.board_id}', daemon=True)
+        self._thread.start()
+
+    def submit(self, command, barrier=None, **kwargs):
+        """Submits a command, i.e. the name of a method of the mux board, to the worker.
+        If a barrier is given, it is assigned to the mux board before executing the command."""
+        self._commands.put((command, barrier, kwargs))
+
+    def result(self):
+        """Waits for the result of the oldest submitted command and returns it with its duration in seconds"""
+        return self._results.get()
+
+    def _run(self):
+        while True:
+            command, barrier, kwargs = self._commands.get()
+            start = time.perf_counter()
+            if barrier is not None:
+                self.mux.barrier = barrier
+            try:
+                status = getattr(self.mux, command)(**kwargs)
+            except Exception as e:
+                self.exec_logger.error(f'{self.mux.board_id}: {command} failed: {e}')
+                if barrier is not None:
+                    barrier.abort()  # releases the other boards and OhmPiHardware waiting to switch
+                status = False
+            self._results.put((status, time.perf_counter() - start))
+
+
 class OhmPiHardware:
     """OhmPiHardware class.
     A class to operate the system of assembled components as defined in the ohmpi/config.py file
@@ -43,7 +482,7 @@ class OhmPiHardware:
     def __init__(self, **kwargs):
         # OhmPiHardware initialization
         self.exec_logger = kwargs.pop('exec_logger', create_stdout_logger('exec_hw'))
-        self.exec_logger.event(f'OhmPiHardware\tinit\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin('OhmPiHardware', 'init')
         self.data_logger = kwargs.pop('exec_logger', create_stdout_logger('data_hw'))
         self.soh_logger = kwargs.pop('soh_logger', create_stdout_logger('soh_hw'))
         self.tx_sync = Event()
@@ -224,18 +663,39 @@ class OhmPiHardware:
             self.mux_boards[mux_id] = mux_module.Mux(**mux_config)
 
         self.mux_barrier = Barrier(len(self.mux_boards) + 1)
+        self._mux_barriers = {}  # reusable barriers by number of parties
+        self._mux_workers = {mux_id: MuxWorker(mux, exec_logger=self.exec_logger)
+                             for mux_id, mux in self.mux_boards.items()}
+        self.mux_switch_status = {}  # status and duration of the last switch on each mux board
+        self._closed_relays = set()  # (electrode, role) relays currently closed
+        self.diff_relays = False  # when True, only the relays differing between consecutive quadrupoles are switched
+        self.relay_stats = {}  # relay operations and delays saved by diffing relay states
+        self._reset_relay_stats()
         self._cabling = {}
         for mux_id, mux in self.mux_boards.items():
             mux.barrier = self.mux_barrier
             for k, v in mux.cabling.items():
                 update_dict(self._cabling, {k: (mux_id, k[0])})  # TODO: in theory k[0] is not needed in values
         # Complete OhmPiHardware initialization
-        self.readings = np.array([])  # time series of acquired data
+        self._buffer = SampleBuffer(n_channels=self.rx.n_channels)  # time series of acquired data
         self.sp = None  # init SP
+        self.segment_jitter = np.array([])  # timing jitter of the segments of the last waveform program
         self._start_time = None  # time of the beginning of a readings acquisition
         self._pulse = 0  # pulse number
-        self.exec_logger.event(f'OhmPiHardware\tinit\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        self.vab_cache = VabCache()  # vab found by compute_vab by quadrupole, to warm-start time-lapse runs
+        self.last_vab_search = {}  # vab, bounds on Rab and R and number of steps of the last compute_vab search
+        self.vab_predictor = VabPredictor()  # predicts Rab and R from the previous measurements of a sequence
+        self.gain_margin = 0.2  # relative margin on the expected signals when planning gains
+        self.signal_cache = {}  # peak signals of the last square wave by quadrupole, to plan gains in time-lapse runs
+        self.gain_stats = {}
+        self.reset_gain_stats()
+        tracer.end('OhmPiHardware', 'init')
         self._pwr_state = 'off'
+        self._pwr_sessions = 0  # number of open power sessions
+        self._pwr_session_switch_off = False  # True if the first session switched pwr on
+        self._pwr_session_lock = RLock()
+        self.pwr_stats = {}  # power sessions, warm-ups and time spent waiting for power
+        self.reset_pwr_stats()
 
     @property
     def pwr_state(self):
@@ -243,6 +703,8 @@ class OhmPiHardware:
 
     @pwr_state.setter
     def pwr_state(self, state):
+        if state != self._pwr_state:
+            self.release_relays()  # never change pwr state with relays kept closed between quadrupoles
         if state == 'on':
             self.tx.pwr_state = 'on'
             self._pwr_state = 'on'
@@ -250,13 +712,71 @@ class OhmPiHardware:
             self.tx.pwr_state = 'off'
             self._pwr_state = 'off'
 
+    def reset_pwr_stats(self):
+        self.pwr_stats = {'sessions': 0, 'warm_ups': 0, 'wait_time': 0.}
+
+    def acquire_pwr(self):
+        """Opens a power session. The first session switches tx pwr on (if it is off), paying the pwr latency once
+        for all nested sessions. Prefer the pwr_session context manager."""
+        with self._pwr_session_lock:
+            self._pwr_sessions += 1
+            self.pwr_stats['sessions'] += 1
+            if self._pwr_sessions == 1:
+                self._pwr_session_switch_off = self.pwr_state == 'off'
+            if self.pwr_state == 'off':
+                tracer.begin('OhmPiHardware', 'pwr_wait')
+                start = time.perf_counter()
+                self.pwr_state = 'on'
+                self.pwr_stats['wait_time'] += time.perf_counter() - start
+                self.pwr_stats['warm_ups'] += 1
+                tracer.end('OhmPiHardware', 'pwr_wait')
+
+    def release_pwr(self):
+        """Closes a power session. The last session switches tx pwr off if the first one switched it on."""
+        with self._pwr_session_lock:
+            if self._pwr_sessions == 0:
+                self.exec_logger.warning('No power session to release')
+                return
+            self._pwr_sessions -= 1
+            if self._pwr_sessions == 0 and self._pwr_session_switch_off:
+                self.pwr_state = 'off'
+
+    @contextmanager
+    def pwr_session(self):
+        """Reference-counted power session context manager. Tx pwr is switched on when entering the first session
+        and switched off when leaving the last one, unless it was already on before."""
+        self.acquire_pwr()
+        try:
+            yield self
+        finally:
+            self.release_pwr()
+
+    @property
+    def readings(self):
+        """Full waveform dataset consisting of [time, pulse nr, polarity, iab, vmn] (followed by the vmn of the other
+        channels of a multichannel RX)"""
+        return self._buffer.to_array()
+
+    @readings.setter
+    def readings(self, readings):
+        self._buffer.from_array(readings)
+
+    @property
+    def full_waveform(self):
+        """Full waveform dataset consisting of [time, iab * polarity, vmn, polarity]"""
+        return self._buffer.to_full_waveform()
+
+    def channel_full_waveform(self, channel=0):
+        """Full waveform dataset of a MN channel consisting of [time, iab * polarity, vmn, polarity]"""
+        return self._buffer.to_full_waveform(channel=channel)
+
     def _clear_values(self):
-        self.readings = np.array([])
+        self._buffer.clear()
         self._start_time = None
         self._pulse = 0
 
     def _gain_auto(self, polarities=(1, -1), vab=5., switch_pwr_off=False):  # TODO: improve _gain_auto
-        self.exec_logger.event(f'OhmPiHardware\ttx_rx_gain_auto\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin('OhmPiHardware', 'tx_rx_gain_auto')
         current, voltage = 0., 0.
         self.rx.reset_gain()
         self.tx.reset_gain()
@@ -294,12 +814,67 @@ class OhmPiHardware:
         # self.rx.gain_auto(voltage)
         if switch_pwr_off:
             self.tx.pwr.pwr_state = 'off'
-        self.exec_logger.event(f'OhmPiHardware\ttx_rx_gain_auto\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end('OhmPiHardware', 'tx_rx_gain_auto')
+
+    def reset_gain_stats(self):
+        self.gain_stats = {'planned': 0, 'auto': 0}
+
+    def peak_signals(self, vab):
+        """Peak iab and vmn (absolute values) of the injection pulses of the last readings, measured at vab, or None
+        if there is no reading"""
+        readings = self.readings
+        injected = readings[:, 2] != 0
+        if not np.any(injected):
+            return None
+        return {'vab': float(vab), 'iab': float(np.max(np.abs(readings[injected, 3]))),
+                'vmn': float(np.max(np.abs(readings[injected, 4])))}
+
+    @staticmethod
+    def expected_signals(peaks, vab):
+        """Scales peak signals measured at peaks['vab'] to vab. Vmn is never scaled down as it includes the SP.
+
+        Returns
+        -------
+        tuple
+            expected peak iab and vmn
+        """
+        ratio = vab / peaks['vab'] if peaks['vab'] > 0. else np.inf
+        return peaks['iab'] * ratio, peaks['vmn'] * max(ratio, 1.)
+
+    def plan_gains(self, iab, vmn, margin=None):
+        """Sets the TX and RX gains from the expected peak iab and vmn instead of measuring them with _gain_auto
+
+        Parameters
+        ----------
+        iab: float
+            expected peak current
+        vmn: float
+            expected peak voltage
+        margin: float, optional
+            relative margin on the expected signals, defaults to self.gain_margin
+
+        Returns
+        -------
+        bool
+            True if the gains were set, False if they cannot be predicted (_gain_auto is then needed)
+        """
+        if margin is None:
+            margin = self.gain_margin
+        if not (np.isfinite(iab) and np.isfinite(vmn)):
+            return False
+        tx_gain = self.tx.gain_for(iab, margin=margin)
+        rx_gain = self.rx.gain_for(vmn, margin=margin)
+        if tx_gain is None or rx_gain is None:
+            return False
+        self.tx.gain = tx_gain
+        self.rx.gain = rx_gain
+        self.exec_logger.debug(f'Planned gains for iab {iab:.3f} and vmn {vmn:.3f}: TX {tx_gain}, RX {rx_gain}')
+        return True
 
     def _inject(self, polarity=1, injection_duration=None):  # TODO: deal with voltage or current pulse
-        self.exec_logger.event(f'OhmPiHardware\tinject\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin('OhmPiHardware', 'inject')
         self.tx.voltage_pulse(length=injection_duration, polarity=polarity)
-        self.exec_logger.event(f'OhmPiHardware\tinject\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end('OhmPiHardware', 'inject')
 
     def _set_mux_barrier(self):
         self.mux_barrier = Barrier(len(self.mux_boards) + 1)
@@ -325,12 +900,10 @@ class OhmPiHardware:
         sampling_rate: float,None , optional
         append: bool Default: False
         """
-        self.exec_logger.event(f'OhmPiHardware\tread_values\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin('OhmPiHardware', 'read_values')
         if not append:
             self._clear_values()
-            _readings = []
-        else:
-            _readings = self.readings.tolist()
+        n_samples = len(self._buffer)
         # if test_r_shunt:
         _current = []
         if sampling_rate is None:  # TODO: handle sampling rate out of range make sure the sampling rates of tx and Rx are consistent
@@ -346,13 +919,20 @@ class OhmPiHardware:
 
         while self.tx_sync.is_set():
             lap = datetime.datetime.now(datetime.timezone.utc)
-            r = [elapsed_seconds(self._start_time), self._pulse, self.tx.polarity, self.tx.current, self.rx.voltage]
+            switching = self.tx.switching
+            if self._buffer.n_channels > 1:
+                r = (elapsed_nanoseconds(self._start_time), self._pulse, self.tx.polarity, self.tx.current,
+                     *self.rx.voltages)
+            else:
+                r = (elapsed_nanoseconds(self._start_time), self._pulse, self.tx.polarity, self.tx.current,
+                     self.rx.voltage)
             if self.tx_sync.is_set():
                 sample += 1
-                _readings.append(r)
-                if test_r_shunt:
-                    self.tx.pwr._retrieve_current()
-                    _current.append(self.tx.pwr.current)
+                if not (switching or self.tx.switching):  # skips samples read while polarity relays are switching
+                    self._buffer.append(*r)
+                    if test_r_shunt:
+                        self.tx.pwr._retrieve_current()
+                        _current.append(self.tx.pwr.current)
                 sleep_time = self._start_time + datetime.timedelta(seconds=sample / sampling_rate) - lap
                 if sleep_time.total_seconds() < 0.:
                     # TODO: count how many samples were skipped to make a stat that could be used to qualify pulses
@@ -361,95 +941,66 @@ class OhmPiHardware:
                 time.sleep(np.max([0., sleep_time.total_seconds()]))
 
         self.exec_logger.debug(f'pulse {self._pulse}: elapsed time {(lap - self._start_time).total_seconds()} s')
-        self.exec_logger.debug(f'pulse {self._pulse}: total samples {len(_readings)}')
-        self.readings = np.array(_readings)
+        self.exec_logger.debug(f'pulse {self._pulse}: total samples {len(self._buffer) - n_samples}')
         if test_r_shunt:
             self._current = np.array(_current)
         self._pulse += 1
-        self.exec_logger.event(f'OhmPiHardware\tread_values\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end('OhmPiHardware', 'read_values')
+
+    def pulse_statistics(self, delay=0., channel=0):
+        """Computes all pulse statistics of the last readings in a single pass.
+
+        Parameters
+        ----------
+        delay: float, optional
+            delay in seconds after the start of each pulse before samples are selected
+        channel: int, optional
+            MN channel. The sp of channels other than the first one is estimated from the readings and not stored.
+
+        Returns
+        -------
+        PulseStatistics
+        """
+        if channel > 0:
+            return PulseStatistics(self.readings, delay=delay, channel=channel)
+        stats = PulseStatistics(self.readings, delay=delay, sp=self.sp)
+        if stats.sp is None:
+            self.exec_logger.warning('Unable to compute sp: readings should at least contain one positive and one '
+                                     'negative pulse')
+        else:
+            self.sp = stats.sp
+        return stats
 
     def select_samples(self, delay=0.):
-        x = []
-        for pulse in np.unique(self.readings[:, 1]):
-            v = np.where((self.readings[:, 1] == pulse))[0]
-            if len(v) > 0:  # to avoid pulse not recorded due to Raspberry Pi lag...
-                t_start_pulse = min(self.readings[v, 0])
-                x.append(np.where((self.readings[:, 0] >= t_start_pulse + delay) & (self.readings[:, 2] != 0) & (
-                        self.readings[:, 1] == pulse))[0])
-        x = np.concatenate(np.array(x, dtype='object'))
-        x = x.astype('int32')
-        return x
+        return PulseStatistics(self.readings, delay=delay, sp=0.).samples
 
     def last_resistance(self, delay=0.):
-        v = self.select_samples(delay)
-        if self.sp is None:
-            self.last_sp(delay=delay)
-        if len(v) > 1:
-            # return np.mean(np.abs(self.readings[v, 4] - self.sp) / self.readings[v, 3])
-            return np.mean(self.readings[v, 2] * (self.readings[v, 4] - self.sp) / self.readings[v, 3])
-        else:
-            return np.nan
+        return self.pulse_statistics(delay=delay).r
 
     def last_dev(self, delay=0.):
-        v = self.select_samples(delay)
-        if self.sp is None:
-            self.last_sp(delay=delay)
-        if len(v) > 1:
-            return 100. * np.std(
-                self.readings[v, 2] * (self.readings[v, 4] - self.sp) / self.readings[v, 3]) / self.last_resistance(
-                delay=delay)
-        else:
-            return np.nan
+        return self.pulse_statistics(delay=delay).r_dev
 
     def last_vmn(self, delay=0.):
-        v = self.select_samples(delay)
-        if self.sp is None:
-            self.last_sp(delay=delay)
-        if len(v) > 1:
-            return np.mean(self.readings[v, 2] * (self.readings[v, 4] - self.sp))
-        else:
-            return np.nan
+        return self.pulse_statistics(delay=delay).vmn
 
     def last_vmn_dev(self, delay=0.):  # TODO: should compute std per stack because this does not account for SP...
-        v = self.select_samples(delay)
-        if self.sp is None:
-            self.last_sp(delay=delay)
-        if len(v) > 1:
-            return 100. * np.std(self.readings[v, 2] * (self.readings[v, 4] - self.sp)) / self.last_vmn(delay=delay)
-        else:
-            return np.nan
+        return self.pulse_statistics(delay=delay).vmn_dev
 
     def last_iab(self, delay=0.):
-        v = self.select_samples(delay)
-        if len(v) > 1:
-            return np.mean(self.readings[v, 3])
-        else:
-            return np.nan
+        return PulseStatistics(self.readings, delay=delay, sp=0.).iab
 
     def last_iab_dev(self, delay=0.):
-        v = self.select_samples(delay)
-        if len(v) > 1:
-            return 100. * np.std(self.readings[v, 3]) / self.last_iab(delay=delay)
-        else:
-            return np.nan
+        return PulseStatistics(self.readings, delay=delay, sp=0.).iab_dev
 
     def last_sp(self,
                 delay=0.):  # TODO: allow for different strategies for computing sp (i.e. when sp drift is not linear)
-        v = self.select_samples(delay)
-        if self.readings.shape == (0,) or len(self.readings[self.readings[:, 2] == 1, :]) < 1 or \
-                len(self.readings[self.readings[:, 2] == -1, :]) < 1:
+        stats = PulseStatistics(self.readings, delay=delay)
+        if stats.sp is None:
             self.exec_logger.warning('Unable to compute sp: readings should at least contain one positive and one '
                                      'negative pulse')
             return 0.
         else:
-            n_pulses = np.unique(self.readings[v, 1])
-            polarity = np.array([np.median(self.readings[v][self.readings[v, 1] == i, 2]) for i in n_pulses])
-            mean_vmn = []
-            for pulse in n_pulses:
-                mean_vmn.append(np.mean(self.readings[v][self.readings[v, 1] == pulse, 4]))
-            mean_vmn = np.array(mean_vmn)
-            self.sp = np.mean(mean_vmn[np.ix_(polarity == 1)] + mean_vmn[np.ix_(polarity == -1)]) / 2
-            # return sp
+            self.sp = stats.sp
 
     def _find_vab(self, vab, vab_req=None, iab_req=None, vmn_req=None, pab_req=None, min_agg=False, vab_min=None,
                   vab_max=None, iab_min=None, iab_max=None, vmn_min=None, vmn_max=None, pab_min=None, pab_max=None,
@@ -483,7 +1034,36 @@ class OhmPiHardware:
             #     float
             #         improved value for vab
         """
-        self.exec_logger.event(f'OhmPiHardware\tfind_vab\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin('OhmPiHardware', 'find_vab')
+        stats = PulseStatistics(self.readings, delay=delay, sp=0.)
+        for p_idx in stats.insufficient_pulses:
+            self.exec_logger.warning(f'Not enough values to estimate R and Rab in pulse {p_idx}!')
+        r_lower_bound, r_upper_bound, rab_lower_bound, rab_upper_bound = stats.bounds(
+            vab, iab_min=self.iab_min, vmn_min=self.vmn_min, n_sigma=n_sigma)
+
+        self.exec_logger.debug(f'r_lower_bound: {r_lower_bound}')
+        self.exec_logger.debug(f'r_upper_bound: {r_upper_bound}')
+        rab_min = np.min(rab_lower_bound[1:])  #
+        rab_max = np.max(rab_upper_bound[1:])  #
+        r_min = np.min(r_lower_bound[1:])
+        r_max = np.max(r_upper_bound[1:])
+        new_vab = self._vab_from_bounds(rab_min, rab_max, r_min, r_max, vab_req=vab_req, iab_req=iab_req,
+                                        vmn_req=vmn_req, pab_req=pab_req, min_agg=min_agg, vab_min=vab_min,
+                                        vab_max=vab_max, iab_min=iab_min, iab_max=iab_max, vmn_min=vmn_min,
+                                        vmn_max=vmn_max, pab_min=pab_min, pab_max=pab_max)
+        tracer.end('OhmPiHardware', 'find_vab')
+        return new_vab, rab_min, rab_max, r_min, r_max
+
+    def _vab_from_bounds(self, rab_min, rab_max, r_min, r_max, vab_req=None, iab_req=None, vmn_req=None,
+                         pab_req=None, min_agg=False, vab_min=None, vab_max=None, iab_min=None, iab_max=None,
+                         vmn_min=None, vmn_max=None, pab_min=None, pab_max=None):
+        """Computes the best injection voltage given bounds on Rab and R (see _find_vab)
+
+        Returns
+        -------
+        float
+            best value for vab
+        """
         # TODO: Check that min and max values are within system specs
         if vab_min is None:
             vab_min = self.vab_min
@@ -525,53 +1105,6 @@ class OhmPiHardware:
                 pab_req = pab_max
             else:
                 pab_req = pab_min
-        pulses = np.unique(self.readings[:, 1])
-        n_pulses = len(pulses)
-        iab_mean = np.zeros(n_pulses)
-        iab_std = np.zeros(n_pulses)
-        vmn_mean = np.zeros(n_pulses)
-        vmn_std = np.zeros(n_pulses)
-        iab_lower_bound = np.zeros(n_pulses)
-        iab_upper_bound = np.zeros(n_pulses)
-        vmn_lower_bound = np.zeros(n_pulses)
-        vmn_upper_bound = np.zeros(n_pulses)
-        rab_lower_bound = np.zeros(n_pulses)
-        rab_upper_bound = np.zeros(n_pulses)
-        r_lower_bound = np.zeros(n_pulses)
-        r_upper_bound = np.zeros(n_pulses)
-        for p_idx, p in enumerate(pulses):
-            yy = self.select_samples(delay)
-            zz = np.where(self.readings[yy, 1] == p)[0]
-            xx = yy[zz]
-            if p_idx > 0:
-                if len(xx) > 1:  # NOTE : remove condition on pulse 0 depending on the solution givent to issue#246
-                    iab = self.readings[xx, 3] / 1000.
-                    vmn = self.readings[xx, 4] / 1000. * self.readings[xx, 2]
-                    iab_mean[p_idx] = np.mean(iab)
-                    iab_std[p_idx] = np.std(iab)
-                    vmn_mean[p_idx] = np.mean(vmn)
-                    vmn_std[p_idx] = np.std(vmn)
-                    # bounds on iab
-                    iab_lower_bound[p_idx] = np.max([self.iab_min, iab_mean[p_idx] - n_sigma * iab_std[p_idx]])
-                    iab_upper_bound[p_idx] = np.max([self.iab_min, iab_mean[p_idx] + n_sigma * iab_std[p_idx]])
-                    # bounds on vmn
-                    vmn_lower_bound[p_idx] = np.max([self.vmn_min, vmn_mean[p_idx] - n_sigma * vmn_std[p_idx]])
-                    vmn_upper_bound[p_idx] = np.max([self.vmn_min, vmn_mean[p_idx] + n_sigma * vmn_std[p_idx]])
-                    # bounds on r
-                    r_lower_bound[p_idx] = np.max([0.1, np.abs(vmn_lower_bound[p_idx] / iab_upper_bound[p_idx])])
-                    r_upper_bound[p_idx] = np.max([0.1, np.abs(vmn_upper_bound[p_idx] / iab_lower_bound[p_idx])])
-                    # bounds on rab
-                    rab_lower_bound[p_idx] = np.max([r_lower_bound[p_idx], np.abs(vab / iab_upper_bound[p_idx])])
-                    rab_upper_bound[p_idx] = np.max([r_upper_bound[p_idx], np.abs(vab / iab_lower_bound[p_idx])])
-                else:
-                    self.exec_logger.warning(f'Not enough values to estimate R and Rab in pulse {p_idx}!')
-
-        self.exec_logger.debug(f'r_lower_bound: {r_lower_bound}')
-        self.exec_logger.debug(f'r_upper_bound: {r_upper_bound}')
-        rab_min = np.min(rab_lower_bound[1:])  #
-        rab_max = np.max(rab_upper_bound[1:])  #
-        r_min = np.min(r_lower_bound[1:])
-        r_max = np.max(r_upper_bound[1:])
         # _vmn_min = np.min(vmn_lower_bound)
         # _vmn_max = np.min(vmn_upper_bound)
         cond_vab_min = vab_min
@@ -617,13 +1150,29 @@ class OhmPiHardware:
         msg = f'Rab: [{rab_min / 1000.:5.3f}, {rab_max / 1000:5.3f}] kOhm, R: [{r_min:4.1f}, {r_max:4.1f}] Ohm'
         self.exec_logger.debug(msg)
         self.exec_logger.debug(f'Selecting Vab : {new_vab:.2f} V.')
-        self.exec_logger.event(f'OhmPiHardware\tfind_vab\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
-        return new_vab, rab_min, rab_max, r_min, r_max
+        return new_vab
+
+    def predict_vab(self, quad, **kwargs):
+        """Predicts the best injection voltage of a quadrupole from the previous measurements of the sequence.
+        Additional arguments (kwargs) are the requirements passed to _vab_from_bounds (vab_req, iab_max, ...).
+
+        Returns
+        -------
+        float, None
+            predicted vab, None if no prediction can be made
+        """
+        bounds = self.vab_predictor.predict(quad)
+        if bounds is None:
+            return None
+        vab = self._vab_from_bounds(*bounds, **kwargs)
+        self.exec_logger.debug(f'Predicted vab for {quad}: {vab:.2f} V (Rab: [{bounds[0]:.1f}, {bounds[1]:.1f}] ohm, '
+                               f'R: [{bounds[2]:.3f}, {bounds[3]:.3f}] ohm)')
+        return vab
 
     def compute_vab(self, vab_init=5., vab_min=None, vab_req=None, vab_max=None,
                     iab_min=None, iab_req=None, iab_max=None, vmn_min=None, vmn_req=None, vmn_max=None,
                     pab_min=None, pab_req=None, pab_max=None, min_agg=False, polarities=(1, -1), pulse_duration=0.1,
-                    delay=0.0, diff_vab_lim=2.5, n_steps=4, n_sigma=2., filename=None, quad_id=0):
+                    delay=0.0, diff_vab_lim=2.5, n_steps=4, n_sigma=2., filename=None, quad_id=0, cache_key=None):
         """ Estimates best Vab voltage based on different strategies.
         In "vmax" and "vmin" strategies, we iteratively increase/decrease the vab while
         checking vmn < vmn_max, vmn > vmn_min and iab < iab_max. We do a maximum of n_steps
@@ -654,6 +1203,10 @@ class OhmPiHardware:
         n_steps : int, optional
             Number of steps to try to find optimal vab. Each step last at least
             injection_duration*len(polarities) seconds.
+        cache_key : list of int, optional
+            Electrodes (ABMN) under which the vab found is stored in the vab cache. If the cache holds a vab
+            for these electrodes, the search starts from it instead of vab_init, and the cached entry is
+            invalidated if Rab drifted since it was stored.
 
         Returns
         -------
@@ -663,6 +1216,7 @@ class OhmPiHardware:
         """
 
         # TODO: Update docstring
+        self.last_vab_search = {}
 
         if not self.tx.pwr.voltage_adjustable:
             vab_opt = self.tx.pwr.voltage
@@ -686,6 +1240,12 @@ class OhmPiHardware:
         if pab_max is None:
             pab_max = self.pab_max
 
+        cached = None
+        if cache_key is not None:
+            cached = self.vab_cache.get(cache_key)
+            if cached is not None:
+                self.exec_logger.debug(f'Warm-starting vab search from cached vab {cached["vab"]:.2f} V')
+                vab_init = cached['vab']
         vab_init = np.min([vab_init, vab_max])
         vab_opt = np.abs(vab_init)
         polarities = list(polarities)
@@ -700,60 +1260,83 @@ class OhmPiHardware:
         vab_list = np.zeros(n_steps + 1) * np.nan
         vab_list[k] = vab_init
 
-        if self.pwr_state == 'off':
-            self.pwr_state = 'on'
-
-        # Switches on measuring LED
-        self.tx.measuring = 'on'
-        # first switch power on before setting a voltage to let it
-        # "decay" if needed (for dph5005)
-        self.tx.voltage = vab_init  # set the voltage (dph is off)
-        if self.tx.pwr.pwr_state == 'off':
-            self.tx.pwr.pwr_state = 'on'
-        self.tx.voltage = vab_init  # check voltage is well set (dph is on)
-
-        if 10. / self.rx.sampling_rate > pulse_duration:
-            sampling_rate = 10. / pulse_duration  # TODO: check this...
-        else:
-            sampling_rate = self.rx.sampling_rate
-        current, voltage = 0., 0.
-        diff_vab = np.inf
-        while (k < n_steps) and (diff_vab > diff_vab_lim) and (vab_list[k] < vab_max):
-            self.exec_logger.event(
-                f'OhmPiHardware\t_compute_vab_sleep\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
-            time.sleep(0.3)  # TODO: replace this by discharging DPS on resistor with relay on GPIO5
-                             # (at least for strategy vmin,
-                             # but might be useful in vmax when last vab too high...)
-            self.exec_logger.event(
-                f'OhmPiHardware\t_compute_vab_sleep\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
-            # self._gain_auto(vab=vab_list[k])
-            self._vab_pulses(vab_list[k], sampling_rate=sampling_rate,
-                             durations=[0.1, pulse_duration, pulse_duration], polarities=polarities)  # 0.1 step at polarity 0 could be removed given the solution to issue #246
-            new_vab, _, _, _, _ = self._find_vab(vab_list[k],
-                                                 vab_req=vab_req, iab_req=iab_req, vmn_req=vmn_req, pab_req=pab_req,
-                                                 vab_min=vab_min, vab_max=vab_max, iab_min=iab_min, iab_max=iab_max,
-                                                 vmn_min=vmn_min, vmn_max=vmn_max, pab_min=pab_min, pab_max=pab_max,
-                                                 min_agg=min_agg, n_sigma=n_sigma, delay=delay)
-            diff_vab = np.abs(new_vab - vab_list[k])
-            if diff_vab < diff_vab_lim:
-                self.exec_logger.debug('Compute_vab stopped on vab increase too small')
-            if filename is not None:
-                os.makedirs(filename[:-4], exist_ok=True)
-                readings = np.hstack((self.readings,np.ones((self.readings.shape[0], 1)) * vab_list[k]))
-                np.save(os.path.join(filename[:-4], f'quad{quad_id}_step{k}.npy'), readings)
-            k = k + 1
-            vab_list[k] = new_vab
-            if self.tx.pwr.voltage_adjustable:
-                self.tx.voltage = vab_list[k]
-        if k > n_steps:
-            self.exec_logger.debug('Compute_vab stopped on maximum number of steps reached')
-        vab_opt = vab_list[k]
+        with self.pwr_session():
+            # Switches on measuring LED
+            self.tx.measuring = 'on'
+            # first switch power on before setting a voltage to let it
+            # "decay" if needed (for dph5005)
+            self.tx.voltage = vab_init  # set the voltage (dph is off)
+            if self.tx.pwr.pwr_state == 'off':
+                self.tx.pwr.pwr_state = 'on'
+            self.tx.voltage = vab_init  # check voltage is well set (dph is on)
+
+            if 10. / self.rx.sampling_rate > pulse_duration:
+                sampling_rate = 10. / pulse_duration  # TODO: check this...
+            else:
+                sampling_rate = self.rx.sampling_rate
+            current, voltage = 0., 0.
+            diff_vab = np.inf
+            while (k < n_steps) and (diff_vab > diff_vab_lim) and (vab_list[k] < vab_max):
+                tracer.begin('OhmPiHardware', '_compute_vab_sleep')
+                time.sleep(0.3)  # TODO: replace this by discharging DPS on resistor with relay on GPIO5
+                                 # (at least for strategy vmin,
+                                 # but might be useful in vmax when last vab too high...)
+                tracer.end('OhmPiHardware', '_compute_vab_sleep')
+                # self._gain_auto(vab=vab_list[k])
+                self._vab_pulses(vab_list[k], sampling_rate=sampling_rate,
+                                 durations=[0.1, pulse_duration, pulse_duration], polarities=polarities)  # 0.1 step at polarity 0 could be removed given the solution to issue #246
+                new_vab, rab_min, rab_max, r_min, r_max = self._find_vab(
+                    vab_list[k], vab_req=vab_req, iab_req=iab_req, vmn_req=vmn_req, pab_req=pab_req, vab_min=vab_min,
+                    vab_max=vab_max, iab_min=iab_min, iab_max=iab_max, vmn_min=vmn_min, vmn_max=vmn_max,
+                    pab_min=pab_min, pab_max=pab_max, min_agg=min_agg, n_sigma=n_sigma, delay=delay)
+                diff_vab = np.abs(new_vab - vab_list[k])
+                if k == 0 and cached is not None and self.vab_cache.drifted(cache_key, rab_min, rab_max):
+                    # contact resistance changed since the vab was cached, the search goes on at least one more step
+                    self.exec_logger.debug(f'Rab drifted from [{cached["rab_min"]:.1f}, {cached["rab_max"]:.1f}] to '
+                                           f'[{rab_min:.1f}, {rab_max:.1f}] ohm, invalidating cached vab')
+                    self.vab_cache.invalidate(cache_key)
+                    diff_vab = np.inf
+                    if self.tx.pwr.voltage_adjustable and new_vab < vab_list[k]:
+                        # the pwr may have been left charged at the cached vab (see run_sequence), discharges it
+                        # before going on with a lower vab (relays of the quadrupole are kept closed)
+                        self.tx.pwr.pwr_state = 'off'
+                        self.tx.discharge_pwr(target=new_vab)
+                elif diff_vab < diff_vab_lim:
+                    self.exec_logger.debug('Compute_vab stopped on vab increase too small')
+                if filename is not None:
+                    os.makedirs(filename[:-4], exist_ok=True)
+                    readings = np.hstack((self.readings,np.ones((self.readings.shape[0], 1)) * vab_list[k]))
+                    np.save(os.path.join(filename[:-4], f'quad{quad_id}_step{k}.npy'), readings)
+                k = k + 1
+                vab_list[k] = new_vab
+                if self.tx.pwr.voltage_adjustable:
+                    self.tx.voltage = vab_list[k]
+            if k > n_steps:
+                self.exec_logger.debug('Compute_vab stopped on maximum number of steps reached')
+            vab_opt = vab_list[k]
+            if k > 0:
+                self.last_vab_search = {'vab': vab_opt, 'rab_min': rab_min, 'rab_max': rab_max, 'r_min': r_min,
+                                        'r_max': r_max, 'n_steps': k, 'cached': cached is not None,
+                                        'peaks': self.peak_signals(vab_list[k - 1])}
+                if cache_key is not None:
+                    self.vab_cache.update(cache_key, vab_opt, rab_min, rab_max, r_min, r_max)
 
         return vab_opt
 
-    def discharge_pwr(self):
+    def discharge_pwr(self, target=None):
+        """Discharges the pwr, down to target voltage [V] if the pwr is in 'feedback' discharge mode and its voltage can
+        be read, otherwise for the whole discharge latency whatever the target (see TxAbstract.discharge_pwr)
+
+        Returns
+        -------
+        float
+            Actual discharge duration [s]
+        """
+        self.release_relays()
+        discharge_time = 0.
         if self.tx.pwr.voltage_adjustable:
-            self.tx.discharge_pwr()
+            discharge_time = self.tx.discharge_pwr(target=target)
+        return discharge_time
 
     def _plot_readings(self, save_fig=False, filename=None):
         # Plot graphs
@@ -793,7 +1376,7 @@ class OhmPiHardware:
                          + np.mean(self.readings[self.readings[:, 2] == -1, 4])) / 2.
 
     def vab_square_wave(self, vab, cycle_duration, sampling_rate=None, cycles=3, polarity=1, duty_cycle=1.,
-                        append=False):
+                        append=False, expected=None):
         """Performs a Vab injection following a square wave and records full waveform data. Calls in function Vab_pulses.
 
         Parameters
@@ -812,41 +1395,43 @@ class OhmPiHardware:
             Duty cycle of injection wave
         append: bool, optional
             Default: False
+        expected: tuple, optional
+            Expected peak iab and vmn at vab (see expected_signals). If the gains can be planned from them,
+            _gain_auto is skipped.
         """
-        self.exec_logger.event(f'OhmPiHardware\tvab_square_wave\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
-        switch_pwr_off, switch_tx_pwr_off = False, False
+        tracer.begin('OhmPiHardware', 'vab_square_wave')
+        switch_pwr_off = False
         # switches tx pwr on if needed (relays switching dps on and off)
-        if self.pwr_state == 'off':
-            self.pwr_state = 'on'
-            switch_tx_pwr_off = True
+        with self.pwr_session():
+            # Switches on measuring LED
+            if self.tx.measuring == 'off':
+                self.tx.measuring = 'on'
 
-        # Switches on measuring LED
-        if self.tx.measuring == 'off':
-            self.tx.measuring = 'on'
-
-        if self.tx.pwr.pwr_state == 'off':
-            self.tx.pwr.pwr_state = 'on'
-            switch_pwr_off = True
+            if self.tx.pwr.pwr_state == 'off':
+                self.tx.pwr.pwr_state = 'on'
+                switch_pwr_off = True
 
-        self._gain_auto(vab=vab)
-        assert 0. <= duty_cycle <= 1.
-        if duty_cycle < 1.:
-            durations = [cycle_duration / 2 * duty_cycle, cycle_duration / 2 * (1. - duty_cycle)] * 2 * cycles
-            pol = [-int(polarity * np.heaviside(i % 2, -1.)) for i in range(2 * cycles)]
-            # pol = [-int(self.tx.polarity * np.heaviside(i % 2, -1.)) for i in range(2 * cycles)]
-            polarities = [0] * (len(pol) * 2)
-            polarities[0::2] = pol
-        else:
-            durations = [cycle_duration / 2] * 2 * cycles
-            polarities = [-int(polarity * np.heaviside(i % 2, -1.)) for i in range(2 * cycles)]
-        durations.insert(0, 0.2)
-        polarities.insert(0, 0)
-        self._vab_pulses(vab, durations, sampling_rate, polarities=polarities, append=append)
-        self.exec_logger.event(f'OhmPiHardware\tvab_square_wave\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
-        if switch_pwr_off:
-            self.tx.pwr.pwr_state = 'off'
-        if switch_tx_pwr_off:
-            self.pwr_state = 'off'
+            if expected is not None and self.plan_gains(*expected):
+                self.gain_stats['planned'] += 1
+            else:
+                self._gain_auto(vab=vab)
+                self.gain_stats['auto'] += 1
+            assert 0. <= duty_cycle <= 1.
+            if duty_cycle < 1.:
+                durations = [cycle_duration / 2 * duty_cycle, cycle_duration / 2 * (1. - duty_cycle)] * 2 * cycles
+                pol = [-int(polarity * np.heaviside(i % 2, -1.)) for i in range(2 * cycles)]
+                # pol = [-int(self.tx.polarity * np.heaviside(i % 2, -1.)) for i in range(2 * cycles)]
+                polarities = [0] * (len(pol) * 2)
+                polarities[0::2] = pol
+            else:
+                durations = [cycle_duration / 2] * 2 * cycles
+                polarities = [-int(polarity * np.heaviside(i % 2, -1.)) for i in range(2 * cycles)]
+            durations.insert(0, 0.2)
+            polarities.insert(0, 0)
+            self._vab_pulses(vab, durations, sampling_rate, polarities=polarities, append=append)
+            tracer.end('OhmPiHardware', 'vab_square_wave')
+            if switch_pwr_off:
+                self.tx.pwr.pwr_state = 'off'
         # Switches off measuring LED
         self.tx.measuring = 'off'
 
@@ -880,45 +1465,107 @@ class OhmPiHardware:
         if switch_pwr_off:
             self.tx.pwr.pwr_state = 'off'
 
+    def _run_waveform(self, durations, polarities, sampling_rate=None):
+        """Runs a waveform program (segments of given durations and polarities) while a single continuous sampler
+        records the whole train. Each segment is recorded as a new pulse.
+
+        Parameters
+        ----------
+        durations: list, np.ndarray
+            Duration of each segment in seconds.
+        polarities: list, np.ndarray
+            Polarity of each segment, either 1, 0 or -1.
+        sampling_rate: float, None, optional
+            Sampling rate for Rx readings
+        """
+        tracer.begin('OhmPiHardware', 'run_waveform')
+        first_pulse = self._pulse
+
+        def next_pulse(i):
+            self._pulse = first_pulse + i
+
+        readings = Thread(target=self._read_values, kwargs={'sampling_rate': sampling_rate, 'append': True})
+        readings.start()
+        self.segment_jitter = self.tx.inject_program(durations, polarities, on_segment=next_pulse)
+        readings.join()
+        self.tx.polarity = 0
+        self.exec_logger.debug(f'Waveform segments timing jitter: max {np.max(self.segment_jitter) * 1000.:.3f} ms, '
+                               f'mean {np.mean(self.segment_jitter) * 1000.:.3f} ms')
+        tracer.end('OhmPiHardware', 'run_waveform')
+
     def _vab_pulses(self, vab, durations, sampling_rate=None, polarities=None, append=False):
-        switch_pwr_off, switch_tx_pwr_off = False, False
+        switch_pwr_off = False
 
         # switches tx pwr on if needed (relays switching dps on and off)
-        if self.pwr_state == 'off':
-            self.pwr_state = 'on'
-            switch_tx_pwr_off = True
-        n_pulses = len(durations)
-        self.exec_logger.debug(f'n_pulses: {n_pulses}')
-        if self.tx.pwr.voltage_adjustable:
-            self.tx.voltage = vab
-        else:
-            vab = self.tx.voltage
+        with self.pwr_session():
+            n_pulses = len(durations)
+            self.exec_logger.debug(f'n_pulses: {n_pulses}')
+            if self.tx.pwr.voltage_adjustable:
+                self.tx.voltage = vab
+            else:
+                vab = self.tx.voltage
 
-        # switches dps pwr on if needed
-        if self.tx.pwr.pwr_state == 'off':
-            self.tx.pwr.pwr_state = 'on'
-            switch_pwr_off = True
+            # switches dps pwr on if needed
+            if self.tx.pwr.pwr_state == 'off':
+                self.tx.pwr.pwr_state = 'on'
+                switch_pwr_off = True
 
-        if sampling_rate is None:
-            sampling_rate = self.sampling_rate
-        if polarities is not None:
-            assert len(polarities) == n_pulses
-        else:
-            polarities = [-int(self.tx.polarity * np.heaviside(i % 2, -1.)) for i in
-                          range(n_pulses)]  # TODO: this doesn't work if tx.polarity=0 which is the case at init...
-        if not append:
-            self._clear_values()
-            self.sp = None  # re-initialise SP before new Vab_pulses
-        for i in range(n_pulses):
-            self._vab_pulse(vab=vab, duration=durations[i], sampling_rate=sampling_rate, polarity=polarities[i],
-                            append=True)
-        if switch_pwr_off:
-            self.tx.pwr.pwr_state = 'off'
-        if switch_tx_pwr_off:
-            self.pwr_state = 'off'
+            if sampling_rate is None:
+                sampling_rate = self.sampling_rate
+            if polarities is not None:
+                assert len(polarities) == n_pulses
+            else:
+                polarities = [-int(self.tx.polarity * np.heaviside(i % 2, -1.)) for i in
+                              range(n_pulses)]  # TODO: this doesn't work if tx.polarity=0 which is the case at init...
+            if not append:
+                self._clear_values()
+                self.sp = None  # re-initialise SP before new Vab_pulses
+            self._run_waveform(durations, polarities, sampling_rate=sampling_rate)
+            if switch_pwr_off:
+                self.tx.pwr.pwr_state = 'off'
+
+    def _reset_relay_stats(self):
+        self.relay_stats = {'operations': 0, 'saved_operations': 0, 'saved_activation_delays': 0,
+                            'saved_release_delays': 0}
+
+    def start_relay_diffing(self):
+        """Starts keeping relays closed between consecutive quadrupoles (e.g. within a sequence).
+        Switching a quadrupole off is then deferred, and switching the next one on only opens the relays not used
+        anymore before closing the new ones."""
+        self._reset_relay_stats()
+        self.diff_relays = True
+
+    def stop_relay_diffing(self):
+        """Opens all relays kept closed and stops diffing relay states.
 
-    def switch_mux(self, electrodes, roles=None, state='off', **kwargs):
+        Returns
+        -------
+        dict
+            Number of relay operations done and number of relay operations, activation and release delays saved
+        """
+        self.release_relays()
+        self.diff_relays = False
+        return self.relay_stats
+
+    def release_relays(self):
+        """Opens all relays kept closed between quadrupoles"""
+        if len(self._closed_relays) > 0:
+            electrodes, roles = zip(*self._closed_relays)
+            self.switch_mux(list(electrodes), roles=list(roles), state='off', diff_relays=False)
+
+    def _check_roles(self, electrodes, roles, bypass_check=False, bypass_ab_check=False):
+        """Checks that a quadrupole switched on does not short-circuit AB or connect AB to MN"""
+        elec = {r: [e for e, role in zip(electrodes, roles) if role[0] == r] for r in ['A', 'B', 'M', 'N']}
+        if not bypass_ab_check and np.isin(elec['A'], elec['B']).any():
+            return False
+        if not bypass_check and np.isin(elec['M'] + elec['N'], elec['A'] + elec['B']).any():
+            return False
+        return True
+
+    def switch_mux(self, electrodes, roles=None, state='off', diff_relays=None, **kwargs):
         """Switches on multiplexer relays for given quadrupole.
+        When diffing relay states, switching off is deferred until the next quadrupole is switched on, and only the
+        relays that differ between both quadrupoles are then switched (relays to open first, then relays to close).
 
         Parameters
         ----------
@@ -928,8 +1575,58 @@ class OhmPiHardware:
             List of roles of electrodes, optional
         state : str, optional
             Either 'on' or 'off'.
+        diff_relays : bool, optional
+            Diffs relay states with the relays currently closed. Defaults to self.diff_relays.
+        kwargs : optional
+            Passed to the switch method of the mux boards (e.g. bypass_check, bypass_ab_check or validated to skip
+            the checks of electrode roles of a quadrupole validated with its sequence).
         """
-        self.exec_logger.event(f'OhmPiHardware\tswitch_mux\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        if roles is None:
+            roles = ['A', 'B', 'M', 'N']
+        if diff_relays is None:
+            diff_relays = self.diff_relays
+        relays = set(zip(electrodes, roles))
+        if not diff_relays or len(electrodes) != len(roles):
+            status = self._switch_mux(electrodes, roles=roles, state=state, **kwargs)
+            self.relay_stats['operations'] += len(relays)
+            if state == 'on' and status:
+                self._closed_relays |= relays
+            elif state == 'off':
+                self._closed_relays -= relays
+            return status
+
+        if state == 'off':  # relays are kept closed until the next quadrupole is switched on
+            return True
+        if not kwargs.get('validated', False) and not self._check_roles(
+                electrodes, roles, bypass_check=kwargs.get('bypass_check', False),
+                bypass_ab_check=kwargs.get('bypass_ab_check', False)):
+            # let the mux boards reject the quadrupole
+            self.release_relays()
+            return self.switch_mux(electrodes, roles=roles, state=state, diff_relays=False, **kwargs)
+        if self.tx.polarity != 0:  # relays should never be switched while injecting
+            self.tx.polarity = 0
+        closed_relays = set(self._closed_relays)
+        to_open = closed_relays - relays
+        to_close = relays - closed_relays
+        status = True
+        if len(to_open) > 0:
+            e, r = zip(*to_open)
+            status = self.switch_mux(list(e), roles=list(r), state='off', diff_relays=False)
+        if status and len(to_close) > 0:
+            e, r = zip(*to_close)
+            status = self.switch_mux(list(e), roles=list(r), state='on', diff_relays=False, **kwargs)
+        if status:
+            # without diffing, the previous quadrupole would have been switched off then this one switched on
+            self.relay_stats['saved_operations'] += len(closed_relays) + len(relays) - len(to_open) - len(to_close)
+            self.relay_stats['saved_release_delays'] += int(len(closed_relays) > 0) - int(len(to_open) > 0)
+            self.relay_stats['saved_activation_delays'] += 1 - int(len(to_close) > 0)
+        else:  # relays may have been partially switched, open them all
+            self._closed_relays |= {k for k in to_close if k in self._cabling.keys()}
+            self.release_relays()
+        return status
+
+    def _switch_mux(self, electrodes, roles=None, state='off', **kwargs):
+        tracer.begin('OhmPiHardware', 'switch_mux')
         status = True
         if roles is None:
             roles = ['A', 'B', 'M', 'N']
@@ -949,27 +1646,29 @@ class OhmPiHardware:
                     status = False
             if status:
                 mux_workers = list(set(mux_workers))
-                b = Barrier(len(mux_workers) + 1)
-                self.mux_barrier = b
-                for idx, mux in enumerate(mux_workers):
-                    # Create a new thread to perform some work
-                    self.mux_boards[mux].barrier = b
-                    kwargs.update({'elec_dict': elec_dict, 'state': state})
-                    mux_workers[idx] = Thread(target=self.mux_boards[mux].switch,
-                                              kwargs=kwargs)  # TODO: handle minimum delay between two relays activation (to avoid lagging during test_mux at high speed)
-                    mux_workers[idx].start()
+                n_parties = len(mux_workers) + 1
+                if n_parties not in self._mux_barriers.keys():
+                    self._mux_barriers[n_parties] = Barrier(n_parties)
+                self.mux_barrier = self._mux_barriers[n_parties]
+                kwargs.update({'elec_dict': elec_dict, 'state': state})
+                for mux in mux_workers:
+                    self._mux_workers[mux].submit('switch', barrier=self.mux_barrier, **kwargs)  # TODO: handle minimum delay between two relays activation (to avoid lagging during test_mux at high speed)
                 try:
                     self.mux_barrier.wait()
-                    for mux_worker in mux_workers:
-                        mux_worker.join()
                 except BrokenBarrierError:
                     self.exec_logger.warning('Switching aborted')
                     status = False
+                self.mux_switch_status = {}
+                for mux in mux_workers:
+                    mux_status, duration = self._mux_workers[mux].result()
+                    self.mux_switch_status[mux] = {'status': mux_status, 'duration': duration}
+                if self.mux_barrier.broken:
+                    self.mux_barrier.reset()
         else:
             self.exec_logger.error(
                 f'Unable to switch {state} electrodes: number of electrodes and number of roles do not match!')
             status = False
-        self.exec_logger.event(f'OhmPiHardware\tswitch_mux\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.end('OhmPiHardware', 'switch_mux')
         return status
 
     def test_mux(self, channel=None, activation_time=1.0):  # TODO: add test in reverse order on each mux board
@@ -1010,13 +1709,35 @@ class OhmPiHardware:
             #     self.switch_mux(electrodes=[c[0]], roles=[c[1]], state='off')
         self.exec_logger.info('Test finished.')
         
-    def reset_mux(self):
+    def reset_mux(self, full=False):
         """Switches off all multiplexer relays.
+        Boards on different buses are reset concurrently, boards sharing a bus one after the other.
+
+        Parameters
+        ----------
+        full : bool, optional
+            Re-initializes the mux boards (full reset) instead of only switching their relays off. Boards which fail
+            to switch their relays off are fully reset anyway.
         """
 
         self.exec_logger.debug('Resetting all mux boards ...')
-        self.exec_logger.event(f'OhmPiHardware\treset_mux\tbegin\t{datetime.datetime.now(datetime.timezone.utc)}')
+        tracer.begin('OhmPiHardware', 'reset_mux')
+        buses = {}
         for mux_id, mux in self.mux_boards.items():  # noqa
-            self.exec_logger.debug(f'Resetting {mux_id}.')
-            mux.reset()
-        self.exec_logger.event(f'OhmPiHardware\treset_mux\tend\t{datetime.datetime.now(datetime.timezone.utc)}')
+            buses.setdefault(id(mux.bus), []).append(mux_id)
+
+        def reset_bus(mux_ids):
+            for mux_id in mux_ids:
+                self.exec_logger.debug(f'Resetting {mux_id}.')
+                if full:
+                    self.mux_boards[mux_id].reset()
+                else:
+                    self.mux_boards[mux_id].fast_reset()
+
+        resets = [Thread(target=reset_bus, args=(mux_ids,)) for mux_ids in buses.values()]
+        for reset in resets:
+            reset.start()
+        for reset in resets:
+            reset.join()
+        self._closed_relays = set()
+        tracer.end('OhmPiHardware', 'reset_mux')
@@ -6,6 +6,7 @@ from time import gmtime
 import logging
 from ohmpi.mqtt_handler import MQTTHandler
 from ohmpi.compressed_sized_timed_rotating_handler import CompressedSizedTimedRotatingFileHandler
+from ohmpi.tracing import tracer
 import sys
 from termcolor import colored
 
@@ -163,6 +164,13 @@ def setup_loggers(mqtt=True):
     exec_handler.setFormatter(exec_formatter)
     exec_logger.addHandler(exec_handler)
     exec_logger.setLevel(EXEC_LOGGING_CONFIG['log_file_logging_level'])
+    # execution spans (see ohmpi.tracing) are recorded and logged at EVENT level if tracing is set in the config or,
+    # by default, if the exec log level lets EVENT messages through
+    tracing = EXEC_LOGGING_CONFIG.get('tracing', None)
+    if tracing is None:
+        tracing = exec_logger.isEnabledFor(logging.EVENT)  # noqa
+    if tracing:
+        tracer.enable(logger=exec_logger)
 
     if logging_to_console:
         console_exec_handler = logging.StreamHandler(sys.stdout)
@@ -12,6 +12,7 @@ Olivier KAUFMANN (UMONS), Arnaud WATLET (UMONS) and Guillaume BLANCHY (FNRS/ULie
 import os
 import json
 from copy import deepcopy
+from contextlib import nullcontext
 import numpy as np
 import csv
 import time
@@ -38,8 +39,9 @@ except ModuleNotFoundError:
           'If you deleted your config.py file by mistake, you should find a backup in configs/config_backup.py')
     sys.exit(-1)
 from ohmpi.config import MQTT_CONTROL_CONFIG, OHMPI_CONFIG, EXEC_LOGGING_CONFIG
-from ohmpi.hardware_system import OhmPiHardware
-from ohmpi.sequence import create_sequence
+from ohmpi.hardware_system import OhmPiHardware, VabPredictor
+from ohmpi.sequence import create_sequence, ab_groups, optimize_ip, optimize_time, quadrupole_roles, \
+    validate_sequence
 from tqdm.auto import tqdm
 import warnings
 
@@ -77,6 +79,8 @@ class OhmPi(object):
             otherwise use other loggers only (print).
         """
         self._sequence = sequence
+        self._validated_sequence = None  # sequence checked by validate_sequence(), see _validate_sequence()
+        self.sequence_diagnostics = None  # per quadrupole diagnostics of the validated sequence
         self.nb_samples = 0
         self.status = 'idle'  # either running or idle
         self.thread = None  # contains the handle for the thread taking the measurement
@@ -225,7 +229,7 @@ class OhmPi(object):
                 w.writerow(last_measurement)
 
     def create_sequence(self, nelec, params=[('dpdp', 1, 8)], include_reciprocal=False,
-        opt_ip=False, opt_param={}, opt_plot=False, fpath=None):
+        opt_ip=False, opt_param={}, opt_plot=False, fpath=None, optimize=None):
         """Creates a sequence of quadrupole.Several type of
         sequence or sequence with different parameters can be combined together.
 
@@ -265,14 +269,75 @@ class OhmPi(object):
         fpath : str, optional
             Path where to save the sequence (including filename and extension). By
             default, sequence is saved in ohmpi/sequences/sequence.txt.
+        optimize : str, optional
+            Either 'ip' (same as opt_ip=True) or 'time' to order the sequence to minimize the acquisition time,
+            see ohmpi.sequence.create_sequence().
         """
         dfseq = create_sequence(nelec, params=params, include_reciprocal=include_reciprocal,
-            opt_ip=opt_ip, opt_param=opt_param, opt_plot=opt_plot)
-        self.sequence = dfseq.astype(int).values
+            opt_ip=opt_ip, opt_param=opt_param, opt_plot=opt_plot, optimize=optimize)
+        self.sequence = self._validate_sequence(dfseq.astype(int).values)
+        if self.sequence is None:
+            self.exec_logger.warning('Unable to create sequence')
+            return
         if fpath is None:
             fpath = 'sequences/sequence.txt'
         np.savetxt(fpath, self.sequence, delimiter=' ', fmt='%d')
 
+    @staticmethod
+    def _quadrupole_roles(quadrupole):
+        """Returns the roles of the electrodes of a quadrupole: A, B, M, N followed by M1, N1, M2, N2, ... for the MN
+        dipoles measured on the other channels of a multichannel RX.
+
+        Parameters
+        ----------
+        quadrupole : list of int
+            List of 4 + 2 * (number of channels - 1) integers representing the electrode numbers.
+
+        Returns
+        -------
+        roles : list of str
+        """
+        return quadrupole_roles(len(quadrupole))
+
+    def _validate_sequence(self, sequence):
+        """Validates a sequence once against the electrode roles and the cabling of the mux boards (see
+        ohmpi.sequence.validate_sequence()), so that the roles are not checked again each time a valid quadrupole is
+        switched. Invalid quadrupoles are logged and kept in the sequence (they are checked when switched as before),
+        but a sequence with A == B is rejected. The validated sequence is a read-only copy, so that it cannot be edited
+        in place once validated (set a new sequence instead).
+
+        Parameters
+        ----------
+        sequence : numpy.ndarray
+            Sequence of quadrupoles.
+
+        Returns
+        -------
+        sequence : numpy.ndarray, None
+            Validated sequence (read-only), None if rejected.
+        """
+        if sequence is None:
+            return None
+        sequence = np.array(sequence)
+        sequence.setflags(write=False)
+        diagnostics = validate_sequence(sequence, cabling=self._hw._cabling)
+        messages = {'ab': 'A == B', 'ab_mn': 'M or N used as A or B', 'mn': 'M == N',
+                    'range': 'electrode out of the range of the mux boards', 'cabling': 'electrode not in cabling'}
+        invalid = np.where(~diagnostics['valid'])[0]
+        for i in invalid[:20]:
+            issues = ', '.join([m for k, m in messages.items() if diagnostics[k][i]])
+            self.exec_logger.error(f'Invalid quadrupole {sequence[i]} at line {i + 1}: {issues}')
+        if len(invalid) > 20:
+            self.exec_logger.error(f'... and {len(invalid) - 20} other invalid quadrupoles')
+        if diagnostics['ab'].any():  # would create a short-circuit
+            return None
+        if len(invalid) > 0:
+            self.exec_logger.warning(f'{len(invalid)} of {len(sequence)} quadrupoles are invalid and will be checked '
+                                     f'when switched')
+        self.sequence_diagnostics = diagnostics
+        self._validated_sequence = sequence
+        return sequence
+
     @staticmethod
     def _find_identical_in_line(quads):
         """Finds quadrupole where A and B are identical.
@@ -296,7 +361,7 @@ class OhmPi(object):
 
         return output
 
-    def find_optimal_vab_for_sequence(self, which='mean', n_samples=10, **kwargs):
+    def find_optimal_vab_for_sequence(self, which='mean', n_samples=10, fast=True, **kwargs):
         """Find optimal Vab based on sample sequence in order to run
         sequence with fixed Vab. Returns Vab.
         
@@ -307,14 +372,23 @@ class OhmPi(object):
             If applying strategy "fixed" based on vab_opt, safer to chose "min"
         n_samples: int
             Number of samples to keep within loaded sequence.
+        fast : bool, optional
+            If True (default), only runs the vab search on the sampled quadrupoles (see survey_vab), otherwise runs
+            a full measurement with the vmax strategy on each of them.
         kwargs : dict, optional
-            kwargs passed to Ohmpi.run_sequence.
+            kwargs passed to Ohmpi.survey_vab (fast) or Ohmpi.run_measurement. In fast mode, run_measurement
+            arguments (e.g. strategy or nb_stack) are ignored with a warning.
 
         Returns
         -------
         Vab_opt : float [in V]
                 Optimal Vab value
         """
+        if fast:
+            survey = self.survey_vab(n_samples=n_samples, **kwargs)
+            vabs = survey['vabs'][np.isfinite(survey['vabs'])]
+            return getattr(np, which)(vabs) if len(vabs) > 0 else np.nan
+
         if self.sequence is None:
             self.sequence = np.array([[0, 0, 0, 0]])
         self.status = 'running'
@@ -325,7 +399,7 @@ class OhmPi(object):
             self._hw.pwr_state = 'on'
 
         for i in tqdm(range(0, n), "Sequence progress", unit='injection', ncols=100, colour='green'):
-            quad = sequence_sample[i, :]  # quadrupole
+            quad = sequence_sample[i, :4]  # quadrupole
             if self.status == 'stopping':
                 break
             acquired_data = self.run_measurement(quad=quad, strategy='vmax', **kwargs)
@@ -342,6 +416,95 @@ class OhmPi(object):
 
         return vab_opt
 
+    def survey_vab(self, n_samples=10, vab_init=None, pulse_duration=0.1, seed=None, cmd_id=None, **kwargs):
+        """Runs only the vab search of the vmax strategy (short pulses, no stacking nor full waveform) on a random
+        sample of the sequence, in a single power session and with relay diffing, to plan a sequence with a fixed
+        vab.
+
+        Parameters
+        ----------
+        n_samples : int, optional
+            Number of samples to keep within loaded sequence.
+        vab_init : float, optional
+            Initial voltage of the vab search [V]. Default value set by settings.
+        pulse_duration : float, optional
+            Duration of the pulses of the vab search [s].
+        seed : int, optional
+            Seed of the random sampling of the sequence (see ohmpi.utils.sequence_random_sampler).
+        cmd_id : str, optional
+            Unique command identifier.
+        kwargs : dict, optional
+            Limits of the vab search (vab_min, vab_max, iab_min, iab_max, vmn_min, vmn_max, pab_min, pab_max), default
+            values set by settings or system specs. Further arguments of compute_vab can be passed as a dictionary
+            with the 'compute_vab' key.
+
+        Returns
+        -------
+        survey : dict
+            'quads': sampled quadrupoles, 'vabs': vab found for each of them (nan if skipped), 'min', 'median' and
+            'max' vab, and 'array_types': the same statistics by array type, keyed by the (AB, BM, MN, AN) spacings.
+        """
+        if self.sequence is None:
+            self.sequence = np.array([[0, 0, 0, 0]])
+        if vab_init is None:
+            vab_init = self.settings.get('vab_init', 5.)
+        kwargs_compute_vab = {'vab_init': vab_init, 'vab_req': self._hw.vab_max, 'pulse_duration': pulse_duration}
+        limits = ['vab_min', 'vab_max', 'iab_min', 'iab_max', 'vmn_min', 'vmn_max', 'pab_min', 'pab_max']
+        ignored = [k for k in kwargs.keys() if k not in limits + ['compute_vab']]
+        if len(ignored) > 0:  # e.g. run_measurement arguments passed through find_optimal_vab_for_sequence
+            self.exec_logger.warning(f'survey_vab ignores {", ".join(ignored)} (only the vab search of the vmax '
+                                     f'strategy is run, see find_optimal_vab_for_sequence with fast=False)')
+        for k in limits:
+            if k in kwargs.keys():
+                kwargs_compute_vab[k] = kwargs[k]
+            elif k in self.settings:
+                kwargs_compute_vab[k] = self.settings[k]
+        kwargs_compute_vab.update(kwargs.get('compute_vab', {}))
+
+        self.status = 'running'
+        quads, labels, spacings = sequence_random_sampler(self.sequence, n_samples=n_samples, seed=seed,
+                                                          return_labels=True)
+        quads = quads[:, :4]  # vab only depends on first MN
+        n = quads.shape[0]
+        vabs = np.full(n, np.nan)
+        with self._pwr_session():
+            self._hw.start_relay_diffing()
+            try:
+                for i in tqdm(range(0, n), "Vab survey", unit='injection', ncols=100, colour='green'):
+                    quad = quads[i, :]
+                    if self.status == 'stopping':
+                        break
+                    if not self.switch_mux_on(quad, cmd_id=cmd_id):
+                        self.exec_logger.info(f'Skipping {quad}')
+                        continue
+                    vabs[i] = self._hw.compute_vab(**kwargs_compute_vab)
+                    self.switch_mux_off(quad, cmd_id)
+                    if self._hw.tx.pwr.voltage_adjustable and vabs[i] > kwargs_compute_vab['vab_init']:
+                        self._hw.tx.pwr.pwr_state = 'off'
+                        self._hw.discharge_pwr(target=kwargs_compute_vab['vab_init'])
+            finally:  # relays are released even if the survey is interrupted
+                self._hw.stop_relay_diffing()
+        self._hw.tx.measuring = 'off'
+
+        def summary(v):
+            v = v[np.isfinite(v)]
+            if len(v) == 0:
+                return {'min': np.nan, 'median': np.nan, 'max': np.nan, 'n': 0}
+            return {'min': np.min(v), 'median': np.median(v), 'max': np.max(v), 'n': len(v)}
+
+        array_types = {}
+        for label in np.unique(labels):
+            array_types[tuple(int(e) for e in spacings[label])] = summary(vabs[labels == label])  # AB, BM, MN, NA
+        survey = {'quads': quads, 'vabs': vabs, 'array_types': array_types}
+        survey.update({k: v for k, v in summary(vabs).items() if k != 'n'})
+        self.exec_logger.info(f"Vab survey on {summary(vabs)['n']} quadrupole(s): min {survey['min']:.2f} V, "
+                              f"median {survey['median']:.2f} V, max {survey['max']:.2f} V")
+
+        # reset to idle if we didn't interrupt the survey
+        if self.status != 'stopping':
+            self.status = 'idle'
+        return survey
+
     def get_data(self, survey_names=None, full=False, cmd_id=None):
         """Get available data.
         
@@ -455,7 +618,7 @@ class OhmPi(object):
         self.data_logger.info(json.dumps({'cmd_id': cmd_id, 'status': 'idle'}))
         self.exec_logger.debug(f'Status: {self.status}')
 
-    def load_sequence(self, filename: str, cmd_id=None):
+    def load_sequence(self, filename: str, cmd_id=None, optimize=None, opt_param=None):
         """Reads quadrupole sequence from file.
 
         Parameters
@@ -465,6 +628,12 @@ class OhmPi(object):
             Electrode index start at 1.
         cmd_id : str, optional
             Unique command identifier.
+        optimize : str, optional
+            Either 'ip' to order the sequence for induced polarization measurements (see
+            ohmpi.sequence.optimize_ip) or 'time' to order it to minimize the acquisition time (see
+            ohmpi.sequence.optimize_time), using the vab found during previous runs when known.
+        opt_param : dict, optional
+            Parameters passed to the optimization function.
 
         Returns
         -------
@@ -477,13 +646,11 @@ class OhmPi(object):
         if sequence is not None:
             self.exec_logger.debug(f'Sequence of {sequence.shape[0]:d} quadrupoles read.')
 
-        # locate lines where electrode A == electrode B
-        test_same_elec = self._find_identical_in_line(sequence)
+        if sequence is not None and optimize is not None:
+            sequence = self._optimize_sequence(sequence, optimize=optimize, opt_param=opt_param)
 
-        if len(test_same_elec) != 0:
-            for i in range(len(test_same_elec)):
-                self.exec_logger.error(f'An electrode index A == B detected at line {str(test_same_elec[i] + 1)}')
-            sequence = None
+        # checks electrode roles and cabling once (the sequence is rejected if A == B somewhere)
+        sequence = self._validate_sequence(sequence)
 
         if sequence is not None:
             self.exec_logger.info(f'Sequence {filename} of {sequence.shape[0]:d} quadrupoles loaded.')
@@ -491,6 +658,28 @@ class OhmPi(object):
             self.exec_logger.warning(f'Unable to load sequence {filename}')
         self.sequence = sequence
 
+    def _optimize_sequence(self, sequence, optimize='time', opt_param=None):
+        """Orders a sequence for IP measurements ('ip') or to minimize the acquisition time ('time')"""
+        opt_param = {} if opt_param is None else dict(opt_param)
+        if optimize == 'ip':
+            order, _ = optimize_ip(sequence, **opt_param)
+        elif optimize == 'time':
+            if 'vab' not in opt_param.keys():  # vab found during previous runs (see run_measurement)
+                vab = np.full(sequence.shape[0], np.nan)
+                for i, quad in enumerate(sequence):
+                    entry = self._hw.vab_cache.peek(quad[:4])
+                    if entry is not None:
+                        vab[i] = entry['vab']
+                opt_param['vab'] = vab
+            opt_param.setdefault('vab_max', self._hw.vab_max)
+            order, report = optimize_time(sequence, **opt_param)
+            self.exec_logger.info(f"Sequence ordered to save {report['saved_time']:.1f} s between quadrupoles "
+                                  f"(predicted {report['time']:.1f} s -> {report['optimized_time']:.1f} s)")
+        else:
+            self.exec_logger.warning(f'Unknown sequence optimization {optimize}')
+            return sequence
+        return sequence[order]
+
     def _process_commands(self, message: str):
         """Processes commands received from the controller(s).
 
@@ -686,10 +875,18 @@ class OhmPi(object):
         """
         self._hw._plot_readings(save_fig=save_fig, filename=filename)
 
+    def _pwr_session(self):
+        """Opens a power session (see OhmPiHardware.pwr_session) if the tx pwr is adjustable. Non-adjustable pwr
+        sources (e.g. batteries) are left as they are, as before power sessions."""
+        if self._hw.tx.pwr.voltage_adjustable:
+            return self._hw.pwr_session()
+        return nullcontext()
+
     def run_measurement(self, quad=None, nb_stack=None, injection_duration=None, duty_cycle=None,
                         strategy=None, vab_init=None, vab_min=None, vab_req=None, vab_max=None,
                         iab_min=None, iab_req=None, min_agg=None, iab_max=None, vmn_min=None, vmn_req=None, vmn_max=None,
-                        pab_min=None, pab_req=None, pab_max=None, cmd_id=None, **kwargs):
+                        pab_min=None, pab_req=None, pab_max=None, vab_cache=None, vab_predictor=None,
+                        gain_planning=None, cmd_id=None, **kwargs):
         # TODO: add sampling_interval -> impact on _hw.rx.sampling_rate (store the current value,
         #  change the _hw.rx.sampling_rate, do the measurement, reset the sampling_rate to the previous value)
         """Measures on a quadrupole and returns a dictionary with the transfer resistance.
@@ -698,7 +895,9 @@ class OhmPi(object):
         ----------
         quad : iterable (list of int)
             Quadrupole to measure, just for labelling. Only switch_mux_on/off
-            really create the route to the electrodes.
+            really create the route to the electrodes. With a multichannel RX, A, B, M, N can be followed by pairs of
+            electrodes (M1, N1, M2, N2, ...) measured on the other channels during the same injection (dipoles
+            padded with 0 are ignored).
         nb_stack : int, optional
             Number of stacks. A stack is considered two pulses (one
             positive, one negative). If 0, we will look for the best voltage.
@@ -757,15 +956,26 @@ class OhmPi(object):
             Default value set by config or boards specs
         min_agg : bool, optional, default: False
             when set to True, requested values are aggregated with the 'or' operator, when False with the 'and' operator
+        vab_cache : bool, optional
+            Whether to start the vab search from the vab found for the same quadrupole (ABMN) in a previous run. If
+            None, default is read from settings (False if not set).
+        vab_predictor : bool, optional
+            Whether to start the vab search from a vab predicted from the previous measurements of the sequence
+            (Rab measured on a shared current electrode and R scaled with the geometric factor). If None, default is
+            read from settings (False if not set).
+        gain_planning : bool, optional
+            Whether to set the TX and RX gains from the signals measured during the vab search (or, with vab_cache,
+            during the previous run on the quadrupole) instead of measuring them with extra pulses. If None,
+            default is read from settings (True if not set).
         cmd_id : str, optional
             Unique command identifier.
-        """
-        # check pwr is on, if not, let's turn it on
-        switch_power_off = False
-        if self._hw.tx.pwr.voltage_adjustable and self._hw.pwr_state == 'off':
-            self._hw.pwr_state = 'on'
-            switch_power_off = True
 
+        Returns
+        -------
+        d : dict
+            Measurement. When several MN dipoles are measured, the measurements of the other channels (see channel_mn)
+            are listed under the 'channels' key.
+        """
         self.exec_logger.debug('Starting measurement')
         self.exec_logger.debug('Waiting for data')
 
@@ -773,6 +983,24 @@ class OhmPi(object):
         if quad is None or len(self._hw.mux_boards) == 0:
             # overwrite quad as we cannot specify electrode number without mux
             quad = np.array([0, 0, 0, 0])
+        if len(quad) > 4:  # MN dipoles of the other channels of a multichannel RX
+            dipoles = np.reshape(quad[4:], (-1, 2))
+            dipoles = dipoles[np.any(dipoles != 0, axis=1)]  # dipoles padding the injection
+            if len(dipoles) > self._hw.rx.n_channels - 1:
+                self.exec_logger.warning(f'RX can only measure {self._hw.rx.n_channels} MN dipole(s) per injection, '
+                                         f'ignoring the other ones')
+                dipoles = dipoles[:self._hw.rx.n_channels - 1]
+            # each channel needs mux boards cabled with its own roles (M1, N1, ...), see
+            # configs/config_mb_2023__3_mux_2024_2roles_2channels.py
+            cabled_roles = set(role for _, role in self._hw._cabling.keys())
+            roles = quadrupole_roles(4 + 2 * len(dipoles))[4:]
+            for i in range(len(dipoles)):
+                if roles[2 * i] not in cabled_roles or roles[2 * i + 1] not in cabled_roles:
+                    self.exec_logger.warning(f'No mux cabled with the {roles[2 * i]} and {roles[2 * i + 1]} roles, '
+                                             f'ignoring the MN dipoles of channel {i + 1} and over')
+                    dipoles = dipoles[:i]
+                    break
+            quad = np.r_[quad[:4], dipoles.ravel()].astype(int)
         if nb_stack is None and 'nb_stack' in self.settings:
             nb_stack = self.settings['nb_stack']
         if injection_duration is None and 'injection_duration' in self.settings:
@@ -814,6 +1042,12 @@ class OhmPi(object):
                 min_agg = self.settings['min_agg']
             else:
                 min_agg = False
+        if vab_cache is None:
+            vab_cache = self.settings.get('vab_cache', False)
+        if vab_predictor is None:
+            vab_predictor = self.settings.get('vab_predictor', False)
+        if gain_planning is None:
+            gain_planning = self.settings.get('gain_planning', True)
         
         if self._hw.tx.pwr.voltage_adjustable is False:
             if strategy != 'fixed':
@@ -825,182 +1059,245 @@ class OhmPi(object):
             if vab_req is not None:
                 vab_init = 0.9 * vab_req
 
-        bypass_check = kwargs['bypass_check'] if 'bypass_check' in kwargs.keys() else False
-        d = {}
-
-        if self.switch_mux_on(quad, bypass_check=bypass_check, cmd_id=cmd_id):
-            if strategy == 'safe':
-                kwargs_compute_vab = kwargs.get('compute_vab', {})
-                kwargs_compute_vab['vab_init'] = vab_init
-                kwargs_compute_vab['vab_min'] = vab_min
-                kwargs_compute_vab['vab_req'] = vab_req
-                kwargs_compute_vab['vab_max'] = vab_max
-                kwargs_compute_vab['iab_min'] = iab_min
-                kwargs_compute_vab['iab_req'] = None
-                kwargs_compute_vab['iab_max'] = iab_max
-                kwargs_compute_vab['vmn_min'] = vmn_min
-                kwargs_compute_vab['vmn_req'] = None
-                kwargs_compute_vab['vmn_max'] = vmn_max
-                kwargs_compute_vab['pab_min'] = pab_min
-                kwargs_compute_vab['pab_req'] = None
-                kwargs_compute_vab['pab_max'] = pab_max
-                kwargs_compute_vab['min_agg'] = False
-
-            elif strategy == 'vmax':
-                kwargs_compute_vab = kwargs.get('compute_vab', {})
-                kwargs_compute_vab['vab_init'] = vab_init
-                kwargs_compute_vab['vab_min'] = vab_min
-                kwargs_compute_vab['vab_req'] = self._hw.vab_max
-                kwargs_compute_vab['vab_max'] = vab_max
-                kwargs_compute_vab['iab_min'] = iab_min
-                kwargs_compute_vab['iab_req'] = None
-                kwargs_compute_vab['iab_max'] = iab_max
-                kwargs_compute_vab['vmn_min'] = vmn_min
-                kwargs_compute_vab['vmn_req'] = None
-                kwargs_compute_vab['vmn_max'] = vmn_max
-                kwargs_compute_vab['pab_min'] = pab_min
-                kwargs_compute_vab['pab_req'] = None
-                kwargs_compute_vab['pab_max'] = pab_max
-                kwargs_compute_vab['min_agg'] = False
-
-            elif strategy == 'vmin':
-                kwargs_compute_vab = kwargs.get('compute_vab', {})
-                kwargs_compute_vab['vab_init'] = vab_init
-                kwargs_compute_vab['vab_min'] = None
-                kwargs_compute_vab['vab_req'] = None
-                kwargs_compute_vab['vab_max'] = vab_max
-                kwargs_compute_vab['iab_min'] = iab_min
-                kwargs_compute_vab['iab_req'] = None
-                kwargs_compute_vab['iab_max'] = iab_max
-                kwargs_compute_vab['vmn_min'] = vmn_min
-                kwargs_compute_vab['vmn_req'] = vmn_req
-                kwargs_compute_vab['vmn_max'] = vmn_max
-                kwargs_compute_vab['pab_min'] = pab_min
-                kwargs_compute_vab['pab_req'] = None
-                kwargs_compute_vab['pab_max'] = pab_max
-                kwargs_compute_vab['min_agg'] = False
-
-            elif strategy == 'flex':
-                kwargs_compute_vab = kwargs.get('compute_vab', {})
-                kwargs_compute_vab['vab_init'] = vab_init
-                kwargs_compute_vab['vab_min'] = vab_min
-                kwargs_compute_vab['vab_req'] = vab_req
-                kwargs_compute_vab['vab_max'] = vab_max
-                kwargs_compute_vab['iab_min'] = iab_min
-                kwargs_compute_vab['iab_req'] = iab_req
-                kwargs_compute_vab['iab_max'] = iab_max
-                kwargs_compute_vab['vmn_min'] = vmn_min
-                kwargs_compute_vab['vmn_req'] = vmn_req
-                kwargs_compute_vab['vmn_max'] = vmn_max
-                kwargs_compute_vab['pab_min'] = pab_min
-                kwargs_compute_vab['pab_req'] = pab_req
-                kwargs_compute_vab['pab_max'] = pab_max
-                kwargs_compute_vab['min_agg'] = min_agg
-
-            if strategy == 'fixed':
-                vab = vab_req
-            else:
-                vab = self._hw.compute_vab(**kwargs_compute_vab)
-
-            # time.sleep(0.5)  # to wait for pwr discharge
-            self._hw.vab_square_wave(vab, cycle_duration=injection_duration*2/duty_cycle, cycles=nb_stack,
-                                     duty_cycle=duty_cycle, **kwargs.get('vab_square_wave', {}))
-            self.switch_mux_off(quad, cmd_id)
+        # opens a power session (switches pwr on if it is off and back off at the end of the measurement, unless
+        # the measurement is part of a longer session such as a sequence)
+        with self._pwr_session():
+            bypass_check = kwargs['bypass_check'] if 'bypass_check' in kwargs.keys() else False
+            d = {}
+
+            if self.switch_mux_on(quad, bypass_check=bypass_check, cmd_id=cmd_id,
+                                  validated=kwargs.get('validated', False)):
+                if strategy == 'safe':
+                    kwargs_compute_vab = kwargs.get('compute_vab', {})
+                    kwargs_compute_vab['vab_init'] = vab_init
+                    kwargs_compute_vab['vab_min'] = vab_min
+                    kwargs_compute_vab['vab_req'] = vab_req
+                    kwargs_compute_vab['vab_max'] = vab_max
+                    kwargs_compute_vab['iab_min'] = iab_min
+                    kwargs_compute_vab['iab_req'] = None
+                    kwargs_compute_vab['iab_max'] = iab_max
+                    kwargs_compute_vab['vmn_min'] = vmn_min
+                    kwargs_compute_vab['vmn_req'] = None
+                    kwargs_compute_vab['vmn_max'] = vmn_max
+                    kwargs_compute_vab['pab_min'] = pab_min
+                    kwargs_compute_vab['pab_req'] = None
+                    kwargs_compute_vab['pab_max'] = pab_max
+                    kwargs_compute_vab['min_agg'] = False
+
+                elif strategy == 'vmax':
+                    kwargs_compute_vab = kwargs.get('compute_vab', {})
+                    kwargs_compute_vab['vab_init'] = vab_init
+                    kwargs_compute_vab['vab_min'] = vab_min
+                    kwargs_compute_vab['vab_req'] = self._hw.vab_max
+                    kwargs_compute_vab['vab_max'] = vab_max
+                    kwargs_compute_vab['iab_min'] = iab_min
+                    kwargs_compute_vab['iab_req'] = None
+                    kwargs_compute_vab['iab_max'] = iab_max
+                    kwargs_compute_vab['vmn_min'] = vmn_min
+                    kwargs_compute_vab['vmn_req'] = None
+                    kwargs_compute_vab['vmn_max'] = vmn_max
+                    kwargs_compute_vab['pab_min'] = pab_min
+                    kwargs_compute_vab['pab_req'] = None
+                    kwargs_compute_vab['pab_max'] = pab_max
+                    kwargs_compute_vab['min_agg'] = False
+
+                elif strategy == 'vmin':
+                    kwargs_compute_vab = kwargs.get('compute_vab', {})
+                    kwargs_compute_vab['vab_init'] = vab_init
+                    kwargs_compute_vab['vab_min'] = None
+                    kwargs_compute_vab['vab_req'] = None
+                    kwargs_compute_vab['vab_max'] = vab_max
+                    kwargs_compute_vab['iab_min'] = iab_min
+                    kwargs_compute_vab['iab_req'] = None
+                    kwargs_compute_vab['iab_max'] = iab_max
+                    kwargs_compute_vab['vmn_min'] = vmn_min
+                    kwargs_compute_vab['vmn_req'] = vmn_req
+                    kwargs_compute_vab['vmn_max'] = vmn_max
+                    kwargs_compute_vab['pab_min'] = pab_min
+                    kwargs_compute_vab['pab_req'] = None
+                    kwargs_compute_vab['pab_max'] = pab_max
+                    kwargs_compute_vab['min_agg'] = False
+
+                elif strategy == 'flex':
+                    kwargs_compute_vab = kwargs.get('compute_vab', {})
+                    kwargs_compute_vab['vab_init'] = vab_init
+                    kwargs_compute_vab['vab_min'] = vab_min
+                    kwargs_compute_vab['vab_req'] = vab_req
+                    kwargs_compute_vab['vab_max'] = vab_max
+                    kwargs_compute_vab['iab_min'] = iab_min
+                    kwargs_compute_vab['iab_req'] = iab_req
+                    kwargs_compute_vab['iab_max'] = iab_max
+                    kwargs_compute_vab['vmn_min'] = vmn_min
+                    kwargs_compute_vab['vmn_req'] = vmn_req
+                    kwargs_compute_vab['vmn_max'] = vmn_max
+                    kwargs_compute_vab['pab_min'] = pab_min
+                    kwargs_compute_vab['pab_req'] = pab_req
+                    kwargs_compute_vab['pab_max'] = pab_max
+                    kwargs_compute_vab['min_agg'] = min_agg
+
+                peaks = None  # peak signals measured on the quadrupole, used to plan gains
+                vab_search = kwargs.get('vab_search', None)  # vab search shared with other quadrupoles (same AB)
+                if strategy == 'fixed':
+                    vab = vab_req
+                elif vab_search is not None:
+                    vab = vab_search['vab']
+                    if vab_search.get('quad', None) == tuple(int(e) for e in quad[:4]):
+                        # vmn peaks only suit the MN dipole searched on, the gains of the others are planned from
+                        # their own signals (signal cache) or set with _gain_auto
+                        peaks = vab_search.get('peaks', None)
+                else:
+                    if vab_cache:
+                        # NOTE: keyed by ABMN for all strategies, as vmn_max also bounds the vab of vmax and safe
+                        # (a vab found on an MN dipole may exceed vmn_max on a closer one)
+                        kwargs_compute_vab['cache_key'] = quad[:4]
+                    predicted = False
+                    if vab_predictor:
+                        vab_pred = self._hw.predict_vab(quad[:4], **{k: kwargs_compute_vab[k] for k in [
+                            'vab_min', 'vab_req', 'vab_max', 'iab_min', 'iab_req', 'iab_max', 'vmn_min', 'vmn_req',
+                            'vmn_max', 'pab_min', 'pab_req', 'pab_max', 'min_agg']})
+                        if vab_pred is not None:
+                            kwargs_compute_vab['vab_init'] = vab_pred
+                            predicted = True
+                    vab = self._hw.compute_vab(**kwargs_compute_vab)
+                    if vab_predictor and not self._hw.last_vab_search.get('cached', True):
+                        self._hw.vab_predictor.record_steps(predicted, self._hw.last_vab_search['n_steps'])
+                    peaks = self._hw.last_vab_search.get('peaks', None)
+                    if kwargs.get('search_only', False):  # only runs the vab search (see run_sequence)
+                        self.switch_mux_off(quad, cmd_id)
+                        return {'vab_search': dict(self._hw.last_vab_search, vab=vab)}
+                quad_key = tuple(int(e) for e in quad)
+                if peaks is None and vab_cache:
+                    peaks = self._hw.signal_cache.get(quad_key, None)
+                expected = None
+                if gain_planning and peaks is not None:
+                    expected = self._hw.expected_signals(peaks, vab)
+
+                # time.sleep(0.5)  # to wait for pwr discharge
+                self._hw.vab_square_wave(vab, cycle_duration=injection_duration*2/duty_cycle, cycles=nb_stack,
+                                         duty_cycle=duty_cycle, expected=expected,
+                                         **kwargs.get('vab_square_wave', {}))
+                if vab_cache:
+                    self._hw.signal_cache[quad_key] = self._hw.peak_signals(vab)
+                self.switch_mux_off(quad, cmd_id)
+
+                if 'delay' in kwargs.keys():
+                    delay = kwargs['delay']
+                    if delay > injection_duration:
+                        delay = injection_duration
+                else:
+                    delay = injection_duration * 2/3  # TODO: check if this is ok and if last point is not taken at the end of injection
+                stats = self._hw.pulse_statistics(delay=delay)
+                Vmn = stats.vmn
+                Vmn_std = stats.vmn_dev
+                I = stats.iab
+                I_std = stats.iab_dev
+                R = stats.r
+                R_std = stats.r_dev
+                if vab_predictor:
+                    self._hw.vab_predictor.update(quad[:4], vab / I * 1000., R)  # I in mA
+
+                full_waveform = self._hw.full_waveform
+                #print('\nTX: {:.3f}, V at Iab: {:.3f}'.format(self._hw.tx.gain, I*2*50))
+                #print('Rx: {:.3f}, V at Vmn: {:.3f}'.format(self._hw.rx.gain, Vmn*self._hw.rx._dg411_gain)
+
+                # if strategy not safe, then switch dps off (button) in case following measurement within sequence
+                # TODO: check if this is the right strategy to handle DPS pwr state on/off after measurement
+                discharge_time = 0.
+                # the next measurement starts from vab_init, unless its starting vab is known (see run_sequence)
+                discharge_target = kwargs.get('discharge_target', vab_init)
+                if ((strategy == 'vmax' or strategy == 'vmin' or strategy == 'flex') and vab > discharge_target
+                        and kwargs.get('discharge', True)):  # if starting vab was higher actual vab, then turn pwr off
+                    self._hw.tx.pwr.pwr_state = 'off'
+
+                    # Discharge DPS capa down to the starting vab of the next measurement
+                    # TODO: For pwr_adjustable only and dependent on TX version so should be placed at PWR level (or at _hw level)
+                    discharge_time = self._hw.discharge_pwr(target=discharge_target)
+                    # self._hw.switch_mux(electrodes=quad[0:2], roles=['A', 'B'], state='on')
+                    # self._hw.tx.polarity = 1
+                    # time.sleep(1.0)
+                    # self._hw.tx.polarity = 0
+                    # self._hw.switch_mux(electrodes=quad[0:2], roles=['A', 'B'], state='off')
+
+                # battery voltage
+                if self._hw.tx.pwr.voltage_adjustable:
+                    # read stored value as requesting it each time takes time
+                    battv = self._hw.tx.pwr._battery_voltage
+                else:
+                    battv = np.nan
+
+                # increment injection_id
+                self.injection_id += 1
+
+                d = {
+                    "time": datetime.now().isoformat(),
+                    "a": quad[0],
+                    "b": quad[1],
+                    "m": quad[2],
+                    "n": quad[3],
+                    "injection_duration_[ms]": injection_duration * 1000.,  # NOTE: check this
+                    "vmn_[mV]": Vmn,
+                    "vmn_std_[%]": Vmn_std,
+                    "iab_[mA]": I,
+                    "iab_std_[%]": I_std,
+                    "r_[Ohm]": R,
+                    "r_std_[%]": R_std,
+                    "rab_[kOhm]": vab / I,
+                    "sp_[mV]": self._hw.sp,
+                    "nb_stack": nb_stack,
+                    "vab_[V]": vab,
+                    "channel_mn": 0,
+                    "injection_id": self.injection_id,
+                    "battery_voltage_tx_[V]": battv, 
+                    #"CPU temp [degC]": self._hw.ctl.cpu_temperature,
+                    "s_samples": stats.n_samples,
+                    "strategy": strategy,
+                    "discharge_time_[s]": discharge_time,
+                    "full_waveform": full_waveform,
+                 }
+
+                # one measurement per MN dipole measured on the other channels of a multichannel RX
+                rows = [d]
+                for channel in range(1, (len(quad) - 2) // 2):
+                    mn = quad[2 + 2 * channel:4 + 2 * channel]
+                    channel_stats = self._hw.pulse_statistics(delay=delay, channel=channel)
+                    if vab_predictor:
+                        self._hw.vab_predictor.update(np.r_[quad[:2], mn], vab / I * 1000., channel_stats.r)
+                    rows.append(dict(d, **{
+                        "m": mn[0],
+                        "n": mn[1],
+                        "vmn_[mV]": channel_stats.vmn,
+                        "vmn_std_[%]": channel_stats.vmn_dev,
+                        "r_[Ohm]": channel_stats.r,
+                        "r_std_[%]": channel_stats.r_dev,
+                        "sp_[mV]": channel_stats.sp,
+                        "channel_mn": channel,
+                        "s_samples": channel_stats.n_samples,
+                        "full_waveform": self._hw.channel_full_waveform(channel),
+                    }))
+
+                for row in rows:
+                    # to the data logger
+                    dd = row.copy()
+                    dd.pop('full_waveform')  # too much for logger
+                    dd.update({'a': str(dd['a'])})
+                    dd.update({'b': str(dd['b'])})
+                    dd.update({'m': str(dd['m'])})
+                    dd.update({'n': str(dd['n'])})
+
+                    # round float to 2 decimal
+                    for key in dd.keys():  # Check why this is applied on keys and not values...
+                        if isinstance(dd[key], float):
+                            dd[key] = float(np.round(dd[key], 3))  # convert back to python float otherwise (numpy >= 2.0.0) gives np.float64()
+                    dd['cmd_id'] = str(cmd_id)
+
+                    # log data to the data logger
+                    print('\r')
+                    self.data_logger.info(dd)
+                if len(rows) > 1:
+                    d = dict(d, channels=rows[1:])
 
-            if 'delay' in kwargs.keys():
-                delay = kwargs['delay']
-                if delay > injection_duration:
-                    delay = injection_duration
-            else:
-                delay = injection_duration * 2/3  # TODO: check if this is ok and if last point is not taken at the end of injection
-            x = self._hw.select_samples(delay)
-            Vmn = self._hw.last_vmn(delay=delay)
-            Vmn_std = self._hw.last_vmn_dev(delay=delay)
-            I = self._hw.last_iab(delay=delay)
-            I_std = self._hw.last_iab_dev(delay=delay)
-            R = self._hw.last_resistance(delay=delay)
-            R_std = self._hw.last_dev(delay=delay)
-
-            # multiply current by polarity
-            full_waveform = np.copy(self._hw.readings[:, [0, -2, -1, 2]])
-            ie = self._hw.readings[:, 2] != 0
-            full_waveform[ie, 1] = full_waveform[ie, 1] * self._hw.readings[ie, 2]
-            #print('\nTX: {:.3f}, V at Iab: {:.3f}'.format(self._hw.tx.gain, I*2*50))
-            #print('Rx: {:.3f}, V at Vmn: {:.3f}'.format(self._hw.rx.gain, Vmn*self._hw.rx._dg411_gain)
-
-            # battery voltage
-            if self._hw.tx.pwr.voltage_adjustable:
-                # read stored value as requesting it each time takes time
-                battv = self._hw.tx.pwr._battery_voltage
             else:
-                battv = np.nan
-
-            # increment injection_id
-            self.injection_id += 1
-
-            d = {
-                "time": datetime.now().isoformat(),
-                "a": quad[0],
-                "b": quad[1],
-                "m": quad[2],
-                "n": quad[3],
-                "injection_duration_[ms]": injection_duration * 1000.,  # NOTE: check this
-                "vmn_[mV]": Vmn,
-                "vmn_std_[%]": Vmn_std,
-                "iab_[mA]": I,
-                "iab_std_[%]": I_std,
-                "r_[Ohm]": R,
-                "r_std_[%]": R_std,
-                "rab_[kOhm]": vab / I,
-                "sp_[mV]": self._hw.sp,
-                "nb_stack": nb_stack,
-                "vab_[V]": vab,
-                "channel_mn": 0,
-                "injection_id": self.injection_id,
-                "battery_voltage_tx_[V]": battv, 
-                #"CPU temp [degC]": self._hw.ctl.cpu_temperature,
-                "s_samples": len(self._hw.readings[x, 2]),  # TODO: use only samples after a delay in each pulse
-                "strategy": strategy,
-                "full_waveform": full_waveform,
-             }
-
-            # to the data logger
-            dd = d.copy()
-            dd.pop('full_waveform')  # too much for logger
-            dd.update({'a': str(dd['a'])})
-            dd.update({'b': str(dd['b'])})
-            dd.update({'m': str(dd['m'])})
-            dd.update({'n': str(dd['n'])})
-
-            # round float to 2 decimal
-            for key in dd.keys():  # Check why this is applied on keys and not values...
-                if isinstance(dd[key], float):
-                    dd[key] = float(np.round(dd[key], 3))  # convert back to python float otherwise (numpy >= 2.0.0) gives np.float64()
-            dd['cmd_id'] = str(cmd_id)
-
-            # log data to the data logger
-            print('\r')
-            self.data_logger.info(dd)
-
-            # if strategy not safe, then switch dps off (button) in case following measurement within sequence
-            # TODO: check if this is the right strategy to handle DPS pwr state on/off after measurement
-            if (strategy == 'vmax' or strategy == 'vmin' or strategy == 'flex') and vab > vab_init :  # if starting vab was higher actual vab, then turn pwr off
-                self._hw.tx.pwr.pwr_state = 'off'
-
-                # Discharge DPS capa
-                # TODO: For pwr_adjustable only and dependent on TX version so should be placed at PWR level (or at _hw level)
-                self._hw.discharge_pwr()
-                # self._hw.switch_mux(electrodes=quad[0:2], roles=['A', 'B'], state='on')
-                # self._hw.tx.polarity = 1
-                # time.sleep(1.0)
-                # self._hw.tx.polarity = 0
-                # self._hw.switch_mux(electrodes=quad[0:2], roles=['A', 'B'], state='off')
-        else:
-            self.exec_logger.info(f'Skipping {quad}')
-
-        # if power was off before measurement, let's turn if off
-        if switch_power_off:
-            self._hw.pwr_state = 'off'
+                self.exec_logger.info(f'Skipping {quad}')
 
         return d
 
@@ -1034,6 +1331,8 @@ class OhmPi(object):
         sequence_delay = int(sequence_delay)
         if nb_meas is None:
             nb_meas = self.settings['nb_meas']
+        # in monitoring mode, the vab search of each quadrupole can start from the vab found in the previous run
+        kwargs.setdefault('vab_cache', self.settings.get('vab_cache', False))
         self.status = 'running'
         self.exec_logger.debug(f'Status: {self.status}')
         self.exec_logger.debug(f'Measuring sequence: {self.sequence}')
@@ -1069,8 +1368,33 @@ class OhmPi(object):
         self.thread = Thread(target=func)
         self.thread.start()
 
+    def _search_group_vab(self, quads, **kwargs):
+        """Runs the vab search once for quadrupoles sharing the same AB dipole. The search is run on the quadrupole
+        with the smallest geometric factor, which is expected to have the largest vmn, so that the vab found suits
+        all of them as long as vab is bounded by vmn_max (vmax and safe strategies). Additional arguments (kwargs) are
+        passed to run_measurement().
+
+        Parameters
+        ----------
+        quads : numpy.ndarray
+            Quadrupoles sharing the same AB dipole.
+
+        Returns
+        -------
+        dict, None
+            vab search (see OhmPiHardware.last_vab_search), None if the search failed
+        """
+        k = np.array([np.abs(VabPredictor.geometric_factor(quad)) for quad in quads])
+        k[~np.isfinite(k)] = np.inf
+        quad = quads[np.argmin(k)]
+        d = self.run_measurement(quad=quad, search_only=True, **kwargs)
+        vab_search = d.get('vab_search', None)
+        if vab_search is None or not np.isfinite(vab_search['vab']):
+            return None
+        return dict(vab_search, quad=tuple(int(e) for e in quad[:4]))
+
     def run_sequence(self, fw_in_zip=None, cmd_id=None, save_strategy_fw=False,
-        export_path=None, **kwargs):
+        export_path=None, diff_relays=None, group_ab=None, **kwargs):
         """Runs sequence synchronously (=blocking on main thread).
            Additional arguments (kwargs) are passed to run_measurement().
 
@@ -1083,16 +1407,39 @@ class OhmPi(object):
             Whether to save the strategy used.
         export_path : str, optional
             Path where to save the results. Default taken from settings.json.
+        diff_relays : bool, optional
+            Whether to keep relays shared by consecutive quadrupoles closed and only switch the other ones.
+            If None, default is read from settings (False if not set).
+        group_ab : bool, optional
+            Whether to run the vab search once for consecutive quadrupoles sharing the same AB dipole, and measure
+            them with the same vab, switching only the MN relays in between (with diff_relays). Only used with the
+            vmax and safe strategies. If None, default is read from settings (False if not set).
         cmd_id : str, optional
             Unique command identifier.
         """
         # check arguments
         if fw_in_zip is None:
             fw_in_zip = self.settings['fw_in_zip']
+        if diff_relays is None:
+            diff_relays = self.settings.get('diff_relays', False)
+        if group_ab is None:
+            group_ab = self.settings.get('group_ab', False)
+        strategy = kwargs.get('strategy', self.settings.get('strategy', None))
+        if strategy == 'fixed' or self.sequence is None or not self._hw.tx.pwr.voltage_adjustable:
+            group_ab = False  # no vab search to share
+        elif group_ab and strategy not in ['vmax', 'safe']:
+            # NOTE: the vab searched on the largest vmn only suits the other MN dipoles when bounded by vmn_max, with
+            # vmn_min or vmn_req (vmin and flex) it would be too low for them
+            self.exec_logger.warning(f'AB grouping is not supported with the {strategy} strategy')
+            group_ab = False
+        vab_cache = kwargs.get('vab_cache', self.settings.get('vab_cache', False))
+        # roles of the quadrupoles validated at load time are not checked again when switched (the validated
+        # sequence is read-only, see _validate_sequence)
+        valid = None
+        if (self.sequence is not None and self.sequence is self._validated_sequence
+                and not self.sequence.flags.writeable):
+            valid = self.sequence_diagnostics['valid']
 
-        # switch power on
-        if self._hw.tx.pwr.voltage_adjustable:
-            self._hw.pwr_state = 'on'
         self.status = 'running'
         self.exec_logger.debug(f'Status: {self.status}')
         self.exec_logger.debug(f'Measuring sequence: {self.sequence}')
@@ -1112,26 +1459,97 @@ class OhmPi(object):
         else:
             n = self.sequence.shape[0]
         self.injection_id = 0  # reset injection_id
-        for i in tqdm(range(0, n), "Sequence progress", unit='injection', ncols=100, colour='green'):
-            if self.sequence is None:
-                quad = np.array([0, 0, 0, 0])
-            else:
-                quad = self.sequence[i, :]  # quadrupole
-            if self.status == 'stopping':
-                break
-            # run a measurement
-            if save_strategy_fw:
-                kwargs['compute_vab'] = {'quad_id': i, 'filename': filename}
-            acquired_data = self.run_measurement(quad=quad, **kwargs)
-
-            # add command_id in dataset
-            acquired_data.update({'cmd_id': cmd_id})
-            # log data to the data logger
-            # self.data_logger.info(f'{acquired_data}')  # NOTE: It could be useful to keep the cmd_id in the
-            # save data and print in a text file
-            self.append_and_save(filename, acquired_data, fw_in_zip=fw_in_zip)
-            self.exec_logger.debug(f'quadrupole {i + 1:d}/{n:d}')
-        self._hw.pwr_state = 'off'
+        self._hw.vab_cache.reset_stats()
+        self._hw.vab_predictor.reset()
+        self._hw.reset_gain_stats()
+        group_stops = {}  # stop index of the groups of quadrupoles sharing AB by start index
+        if group_ab:
+            group_stops = {start: stop for start, stop in ab_groups(self.sequence) if stop - start > 1}
+        group_stats = {'searches': 0, 'grouped': 0, 'search_time': 0.}
+        vab_search = None
+        group_stop = 0
+        # a single power session for the whole sequence so that pwr latency is only paid once
+        self._hw.reset_pwr_stats()
+        with self._pwr_session():
+            if diff_relays:
+                self._hw.start_relay_diffing()
+            try:
+                for i in tqdm(range(0, n), "Sequence progress", unit='injection', ncols=100, colour='green'):
+                    if self.sequence is None:
+                        quad = np.array([0, 0, 0, 0])
+                    else:
+                        quad = self.sequence[i, :]  # quadrupole
+                    if valid is not None:
+                        kwargs['validated'] = bool(valid[i])
+                    if self.status == 'stopping':
+                        break
+                    # run a measurement
+                    if save_strategy_fw:
+                        kwargs['compute_vab'] = {'quad_id': i, 'filename': filename}
+                    if i >= group_stop:
+                        vab_search = None
+                        if i in group_stops.keys():  # first quadrupole of a group sharing AB
+                            group_stop = group_stops[i]
+                            t_search = time.time()
+                            vab_search = self._search_group_vab(self.sequence[i:group_stop], **dict(
+                                kwargs, validated=valid is not None and bool(valid[i:group_stop].all())))
+                            group_stats['searches'] += 1
+                            group_stats['search_time'] += time.time() - t_search
+                    # the pwr is only discharged down to the vab the next quadrupole starts from when its own vab
+                    # search is warm-started from the cache (see compute_vab), otherwise down to vab_init
+                    next_vab = {}
+                    if (vab_cache and strategy in ['vmax', 'vmin', 'flex'] and self.sequence is not None
+                            and i + 1 < n and i + 1 >= group_stop and i + 1 not in group_stops.keys()):
+                        entry = self._hw.vab_cache.peek(self.sequence[i + 1, :4])
+                        if entry is not None:
+                            next_vab['discharge_target'] = entry['vab']
+                    if vab_search is not None:
+                        # the pwr is only discharged after the last quadrupole of the group
+                        acquired_data = self.run_measurement(quad=quad, vab_search=vab_search,
+                                                             discharge=(i == group_stop - 1),
+                                                             **dict(kwargs, **next_vab))
+                        group_stats['grouped'] += 1
+                    else:
+                        acquired_data = self.run_measurement(quad=quad, **dict(kwargs, **next_vab))
+
+                    # a multichannel injection returns the measurements of the other MN dipoles under 'channels'
+                    for data in [acquired_data] + acquired_data.pop('channels', []):
+                        # add command_id in dataset
+                        data.update({'cmd_id': cmd_id})
+                        # log data to the data logger
+                        # self.data_logger.info(f'{acquired_data}')  # NOTE: It could be useful to keep the cmd_id
+                        # in the save data and print in a text file
+                        self.append_and_save(filename, data, fw_in_zip=fw_in_zip)
+                    self.exec_logger.debug(f'quadrupole {i + 1:d}/{n:d}')
+            finally:  # relays are released even if the sequence is interrupted
+                if diff_relays:
+                    relay_stats = self._hw.stop_relay_diffing()
+                    n_operations = relay_stats['operations'] + relay_stats['saved_operations']
+                    self.exec_logger.info(f"Relay state diffing saved {relay_stats['saved_operations']} relay "
+                                          f"operations (out of {n_operations}), "
+                                          f"{relay_stats['saved_activation_delays']} activation delays and "
+                                          f"{relay_stats['saved_release_delays']} release delays")
+        self.exec_logger.info(f"Power sessions: {self._hw.pwr_stats['warm_ups']} warm-up(s), "
+                              f"{self._hw.pwr_stats['wait_time']:.1f} s waiting for power")
+        vab_cache_stats = self._hw.vab_cache.stats
+        if vab_cache_stats['hits'] + vab_cache_stats['misses'] > 0:
+            self.exec_logger.info(f"Vab cache: {vab_cache_stats['hits']} hit(s), {vab_cache_stats['misses']} miss(es), "
+                                  f"{vab_cache_stats['invalidations']} invalidation(s)")
+        vab_predictor_stats = self._hw.vab_predictor.stats
+        if vab_predictor_stats['predicted'] > 0:
+            self.exec_logger.info(f"Vab predictor: {vab_predictor_stats['predicted']} vab search(es) started from a "
+                                  f"predicted vab in {vab_predictor_stats['predicted_steps']} step(s), "
+                                  f"{self._hw.vab_predictor.saved_steps:.0f} step(s) saved")
+        if group_stats['searches'] > 0:
+            elapsed = time.time() - t0
+            saved_time = (group_stats['grouped'] - group_stats['searches']) * group_stats['search_time'] / \
+                group_stats['searches']
+            self.exec_logger.info(f"AB grouping: {group_stats['searches']} vab search(es) for "
+                                  f"{group_stats['grouped']} quadrupole(s), about {saved_time:.1f} s saved "
+                                  f"({(elapsed + saved_time) / elapsed:.2f}x throughput)")
+        if self._hw.gain_stats['planned'] > 0:
+            self.exec_logger.info(f"Gain planning: gains of {self._hw.gain_stats['planned']} measurement(s) planned, "
+                                  f"{self._hw.gain_stats['auto']} measured with extra pulses")
 
         # file management
         if fw_in_zip:
@@ -1186,93 +1604,85 @@ class OhmPi(object):
                 DeprecationWarning)
             vab = tx_volt
 
-        # check pwr is on, if not, let's turn it on
-        switch_tx_pwr_off = False
-        if self._hw.pwr_state == 'off':
-            self._hw.pwr_state = 'on'
-            switch_tx_pwr_off = True
-
-        # create custom sequence where MN == AB
-        # we only check the electrodes which are in the sequence (not all might be connected)
-        if couple is None:
-            if self.sequence is None:
-                quads = np.array([[1, 2, 0, 0]], dtype=np.uint32)
+        # opens a power session (switches pwr on if it is off and back off at the end, unless already on)
+        with self._pwr_session():
+            # create custom sequence where MN == AB
+            # we only check the electrodes which are in the sequence (not all might be connected)
+            if couple is None:
+                if self.sequence is None:
+                    quads = np.array([[1, 2, 0, 0]], dtype=np.uint32)
+                else:
+                    elec = np.sort(np.unique(self.sequence.flatten()))  # assumed order
+                    quads = np.vstack([
+                        elec[:-1],
+                        elec[1:],
+                        elec[:-1],
+                        elec[1:],
+                    ]).T
             else:
-                elec = np.sort(np.unique(self.sequence.flatten()))  # assumed order
-                quads = np.vstack([
-                    elec[:-1],
-                    elec[1:],
-                    elec[:-1],
-                    elec[1:],
-                ]).T
-        else:
-            quads = np.array([[couple[0], couple[1], 0, 0]], dtype=np.uint32)
+                quads = np.array([[couple[0], couple[1], 0, 0]], dtype=np.uint32)
            
-        # create filename to store RS
-        export_path_rs = self.settings['export_path'].replace('.csv', '') \
-                         + '_' + datetime.now().strftime('%Y%m%dT%H%M%S') + '_rs.csv'
-
-        # perform RS check
-        self.status = 'running'
-        self.reset_mux()
-
-        # switches off measuring LED
-        self._hw.tx.measuring = 'on'
-
-        # turn dps_pwr_on if needed
-        switch_pwr_off = False
-
-        if self._hw.pwr.pwr_state == 'off':
-            self._hw.pwr.pwr_state = 'on'
-            switch_pwr_off = True
-
-        # measure all quad of the RS sequence
-        for i in range(0, quads.shape[0]):
-            quad = quads[i, :]  # quadrupole
-            self._hw.switch_mux(electrodes=list(quads[i, :2]), roles=['A', 'B'], state='on')
-            self._hw._vab_pulse(duration=0.2, vab=vab)
-            current = self._hw.readings[-1, 3]
-            vab = self._hw.tx.pwr.voltage
-            time.sleep(0.2)
-
-            # compute resistance measured (= contact resistance)
-            rab = abs(vab*1000 / current) / 1000  # kOhm
+            # create filename to store RS
+            export_path_rs = self.settings['export_path'].replace('.csv', '') \
+                             + '_' + datetime.now().strftime('%Y%m%dT%H%M%S') + '_rs.csv'
+
+            # perform RS check
+            self.status = 'running'
+            self.reset_mux()
+
+            # switches off measuring LED
+            self._hw.tx.measuring = 'on'
+
+            # turn dps_pwr_on if needed
+            switch_pwr_off = False
+
+            if self._hw.pwr.pwr_state == 'off':
+                self._hw.pwr.pwr_state = 'on'
+                switch_pwr_off = True
+
+            # measure all quad of the RS sequence
+            for i in range(0, quads.shape[0]):
+                quad = quads[i, :]  # quadrupole
+                self._hw.switch_mux(electrodes=list(quads[i, :2]), roles=['A', 'B'], state='on')
+                self._hw._vab_pulse(duration=0.2, vab=vab)
+                current = self._hw.readings[-1, 3]
+                vab = self._hw.tx.pwr.voltage
+                time.sleep(0.2)
+
+                # compute resistance measured (= contact resistance)
+                rab = abs(vab*1000 / current) / 1000  # kOhm
             
-            # create a message as dictionnary to be used by the html interface
-            msg = {
-                'rsdata': {
-                    'A': int(quad[0]),
-                    'B': int(quad[1]),
-                    'rs': np.round(rab, 3),  # in kOhm
+                # create a message as dictionnary to be used by the html interface
+                msg = {
+                    'rsdata': {
+                        'A': int(quad[0]),
+                        'B': int(quad[1]),
+                        'rs': np.round(rab, 3),  # in kOhm
+                    }
                 }
-            }
-            self.data_logger.info(json.dumps(msg))
-
-            # if contact resistance = 0 -> we have a short circuit!!
-            if rab < 1e-5:
-                msg = f'!!!SHORT CIRCUIT!!! {str(quad):s}: {rab:.3f} kOhm'
-                self.exec_logger.warning(msg)
+                self.data_logger.info(json.dumps(msg))
 
-            # save data in a text file
-            self.append_and_save(export_path_rs, {
-                'A': quad[0],
-                'B': quad[1],
-                'RS [kOhm]': np.round(rab, 3),
-            })
+                # if contact resistance = 0 -> we have a short circuit!!
+                if rab < 1e-5:
+                    msg = f'!!!SHORT CIRCUIT!!! {str(quad):s}: {rab:.3f} kOhm'
+                    self.exec_logger.warning(msg)
 
-            # close mux path and put pin back to GND
-            self.switch_mux_off(quad)
+                # save data in a text file
+                self.append_and_save(export_path_rs, {
+                    'A': quad[0],
+                    'B': quad[1],
+                    'RS [kOhm]': np.round(rab, 3),
+                })
 
-        self.status = 'idle'
-        if switch_pwr_off:
-            self._hw.pwr.pwr_state = 'off'
+                # close mux path and put pin back to GND
+                self.switch_mux_off(quad)
 
-        # switches off measuring LED
-        self._hw.tx.measuring = 'off'
+            self.status = 'idle'
+            if switch_pwr_off:
+                self._hw.pwr.pwr_state = 'off'
 
-        # if power was off before measurement, let's turn if off
-        if switch_tx_pwr_off:
-            self._hw.pwr_state = 'off'
+            # switches off measuring LED
+            self._hw.tx.measuring = 'off'
     
         # TODO if interrupted, we would need to restore the values
         # TODO or we offer the possibility in 'run_measurement' to have rs_check each time?
@@ -1288,23 +1698,27 @@ class OhmPi(object):
             Unique command identifier.
         """
         try:
-            self.sequence = np.array(sequence).astype(int)
+            self.sequence = self._validate_sequence(np.array(sequence).astype(int))
         except Exception as e:
             self.exec_logger.warning(f'Unable to set sequence: {e}')
 
-    def switch_mux_on(self, quadrupole, bypass_check=False, cmd_id=None):
+    def switch_mux_on(self, quadrupole, bypass_check=False, cmd_id=None, validated=False):
         """Switches on multiplexer relays for given quadrupole.
 
         Parameters
         ----------
-        quadrupole : list of 4 int
-            List of 4 integers representing the electrode numbers.
+        quadrupole : list of int
+            List of 4 integers representing the electrode numbers (A, B, M, N), optionally followed by pairs of
+            integers for the MN dipoles of the other channels of a multichannel RX.
         bypass_check: bool, optional
             Bypasses checks for A==M or A==N or B==M or B==N (i.e. used for rs-check).
         cmd_id : str, optional
             Unique command identifier.
+        validated : bool, optional
+            Whether the quadrupole was validated with its sequence (see _validate_sequence()), in which case the
+            electrode roles are not checked again by the mux boards.
         """
-        assert len(quadrupole) == 4
+        assert len(quadrupole) >= 4 and len(quadrupole) % 2 == 0
         if (self._hw.tx.pwr.voltage > self._hw.rx._voltage_max) and bypass_check:
             self.exec_logger.warning('Cannot bypass checking electrode roles because tx pwr voltage is over rx maximum voltage')
             self.exec_logger.debug(f'tx pwr voltage: {self._hw.tx.pwr.voltage}, rx max voltage: {self._hw.rx._voltage_max}')
@@ -1313,20 +1727,22 @@ class OhmPi(object):
             if np.array(quadrupole).all() == np.array([0, 0, 0, 0]).all():  # NOTE: No mux
                 return True
             else:
-                return self._hw.switch_mux(electrodes=quadrupole, state='on', bypass_check=bypass_check)
+                return self._hw.switch_mux(electrodes=quadrupole, roles=self._quadrupole_roles(quadrupole),
+                                           state='on', bypass_check=bypass_check, validated=validated)
 
     def switch_mux_off(self, quadrupole, cmd_id=None):
         """Switches off multiplexer relays for given quadrupole.
 
         Parameters
         ----------
-        quadrupole : list of 4 int
-            List of 4 integers representing the electrode numbers.
+        quadrupole : list of int
+            List of 4 integers representing the electrode numbers (A, B, M, N), optionally followed by pairs of
+            integers for the MN dipoles of the other channels of a multichannel RX.
         cmd_id : str, optional
             Unique command identifier.
         """
-        assert len(quadrupole) == 4
-        return self._hw.switch_mux(electrodes=quadrupole, state='off')
+        assert len(quadrupole) >= 4 and len(quadrupole) % 2 == 0
+        return self._hw.switch_mux(electrodes=quadrupole, roles=self._quadrupole_roles(quadrupole), state='off')
 
     def test(self, test_names=[], remote=False, filename=None):
         """Run test on the ohmpi system.
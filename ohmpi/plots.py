@@ -1,11 +1,12 @@
 import matplotlib.pyplot as plt
 import numpy as np
 from ohmpi.utils import parse_log
+from ohmpi.tracing import load_trace
 import matplotlib
 # plt.switch_backend('agg')  # for thread safe operations...
 
 
-def plot_exec_log(exec_log,names=None,last_session=True):  # TODO: select session id instead of last session (if -1 : last)
+def _events_from_log(exec_log, last_session=True):
     time, process_id, tag, msg, session = parse_log(exec_log)
     if last_session:
         time, process_id, tag, msg = time[session == max(session)], process_id[session == max(session)], \
@@ -20,6 +21,37 @@ def plot_exec_log(exec_log,names=None,last_session=True):  # TODO: select sessio
         state[i] = event.split("\t")[2]
         time[i] = event.split("\t")[3].replace('\n','')
     time = time.astype(np.datetime64)
+    return category, name, state, time
+
+
+def _events_from_trace(trace):
+    trace = load_trace(trace)
+    events = [e for e in trace['traceEvents'] if e['ph'] in ['B', 'E']]
+    t0 = trace.get('otherData', {}).get('t0_utc_ns', 0)
+    category = np.array([e['cat'] for e in events]).astype(str)
+    name = np.array([e['name'] for e in events]).astype(str)
+    state = np.array(['begin' if e['ph'] == 'B' else 'end' for e in events]).astype(str)
+    time = np.array([t0 + int(e['ts'] * 1000) for e in events]).astype('datetime64[ns]')
+    return category, name, state, time
+
+
+def plot_exec_log(exec_log, names=None, last_session=True):  # TODO: select session id instead of last session (if -1 : last)
+    """Plots execution spans
+
+    Parameters
+    ----------
+    exec_log: str, dict or Tracer
+        Path to an exec log file (events logged at EVENT level) or trace recorded with ohmpi.tracing (path to a JSON
+        trace file, trace dictionary or Tracer)
+    names: dict, optional
+        Names of the spans to plot for each category
+    last_session: bool, optional
+        Only plots the last session of an exec log file
+    """
+    if isinstance(exec_log, str) and not exec_log.endswith('.json'):
+        category, name, state, time = _events_from_log(exec_log, last_session=last_session)
+    else:
+        category, name, state, time = _events_from_trace(exec_log)
     state = state[time.argsort()]
     category = category[time.argsort()]
     name = name[time.argsort()]
@@ -1,10 +1,7 @@
 import numpy as np
-import pandas as pd
-import os
-import matplotlib.pyplot as plt
 
 def create_sequence(nelec, params=[('dpdp', 1, 8)], include_reciprocal=False,
-    opt_ip=False, opt_param={}, opt_plot=False):
+    opt_ip=False, opt_param={}, opt_plot=False, optimize=None):
     """Creates a sequence of quadrupole.Several type of
     sequence or sequence with different parameters can be combined together.
 
@@ -39,52 +36,35 @@ def create_sequence(nelec, params=[('dpdp', 1, 8)], include_reciprocal=False,
         'niter' (int): number of iterations during optimization
         'nchains' (int): number of chain to run in parallel (each chain is run niter times)
         'pad' (int): how far from its position move the quad with the largest cost in the sequence
+        'patience' (int): number of iterations without improvement before stopping early
     opt_plot : bool, optional
         Plot cost decay of ip optimization.
+    optimize : str, optional
+        Either:
+        - 'ip' : same as opt_ip=True
+        - 'time' : orders the sequence to minimize the acquisition time (relay operations, DPS voltage changes
+          and discharges), see optimize_time(). opt_param is then passed to optimize_time(), e.g. 'vab', 'vab_max',
+          'ip_weight' (to also optimize for IP) and the parameters of the time model.
     """
-    # dictionary of function to create sequence
-    fdico = {
-        'dpdp': dpdp,
-        'wenner': wenner,
-        'schlum': schlum,
-        'multigrad': multigrad,
-    }
-    
-    # check parameters (all int and > 0)
-    for param in params:
-        for i, p in enumerate(param[1:]):
-            if isinstance(p, float) or isinstance(p, int):
-                if p <= 0:
-                    raise ValueError('parameters of sequence (a, n or s) needs to be > 0')
-            else:
-                for pp in p:
-                    if pp <= 0:
-                        raise ValueError('parameters of sequence (a, n or s) needs to be > 0')
+    seq = compile_sequence(nelec, params=params, include_reciprocal=include_reciprocal).astype(int)
 
-    # create sequence
-    dfs = []
-    for param in params:
-        dfs.append(fdico[param[0]](nelec, *param[1:]))
-    dfseq = pd.concat(dfs, axis=0)
-
-    # add reciprocal
-    if include_reciprocal:
-        dfseqr = dfseq.copy().rename(columns={'a': 'm', 'b': 'n', 'm': 'a', 'n': 'b'})
-        dfseqr = dfseqr.sort_values(['a', 'b', 'm', 'n'])
-        dfseq = pd.concat([dfseq, dfseqr]).reset_index(drop=True)
+    if optimize == 'ip':
+        opt_ip = True
 
     # optimize for IP
     if opt_ip:
-        dfseq = dfseq.sort_values(['m', 'n', 'a', 'b'])
+        seq = seq[np.lexsort(seq[:, [1, 0, 3, 2]].T)]  # sorted by m, n, a, b
         nchains = opt_param['nchains'] if 'nchains' in opt_param else 4
+        ip_param = {k: v for k, v in opt_param.items() if k in ['niter', 'pad', 'patience']}
         try:
             from joblib import Parallel, delayed
-            outs = Parallel(n_jobs=-1, backend='loky')(delayed(optimize_ip)(dfseq.values) for i in range(nchains))
+            outs = Parallel(n_jobs=-1, backend='loky')(delayed(optimize_ip)(seq, **ip_param)
+                                                       for i in range(nchains))
         except ImportError:
             print('For parallel optimization, install joblib "pip install joblib"')
             outs = []
             for nchain in range(nchains):
-                outs.append(optimize_ip(dfseq.values))
+                outs.append(optimize_ip(seq, **ip_param))
 
         # best order
         cost = np.inf
@@ -94,9 +74,17 @@ def create_sequence(nelec, params=[('dpdp', 1, 8)], include_reciprocal=False,
                 order = out[0]
                 cost = out[1][-1]
         print('Best cost is {:.2f}'.format(cost))
-        dfseq.loc[:, :] = dfseq.values[order, :]
+        seq = seq[order, :]
+
+    # optimize for acquisition time
+    if optimize == 'time':
+        order, report = optimize_time(seq, **opt_param)
+        seq = seq[order, :]
+        print('Predicted time between quadrupoles: {:.1f} s ({:.1f} s saved)'.format(
+            report['optimized_time'], report['saved_time']))
 
-    if opt_plot:
+    if opt_plot and opt_ip:
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots()
         for out in outs:
             ax.plot(out[1])
@@ -105,8 +93,178 @@ def create_sequence(nelec, params=[('dpdp', 1, 8)], include_reciprocal=False,
         fig.show()
             
     # stats
-    print('{:d} quadrupoles generated.'.format(dfseq.shape[0]))
-    return dfseq
+    print('{:d} quadrupoles generated ({:d} groups of consecutive quadrupoles sharing AB).'.format(
+        seq.shape[0], ab_groups(seq).shape[0]))
+    import pandas as pd
+    return pd.DataFrame(seq, columns=['a', 'b', 'm', 'n'])
+
+
+def compile_sequence(nelec, params=[('dpdp', 1, 8)], include_reciprocal=False):
+    """Compiles the quadrupoles of one or several array types in a single array. Quadrupoles are packed in
+    integer keys (see pack_quadrupoles) to remove the ones generated by overlapping parameters (first occurrence
+    kept) and to pair them with their reciprocal.
+
+    Parameters
+    ----------
+    nelec : int
+        Number of electrodes (at most 65535).
+    params : list of tuple, optional
+        Array types and parameters, see create_sequence().
+    include_reciprocal : bool, optional
+        If True, will add reciprocal quadrupoles (so MNAB) to the sequence, except the ones already in it.
+
+    Returns
+    -------
+    seq : numpy.ndarray of uint16
+        Array of shape nquad x 4 with A, B, M and N.
+    """
+    # dictionary of function to create sequence
+    fdico = {
+        'dpdp': _dpdp,
+        'wenner': _wenner,
+        'schlum': _schlum,
+        'multigrad': _multigrad,
+    }
+    if not 0 < nelec <= np.iinfo(np.uint16).max:
+        raise ValueError('number of electrodes needs to be > 0 and <= 65535')
+
+    # check parameters (all int and > 0)
+    for param in params:
+        for i, p in enumerate(param[1:]):
+            if isinstance(p, float) or isinstance(p, int):
+                if p <= 0:
+                    raise ValueError('parameters of sequence (a, n or s) needs to be > 0')
+            else:
+                for pp in p:
+                    if pp <= 0:
+                        raise ValueError('parameters of sequence (a, n or s) needs to be > 0')
+
+    # create sequence
+    seq = np.vstack([np.zeros((0, 4), dtype=np.int32)] + [fdico[param[0]](nelec, *param[1:]) for param in params])
+    keys = pack_quadrupoles(seq)
+    sorted_keys, first = np.unique(keys, return_index=True)
+    if len(first) < len(keys):  # overlapping parameters
+        first = np.sort(first)  # keeps the order of the array types
+        seq = seq[first]
+
+    # add reciprocal
+    if include_reciprocal:
+        seqr = seq[:, [2, 3, 0, 1]]
+        rkeys = pack_quadrupoles(seqr)
+        order = np.argsort(rkeys)
+        seqr, rkeys = seqr[order], rkeys[order]
+        if len(sorted_keys) > 0:  # removes the reciprocals already in the sequence
+            pos = np.minimum(np.searchsorted(sorted_keys, rkeys), len(sorted_keys) - 1)
+            seqr = seqr[sorted_keys[pos] != rkeys]
+        seq = np.vstack([seq, seqr])
+    return np.ascontiguousarray(seq, dtype=np.uint16)
+
+
+def pack_quadrupoles(seq):
+    """Packs the A, B, M and N electrodes of each quadrupole in a single integer key (16 bits per electrode), so
+    that sorting keys sorts quadrupoles by A, B, M and N.
+
+    Parameters
+    ----------
+    seq : array_like
+        Sequence with 4 columns as A, B, M and N.
+
+    Returns
+    -------
+    keys : numpy.ndarray of uint64
+    """
+    seq = np.asarray(seq).astype(np.uint64).reshape(-1, 4)
+    return (seq[:, 0] << np.uint64(48)) | (seq[:, 1] << np.uint64(32)) | (seq[:, 2] << np.uint64(16)) | seq[:, 3]
+
+
+def reciprocal_index(seq):
+    """Pairs each quadrupole of a sequence with its reciprocal (MNAB).
+
+    Parameters
+    ----------
+    seq : array_like
+        Sequence with 4 columns as A, B, M and N.
+
+    Returns
+    -------
+    index : numpy.ndarray of int
+        Index of the reciprocal of each quadrupole in the sequence, -1 if it is not in the sequence.
+    """
+    seq = np.asarray(seq)
+    keys = pack_quadrupoles(seq)
+    rkeys = pack_quadrupoles(seq[:, [2, 3, 0, 1]])
+    order = np.argsort(keys)
+    pos = np.clip(np.searchsorted(keys[order], rkeys), 0, max(len(keys) - 1, 0))
+    found = keys[order][pos] == rkeys if len(keys) > 0 else np.zeros(0, dtype=bool)
+    return np.where(found, order[pos] if len(keys) > 0 else -1, -1)
+
+
+def _levels(p):
+    # an int p stands for levels 1 to p, otherwise p is the list of levels
+    if np.ndim(p) == 0:
+        return np.arange(int(p)) + 1
+    return np.asarray(p, dtype=int)
+
+
+def _quadrupoles(nelec, A, B, M, N, valid=True):
+    # broadcasts A, B, M and N to quadrupoles, keeps the valid ones within the electrodes sorted by A, B, M and N
+    A, B, M, N = np.broadcast_arrays(A, B, M, N)
+    valid = valid & (A <= nelec) & (B <= nelec) & (M <= nelec) & (N <= nelec)
+    abmn = np.empty((np.count_nonzero(valid), 4), dtype=np.int32)
+    for i, x in enumerate([A, B, M, N]):
+        abmn[:, i] = x[valid]
+    return abmn[np.argsort(pack_quadrupoles(abmn))]
+
+
+def _dpdp(nelec, a, n):
+    a = _levels(a)[:, None, None]
+    n = _levels(n)[None, :, None]
+    if (a < 1).any():
+        raise ValueError('a must be >= 1, it is the electrode spacing between AB and MN pairs (a = 1 is the same as skip 0)')
+    if (n < 1).any():
+        raise ValueError('n must be >= 1, it is the number of level between AB and MN')
+    A = np.arange(nelec)[None, None, :] + 1
+    B = A + a
+    M = B + n * a
+    N = M + a
+    return _quadrupoles(nelec, A, B, M, N)
+
+
+def _wenner(nelec, a):
+    a = _levels(a)[:, None]
+    A = np.arange(nelec)[None, :] + 1
+    M = A + a
+    N = M + a
+    B = N + a
+    return _quadrupoles(nelec, A, B, M, N)
+
+
+def _schlum(nelec, a, n):
+    a, n = np.meshgrid(_levels(a), _levels(n), indexing='ij')
+    valid = n >= a - 1  # minus 1 here to permit measurements on level 2 of pseudosection
+    a, n = a[valid], n[valid]
+    A = np.arange(nelec)[None, :] + 1
+    M = A + n[:, None]
+    N = M + a[:, None]
+    B = N + n[:, None]
+    return _quadrupoles(nelec, A, B, M, N)
+
+
+def _multigrad(nelec, a, n, s):
+    s = _levels(s)[:, None, None, None]
+    n = _levels(n)[None, :, None, None]  # sometimes n will make M or N go beyond B
+    a = _levels(a)[None, None, :, None]
+    A = np.arange(nelec)[None, None, None, :] + 1
+    B = A + (s + 2) * a
+    M = A + n * a
+    N = M + a
+    return _quadrupoles(nelec, A, B, M, N, valid=(M < B) & (N < B))
+
+
+def _to_frame(abmn):
+    import pandas as pd
+    return pd.DataFrame(abmn, columns=['a', 'b', 'm', 'n'])
+
 
 def dpdp(nelec, a, n):
     ''' Generates quadrupole matrix for dipole-dipole survey.
@@ -121,30 +279,7 @@ def dpdp(nelec, a, n):
     n : int or list of int
         Quadrupole separation in electrode spacing.
     '''
-    # check parameters
-    if isinstance(a, int):
-        a = np.arange(a) + 1
-    if isinstance(n, int):
-        n = np.arange(n) + 1
-    
-    elec = np.arange(nelec) + 1
-    abmn = []
-    for aa in a:
-        if aa < 1:
-            raise ValueError('a must be >= 1, it is the electrode spacing between AB and MN pairs (a = 1 is the same as skip 0)')
-        for nn in n:
-            if nn < 1:
-                raise ValueError('n must be >= 1, it is the number of level between AB and MN')
-            A = elec
-            B = A + aa
-            M = B + nn * aa
-            N = M + aa
-            abmn.append(np.vstack([A, B, M, N]).T)
-    abmn = np.vstack(abmn)
-    abmn = abmn[(abmn <= nelec).all(1), :]
-    df = pd.DataFrame(abmn, columns=['a', 'b', 'm', 'n'])
-    df = df.sort_values(['a', 'b', 'm', 'n']).reset_index(drop=True)
-    return df
+    return _to_frame(_dpdp(nelec, a, n))
 
 def wenner(nelec, a):
     '''Generates quadrupole matrix for Wenner alpha survey.
@@ -156,22 +291,7 @@ def wenner(nelec, a):
     a : int or list of int
         Spacing between electrodes (in electrode spacing).
    '''
-    if isinstance(a, int):
-        a = np.arange(a) + 1
-    elec = np.arange(nelec) + 1
-    abmn = []
-    for aa in a:
-        A = elec
-        M = A + aa
-        N = M + aa
-        B = N + aa
-        abmn.append(np.vstack([A, B, M, N]).T)
-    abmn = np.vstack(abmn)
-    abmn = abmn[(abmn <= nelec).all(1), :]
-    df = pd.DataFrame(abmn, columns=['a', 'b', 'm', 'n'])
-    df = df.sort_values(['a', 'b', 'm', 'n']).reset_index(drop=True)
-    return df
-    
+    return _to_frame(_wenner(nelec, a))
 
 def schlum(nelec, a, n):
     ''' Generates quadrupole matrix for Schlumberger survey.
@@ -184,28 +304,8 @@ def schlum(nelec, a, n):
     n : int or list of int
         Quadrupole separation in electrode spacing.   
     '''
-    # check parameters
-    if isinstance(a, int):
-        a = np.arange(a) + 1
-    if isinstance(n, int):
-        n = np.arange(n) + 1
-    
-    elec = np.arange(nelec) + 1
-    abmn = []
-    for aa in a:
-        for nn in n:
-            if nn >= aa-1: #minus 1 here to permit measurements on level 2 of pseudosection
-                A = elec
-                M = A + nn
-                N = M + aa
-                B = N + nn
-                abmn.append(np.vstack([A, B, M, N]).T)
-    abmn = np.vstack(abmn)
-    abmn = abmn[(abmn <= nelec).all(1), :]
-    df = pd.DataFrame(abmn, columns=['a', 'b', 'm', 'n'])
-    df = df.sort_values(['a', 'b', 'm', 'n']).reset_index(drop=True)
-    return df
-    
+    return _to_frame(_schlum(nelec, a, n))
+
 def multigrad(nelec, a, n, s):
     ''' Generate measurement matrix for multigradient array.
     
@@ -221,59 +321,208 @@ def multigrad(nelec, a, n, s):
         Separation factor for current electrodes, should be the intermediate
         numbers.
     '''
-    # check parameters
-    if isinstance(a, int):
-        a = np.arange(a) + 1
-    if isinstance(n, int):
-        n = np.arange(n) + 1
-    if isinstance(s, int):
-        s = np.arange(s) + 1
-    elec = np.arange(nelec) + 1
-    abmn = []
-    for ss in s:
-        for nn in n:  # sometimes n will make M or N go beyond B
-            for aa in a:
-                A = elec
-                B = A + (ss + 2) * aa
-                M = A + nn * aa
-                N = M + aa
-                abmn.append(np.vstack([A, B, M, N]).T)
-    abmn = np.vstack(abmn)
-    abmn = abmn[(abmn <= nelec).all(1), :]
-    abmn = abmn[(abmn[:, 2] < abmn[:, 1]) & (abmn[:, 3] < abmn[:, 1])]
-    df = pd.DataFrame(abmn, columns=['a', 'b', 'm', 'n'])
-    df = df.sort_values(['a', 'b', 'm', 'n']).reset_index(drop=True)
-    return df 
+    return _to_frame(_multigrad(nelec, a, n, s))
+
+def ab_groups(seq):
+    """Finds runs of consecutive quadrupoles sharing the same A and B electrodes.
+
+    Parameters
+    ----------
+    seq : array_like
+        Sequence with 4 columns as A, B, M and N.
+
+    Returns
+    -------
+    groups : numpy.ndarray of int
+        Array of shape ngroups x 2 with the start (included) and stop (excluded) index of each group.
+    """
+    seq = np.asarray(seq)
+    if seq.shape[0] == 0:
+        return np.zeros((0, 2), dtype=int)
+    new_ab = np.r_[True, np.any(seq[1:, :2] != seq[:-1, :2], axis=1)]
+    starts = np.where(new_ab)[0]
+    stops = np.r_[starts[1:], seq.shape[0]]
+    return np.vstack([starts, stops]).T
+
+
+def multichannel_sequence(seq, n_channels=2):
+    """Compiles a sequence of quadrupoles into injections measuring several MN dipoles at once on a multichannel RX.
+    The MN dipoles of the quadrupoles sharing the same A and B electrodes are packed (first fit, in the order of the
+    sequence) in injections of up to n_channels dipoles, an electrode being used at most once per injection.
+
+    Parameters
+    ----------
+    seq : array_like
+        Sequence with 4 columns as A, B, M and N.
+    n_channels : int, optional
+        Number of MN channels of the RX.
+
+    Returns
+    -------
+    injections : numpy.ndarray of int
+        Array of shape ninjections x (2 + 2 * n_channels) with columns A, B, M, N, M1, N1, M2, N2, ... Injections
+        with fewer dipoles than channels are padded with 0.
+    """
+    seq = np.asarray(seq, dtype=int).reshape(-1, 4)
+    width = 2 + 2 * n_channels
+    if seq.shape[0] == 0:
+        return np.zeros((0, width), dtype=int)
+    # AB dipoles in the order of their first appearance in the sequence
+    abs_, first, inverse = np.unique(seq[:, :2], axis=0, return_index=True, return_inverse=True)
+    inverse = np.ravel(inverse)
+    injections = []
+    for g in np.argsort(first):
+        rows = []  # MN dipoles of each injection
+        for mn in seq[inverse == g, 2:]:
+            for row in rows:
+                if len(row) < n_channels and not np.isin(mn, row).any():
+                    row.append(mn)
+                    break
+            else:
+                rows.append([mn])
+        for row in rows:
+            injection = np.zeros(width, dtype=int)
+            injection[:2] = abs_[g]
+            injection[2:2 + 2 * len(row)] = np.ravel(row)
+            injections.append(injection)
+    return np.array(injections)
+
+
+def quadrupole_roles(n_columns=4):
+    """Returns the roles of the electrodes of the quadrupoles of a sequence: A, B, M, N followed by M1, N1, M2, N2, ...
+    for the MN dipoles measured on the other channels of a multichannel RX.
+
+    Parameters
+    ----------
+    n_columns : int, optional
+        Number of columns of the sequence (4 + 2 * (number of channels - 1)).
+
+    Returns
+    -------
+    roles : list of str
+    """
+    return ['A', 'B', 'M', 'N'] + [f'{r}{i}' for i in range(1, (n_columns - 2) // 2) for r in ['M', 'N']]
+
+
+def validate_sequence(seq, cabling=None):
+    """Checks all the quadrupoles of a sequence at once, so that a validated sequence can be switched without checking
+    the electrode roles at each quadrupole. Electrodes numbered 0 are not connected and are ignored.
+
+    Parameters
+    ----------
+    seq : array_like
+        Sequence with columns A, B, M, N (optionally followed by M1, N1, M2, N2, ...).
+    cabling : dict, optional
+        Cabling of the mux boards as {(electrode, role): ...} (see OhmPiHardware._cabling). If None or empty (no mux),
+        the cabling and electrode range are not checked.
+
+    Returns
+    -------
+    diagnostics : dict of numpy.ndarray of bool
+        Per quadrupole diagnostics:
+        - 'ab': A == B (short-circuit)
+        - 'ab_mn': M or N is also A or B (over-voltage of the RX)
+        - 'mn': M == N
+        - 'range': electrode out of the range of the mux boards (or negative)
+        - 'cabling': (electrode, role) not in the cabling
+        - 'valid': none of the above
+    """
+    seq = np.atleast_2d(np.asarray(seq, dtype=int))
+    if seq.size == 0:
+        seq = seq.reshape(0, 4)
+    ab, mn = seq[:, :2], seq[:, 2:]
+    diagnostics = {
+        'ab': (ab[:, 0] == ab[:, 1]) & (ab[:, 0] != 0),
+        'ab_mn': np.any((mn[:, :, None] == ab[:, None, :]) & (mn[:, :, None] != 0), axis=(1, 2)),
+        'mn': np.any((mn[:, 0::2] == mn[:, 1::2]) & (mn[:, 0::2] != 0), axis=1),
+        'range': np.any(seq < 0, axis=1),
+        'cabling': np.zeros(seq.shape[0], dtype=bool),
+    }
+    if cabling:
+        roles = quadrupole_roles(seq.shape[1])
+        keys = [(int(e), roles.index(r)) for e, r in cabling.keys() if r in roles and e >= 0]
+        nelec = max([e for e, _ in cabling.keys()]) + 1
+        # covered[j, e] is True if electrode e can be switched with the role of column j
+        covered = np.zeros((len(roles), nelec), dtype=bool)
+        if len(keys) > 0:
+            e, j = np.array(keys).T
+            covered[j, e] = True
+        out = (seq < 0) | (seq >= nelec)
+        diagnostics['range'] = np.any(out, axis=1)
+        cabled = covered[np.arange(seq.shape[1]), np.where(out, 0, seq)]
+        diagnostics['cabling'] = np.any(~cabled & ~out & (seq != 0), axis=1)
+    diagnostics['valid'] = ~np.any(list(diagnostics.values()), axis=0)
+    return diagnostics
+
 
 #%% function for ip optimization
+def _next_mn_table(quad, nelec=None):
+    # table[i, e] is the first position >= i where electrode e is used as M or N (nquad if never), so that the
+    # next use of e after position i is table[i + 1, e]
+    n = quad.shape[0]
+    if nelec is None:
+        nelec = quad.max() + 1 if n > 0 else 1
+    table = np.full((n + 1, nelec), n, dtype=np.int32)
+    rows = np.repeat(np.arange(n), quad.shape[1] - 2)
+    table[rows, quad[:, 2:].ravel()] = rows
+    return np.minimum.accumulate(table[::-1], axis=0)[::-1]
+
+
+def _update_next_mn_table(table, quad, lo, hi):
+    # updates the table in place after the quadrupoles at positions lo to hi (included) changed, rows after hi
+    # are unchanged and rows before lo only change where they pointed to the modified window
+    n = quad.shape[0]
+    window = np.full((hi - lo + 2, table.shape[1]), n, dtype=np.int32)
+    window[-1] = table[hi + 1]
+    rows = np.repeat(np.arange(lo, hi + 1), quad.shape[1] - 2)
+    window[rows - lo, quad[lo:hi + 1, 2:].ravel()] = rows
+    table[lo:hi + 2] = np.minimum.accumulate(window[::-1], axis=0)[::-1]
+    if lo > 0:
+        head = table[:lo]
+        np.copyto(head, table[lo], where=head >= lo)
+
+
+def _ip_distances(quad, table):
+    # distance between each quadrupole and the next one using its A or B electrode as M or N (-1 if none)
+    n = quad.shape[0]
+    i = np.arange(n)
+    nxt = np.minimum(table[i + 1, quad[:, 0]], table[i + 1, quad[:, 1]])
+    return np.where(nxt < n, nxt - i, -1)
+
+
+def _ip_cost(d):
+    return np.sum(1. / d[d > 0])
+
+
 def computeCost(quad):
-    # compute d (smallest distance between injecting and next time the electrode is used for MN)
-    d = []
-    for i in range(quad.shape[0]):
-        a = quad[i, 0]
-        b = quad[i, 1]
-        ie1 = (quad[i+1:, 2:] == a).any(1)
-        ie2 = (quad[i+1:, 2:] == b).any(1)
-        ie = ie1 | ie2
-        if ie.sum() > 0:
-            d.append(i + np.min(np.where(ie)[0])+1)  # index 1 is first row after i
-        else:
-            d.append(-1)  # flag it to set it to 0 in the cost function later
-    d = np.array(d)
-    
-    # cost function
-    dinv = 1/d
-    dinv[d < 0] = 0
-    cost = np.sum(dinv)
-    return cost, d
+    """Computes the IP cost of a sequence: the sum of 1/d, with d the distance between each quadrupole and the next
+    one using one of its injection electrodes (A or B) for potential readings (M or N).
 
+    Parameters
+    ----------
+    quad : array_like
+        Sequence with 4 columns as A, B, M and N.
 
-def optimize_ip(seq, niter=1000, pad=2):
+    Returns
+    -------
+    cost : float
+        IP cost of the sequence.
+    d : numpy.ndarray of int
+        Distance for each quadrupole (-1 if its injection electrodes are not used for potential readings afterwards).
+    """
+    quad = np.asarray(quad, dtype=int)
+    d = _ip_distances(quad, _next_mn_table(quad))
+    return _ip_cost(d), d
+
+
+def optimize_ip(seq, niter=1000, pad=2, patience=None):
     """Optimize a sequence to maximize the distance between
     a quadrupole used for injection and for potential readings.
     Tried to follow the Quenched method of Wilkinson et al. (2012)
     https://doi.org/10.1111/j.1365-246X.2012.05372.x. This function is
     relatively fast but can be stuck in local minima.
+    The cost is updated incrementally after each move: the table of the next use of each electrode as M or N is
+    only recomputed between the old and new positions of the moved quadrupole.
 
     Parameters
     ----------
@@ -284,6 +533,8 @@ def optimize_ip(seq, niter=1000, pad=2):
     pad : int, optional
         How far away from the position of the quadrupole with the largest
         cost can we move this quadrupole with the largest cost.
+    patience : int, optional
+        Stops the optimization early when the cost did not decrease during patience iterations.
 
     Returns
     -------
@@ -292,36 +543,199 @@ def optimize_ip(seq, niter=1000, pad=2):
     costs : array of float
         Costs for each iteration.
     """
-    seq = seq.copy()
-    order = np.arange(seq.shape[0])
-    order_old = order.copy()
-    cost_old = np.inf
+    seq = np.array(seq, dtype=int)
+    n = seq.shape[0]
+    order = np.arange(n)
     costs = np.zeros(niter) * np.nan
+    if n == 0:
+        return order, costs
+    quad = seq.copy()  # seq[order, :]
+    table = _next_mn_table(quad)
+    d = _ip_distances(quad, table)
+    cost = _ip_cost(d)
+    stall = 0
+
+    def move(src, dst):
+        quad[:] = np.insert(np.delete(quad, src, axis=0), dst, quad[src], axis=0)
+        order[:] = np.insert(np.delete(order, src), dst, order[src])
+        _update_next_mn_table(table, quad, min(src, dst), max(src, dst))
+
     for iteration in range(niter):
-        quad = seq[order, :]
-        cost, d = computeCost(quad)
-    
         if (d != -1).sum() == 0:
+            costs[iteration:] = cost
             break
 
+        # move the smallest d to another random position
+        imin = np.where(d == np.min(d[d != -1]))[0][0]
+        positions = np.r_[np.arange(0, imin-pad), np.arange(imin+pad, n)]
+        if len(positions) == 0:
+            costs[iteration:] = cost
+            break
+        ipos = np.random.choice(positions, 1)[0]
+        move(imin, ipos)
+        new_d = _ip_distances(quad, table)
+        new_cost = _ip_cost(new_d)
+
         # only accept order that bring down the cost
-        if cost > cost_old:
-            order = order_old  # go back to previous order
-            costs[iteration] = cost_old
+        if new_cost > cost:
+            move(ipos, imin)  # go back to previous order
+            stall += 1
         else:
-            costs[iteration] = cost
-            cost_old = cost
-            order_old = order
-        
-        # update order by moving the smallest d to another random position
-        imin = np.where(d == np.min(d[d != -1]))[0][0]
-        ipos = np.random.choice(np.r_[np.arange(0, imin-pad),
-                                np.arange(imin+pad, len(order))], 1)[0]
-        order = np.insert(np.delete(order, imin), ipos, order[imin])
+            stall = stall + 1 if new_cost == cost else 0
+            cost, d = new_cost, new_d
+        costs[iteration] = cost
+        if patience is not None and stall >= patience:
+            costs[iteration:] = cost
+            break
 
     return order, costs
 
 
+#%% functions for acquisition time optimization
+def geometric_factors(seq):
+    """Computes the geometric factor of each quadrupole, assuming evenly spaced electrodes (unit spacing) on a line.
+
+    Parameters
+    ----------
+    seq : array_like
+        Sequence with 4 columns as A, B, M and N.
+
+    Returns
+    -------
+    k : numpy.ndarray of float
+        Geometric factors (nan if undefined).
+    """
+    a, b, m, n = np.asarray(seq, dtype=float)[:, :4].T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g = 1. / np.abs(a - m) - 1. / np.abs(b - m) - 1. / np.abs(a - n) + 1. / np.abs(b - n)
+        k = 2 * np.pi / g
+    k[~np.isfinite(k) | (k == 0.)] = np.nan
+    return k
+
+
+def predict_vab(seq, vab=None, vab_max=50.):
+    """Predicts the vab of each quadrupole. The vab needed to reach a given vmn is assumed proportional to the
+    absolute geometric factor and scaled so that the quadrupole with the largest one is injected at vab_max.
+
+    Parameters
+    ----------
+    seq : array_like
+        Sequence with 4 columns as A, B, M and N.
+    vab : array_like, optional
+        Known vab of the quadrupoles [V], nan if unknown (e.g. found during a previous run). Unknown values are
+        predicted.
+    vab_max : float, optional
+        Maximum injection voltage [V].
+
+    Returns
+    -------
+    vab : numpy.ndarray of float
+    """
+    k = np.abs(geometric_factors(seq))
+    k_max = np.nanmax(k) if np.isfinite(k).any() else np.nan
+    predicted = np.nan_to_num(vab_max * k / k_max, nan=vab_max)  # an undefined factor means no vmn
+    if vab is None:
+        return predicted
+    vab = np.asarray(vab, dtype=float)
+    return np.where(np.isfinite(vab), vab, predicted)
+
+
+def _transition_times(prev, vab_prev, seq, vab, relay_time=0.01, voltage_time=0.1, discharge_rate=0.05,
+                      pwr_toggle_time=0.5):
+    # relays of the roles changing between quadrupoles are opened then closed (relay states are diffed)
+    relays = 2 * np.sum(np.asarray(seq) != np.asarray(prev), axis=-1)
+    dv = vab - vab_prev
+    # the pwr is switched off and discharged before injecting at a lower vab
+    discharge = dv < -1e-3
+    return (relay_time * relays + voltage_time * (np.abs(dv) > 1e-3)
+            + discharge * (pwr_toggle_time - discharge_rate * dv))
+
+
+def transition_times(seq, vab=None, vab_max=50., **kwargs):
+    """Predicts the time spent between consecutive quadrupoles of a sequence, switching relays and changing the
+    DPS voltage.
+
+    Parameters
+    ----------
+    seq : array_like
+        Sequence with 4 (or more) columns as A, B, M and N.
+    vab : array_like, optional
+        Known vab of the quadrupoles [V], see predict_vab().
+    vab_max : float, optional
+        Maximum injection voltage [V], see predict_vab().
+    kwargs : dict, optional
+        Parameters of the time model:
+        'relay_time' (float): time per relay operation [s]
+        'voltage_time' (float): time to set a new vab on the DPS [s]
+        'discharge_rate' (float): time to discharge the DPS [s/V]
+        'pwr_toggle_time' (float): time to switch the pwr off (to discharge it) and on again [s]
+
+    Returns
+    -------
+    times : numpy.ndarray of float
+        Array of shape nquad - 1 with the time between each quadrupole and the next one [s].
+    """
+    seq = np.asarray(seq)
+    vab = predict_vab(seq, vab=vab, vab_max=vab_max)
+    return _transition_times(seq[:-1], vab[:-1], seq[1:], vab[1:], **kwargs)
+
+
+def optimize_time(seq, vab=None, vab_max=50., ip_weight=0., start=None, **kwargs):
+    """Orders a sequence to minimize the acquisition time spent between quadrupoles (relay operations, DPS voltage
+    changes, pwr discharges and toggles, see transition_times()). The order is built greedily, always moving to the
+    quadrupole the fastest to reach, starting from the one with the lowest vab.
+
+    Parameters
+    ----------
+    seq : array_like
+        Sequence with 4 (or more) columns as A, B, M and N.
+    vab : array_like, optional
+        Known vab of the quadrupoles [V], see predict_vab().
+    vab_max : float, optional
+        Maximum injection voltage [V], see predict_vab().
+    ip_weight : float, optional
+        Weight [s] of the IP cost (see optimize_ip) of measuring on an electrode that was used for injection d
+        quadrupoles before (ip_weight / d). Set to 0 to only optimize time.
+    start : int, optional
+        Index of the first quadrupole.
+    kwargs : dict, optional
+        Parameters of the time model, see transition_times().
+
+    Returns
+    -------
+    order : array of int
+        Array of index showing the best order of quad to minimize the acquisition time.
+    report : dict
+        Predicted 'time' of the sequence before and after ('optimized_time') optimization, and 'saved_time' [s].
+    """
+    seq = np.asarray(seq, dtype=int)
+    n = seq.shape[0]
+    vab = predict_vab(seq, vab=vab, vab_max=vab_max)
+    order = np.arange(n)
+    if n > 1:
+        order = np.empty(n, dtype=int)
+        remaining = np.ones(n, dtype=bool)
+        last_injection = np.full(seq.max() + 1, -np.inf)  # last position of each electrode used as A or B
+        current = np.argmin(vab) if start is None else start
+        for pos in range(n):
+            order[pos] = current
+            remaining[current] = False
+            last_injection[seq[current, :2]] = pos
+            if pos == n - 1:
+                break
+            candidates = np.where(remaining)[0]
+            cost = _transition_times(seq[current], vab[current], seq[candidates], vab[candidates], **kwargs)
+            if ip_weight > 0.:
+                cost = cost + ip_weight * np.sum(1. / (pos + 1 - last_injection[seq[candidates, 2:]]), axis=1)
+            current = candidates[np.argmin(cost)]  # ties keep the original order
+    time_before = np.sum(transition_times(seq, vab=vab, **kwargs))
+    time_after = np.sum(transition_times(seq[order], vab=vab[order], **kwargs))
+    if time_after > time_before and ip_weight == 0.:  # greedy ordering can be worse on well ordered sequences
+        order, time_after = np.arange(n), time_before
+    report = {'time': float(time_before), 'optimized_time': float(time_after),
+              'saved_time': float(time_before - time_after)}
+    return order, report
+
 # if True:
 #     plt.ion()
 #     seq = create_sequence(24, params=[('wenner', 4)], opt_ip=True, opt_plot=True)
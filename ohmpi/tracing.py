@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from itertools import count
+
+
+class _Span:
+    def __init__(self, tracer, category, name):
+        self._tracer = tracer
+        self._category = category
+        self._name = name
+
+    def __enter__(self):
+        self._tracer.begin(self._category, self._name)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._tracer.end(self._category, self._name)
+
+
+class Tracer:
+    """Tracer class.
+    Records begin and end events of execution spans with time.perf_counter_ns in a ring buffer. Recording is
+    disabled by default and then only costs a test on the enabled flag. Traces can be exported in the Chrome trace
+    event format, which can be opened with Perfetto (https://ui.perfetto.dev) or chrome://tracing.
+    When enabled with a logger, spans are also logged at EVENT level in the format read by ohmpi.plots.plot_exec_log
+    (category, name, begin/end and UTC time separated by tabs).
+
+    Parameters
+    ----------
+    capacity: int, optional
+        Maximum number of events kept in the ring buffer. Oldest events are overwritten.
+    """
+    def __init__(self, capacity=65536):
+        self.enabled = False
+        self.logger = None  # logger to which events are also logged at EVENT level
+        self._capacity = capacity
+        self._events = [None] * capacity
+        self._counter = count()
+        self._n_events = 0
+        self._t0 = time.perf_counter_ns()
+        self._t0_utc = time.time_ns()
+
+    def enable(self, capacity=None, logger=None):
+        """Clears the ring buffer and starts recording events
+
+        Parameters
+        ----------
+        capacity: int, optional
+            Maximum number of events kept in the ring buffer
+        logger: logging.Logger, optional
+            Logger to which events are also logged at EVENT level (e.g. the exec logger, see ohmpi.logging_setup)
+        """
+        if capacity is not None:
+            self._capacity = capacity
+        self.logger = logger
+        self.clear()
+        self.enabled = True
+
+    def disable(self):
+        """Stops recording events. Recorded events are kept until the next call to enable or clear"""
+        self.enabled = False
+
+    def clear(self):
+        self._events = [None] * self._capacity
+        self._counter = count()
+        self._n_events = 0
+        self._t0 = time.perf_counter_ns()
+        self._t0_utc = time.time_ns()
+
+    def _record(self, phase, category, name):
+        i = next(self._counter)  # atomic, no lock needed
+        self._events[i % self._capacity] = (time.perf_counter_ns(), phase, category, name, threading.get_ident())
+        self._n_events = i + 1
+        if self.logger is not None:
+            state = 'begin' if phase == 'B' else 'end'
+            self.logger.event(f'{category}\t{name}\t{state}\t{datetime.now(timezone.utc)}')
+
+    def begin(self, category, name):
+        if self.enabled:
+            self._record('B', category, name)
+
+    def end(self, category, name):
+        if self.enabled:
+            self._record('E', category, name)
+
+    def span(self, category, name):
+        """Context manager recording a span from its begin to its end"""
+        if self.enabled:
+            return _Span(self, category, name)
+        return nullcontext()
+
+    @property
+    def events(self):
+        """Recorded events in chronological order as (time_ns, phase, category, name, thread_id) tuples"""
+        n = self._n_events
+        if n > self._capacity:
+            events = self._events[n % self._capacity:] + self._events[:n % self._capacity]
+        else:
+            events = self._events[:n]
+        return sorted([e for e in events if e is not None], key=lambda e: e[0])
+
+    def to_chrome_trace(self):
+        """Returns the recorded events as a Chrome trace event format dictionary"""
+        pid = os.getpid()
+        trace_events = [{'name': name, 'cat': category, 'ph': phase, 'ts': (t - self._t0) / 1000., 'pid': pid,
+                         'tid': tid} for t, phase, category, name, tid in self.events]
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                'otherData': {'t0_utc_ns': self._t0_utc}}
+
+    def export(self, filename):
+        """Exports the recorded events to a Chrome trace / Perfetto JSON file"""
+        with open(filename, 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+tracer = Tracer()
+
+
+def load_trace(trace):
+    """Loads a Chrome trace event format trace
+
+    Parameters
+    ----------
+    trace: str, dict or Tracer
+        Path to a JSON trace file, trace dictionary or Tracer
+
+    Returns
+    -------
+    dict
+        Trace dictionary
+    """
+    if isinstance(trace, Tracer):
+        return trace.to_chrome_trace()
+    if isinstance(trace, str):
+        with open(trace, 'r') as f:
+            trace = json.load(f)
+    return trace
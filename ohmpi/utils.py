@@ -498,71 +498,79 @@ MQTT_CONTROL_CONFIG = {
                         print(f'### skipping {config_filename} ###')
 
 
-def sequence_random_sampler(sequence, n_samples=10, include_min_and_max_separation=True):
-    """
-    Downsample sequence randomly
+def sequence_spacings(sequence):
+    """Computes the spacings between the electrodes of each quadrupole, which identify its array type.
+
     Parameters
     ----------
-    sequence
-    n_samples
+    sequence : array_like
+        Sequence with 4 (or more) columns as A, B, M and N.
 
     Returns
     -------
+    spacings : numpy.ndarray of int
+        Array of shape nquad x 4 with the AB, BM, MN and NA spacings (in number of electrodes).
+    """
+    sequence = np.asarray(sequence, dtype=np.int64).reshape(-1, np.shape(sequence)[-1])
+    return np.abs(np.diff(sequence[:, [0, 1, 2, 3, 0]], axis=1))
 
+
+def sequence_random_sampler(sequence, n_samples=10, include_min_and_max_separation=True, seed=None,
+                            return_labels=False):
     """
+    Downsample sequence randomly, stratified by array type (quadrupoles grouped by their AB, BM, MN and NA spacings).
+    If there are more array types than samples, one quadrupole is sampled in n_samples array types, otherwise
+    samples are shared between array types proportionally to their number of quadrupoles (at least one each).
 
-    import random
-
-    spacing_ab = np.abs(sequence[:, 1] - sequence[:, 0])
-    spacing_bm = np.abs(sequence[:, 2] - sequence[:, 1])
-    spacing_mn = np.abs(sequence[:, 3] - sequence[:, 2])
-    spacing_an = np.abs(sequence[:, 0] - sequence[:, 3])
-
-    array_types = 0
-    arrays = {}
-    for ab in np.sort(np.unique(spacing_ab)):
-        for bm in np.sort(np.unique(spacing_bm)):
-            for mn in np.sort(np.unique(spacing_mn)):
-                for an in np.sort(np.unique(spacing_an)):
-                    seq = sequence[
-                        np.where((spacing_ab == ab) & (spacing_bm == bm) & (spacing_mn == mn) & (spacing_an == an))]
-                    if len(seq) > 0:
-                        arrays[array_types] = seq
-                        array_types += 1
-
-    if n_samples < array_types:
-        if include_min_and_max_separation:
-            sampled_types = [0, array_types - 1]
-            sampled_types = sampled_types + random.sample(range(1, array_types - 1), n_samples - 2)
-        else:
-            sampled_types = random.sample(range(array_types), n_samples)
-        for i, sampled_type in enumerate(sampled_types):
-            sample = random.sample(range(len(arrays[sampled_type])), 1)
-            if i == 0:
-                quads = arrays[sampled_type][sample]
-            else:
-                quads = np.vstack((quads, arrays[sampled_type][sample]))
-
-    if n_samples > array_types:
-        length_dict = np.array([len(arrays[k]) for k in range(array_types)])
-        sizes = (n_samples // array_types) * (
-                (length_dict / np.sum(length_dict)) * array_types) // 1 + (
-                        (length_dict / np.sum(length_dict)) * array_types) // 1
-        sizes = sizes.astype(int)
-
-        if n_samples - np.sum(sizes) > 0:
-            adds = np.zeros(array_types)
-            adds[np.where((length_dict - sizes) > 0)[0][
-                random.sample(range(len(np.where((length_dict - sizes) > 0)[0])), n_samples - np.sum(sizes))]] = 1
-            sizes = sizes + adds
-
-        sizes = sizes.astype(int)
-        quads = np.array([])
-        for i, (size, key) in enumerate(zip(sizes, arrays)):
-            samples = random.sample(range(len(arrays[key])), size)
-            if i == 0:
-                quads = arrays[key][samples]
-            else:
-                quads = np.vstack((quads, arrays[key][samples]))
+    Parameters
+    ----------
+    sequence : array_like
+        Sequence with 4 (or more) columns as A, B, M and N.
+    n_samples : int, optional
+        Number of quadrupoles to sample.
+    include_min_and_max_separation : bool, optional
+        When sampling fewer array types than available, always includes the first and last array types (smallest
+        and largest AB spacing).
+    seed : int, numpy.random.Generator, optional
+        Seed of the random number generator.
+    return_labels : bool, optional
+        Also returns the array type of each sampled quadrupole.
 
+    Returns
+    -------
+    quads : numpy.ndarray
+        Sampled quadrupoles, grouped by array type.
+    labels : numpy.ndarray of int
+        Array type of each sampled quadrupole, index in array_types (only if return_labels).
+    array_types : numpy.ndarray of int
+        AB, BM, MN and NA spacings of each array type (only if return_labels).
+    """
+    sequence = np.asarray(sequence)
+    rng = np.random.default_rng(seed)
+    array_types, labels = np.unique(sequence_spacings(sequence), axis=0, return_inverse=True)
+    labels = np.ravel(labels)
+    n_types = len(array_types)
+    counts = np.bincount(labels, minlength=n_types)
+
+    # number of quadrupoles sampled in each array type
+    sizes = np.zeros(n_types, dtype=int)
+    if n_samples <= n_types:
+        if include_min_and_max_separation and n_samples >= 2:
+            sampled_types = np.r_[0, n_types - 1, rng.choice(np.arange(1, n_types - 1), n_samples - 2, replace=False)]
+        else:
+            sampled_types = rng.choice(n_types, n_samples, replace=False)
+        sizes[sampled_types] = 1
+    else:
+        sizes = np.minimum(1 + ((n_samples - n_types) * counts) // len(sequence), counts)
+        while sizes.sum() < min(n_samples, len(sequence)):  # shares the remaining samples randomly
+            room = np.where(sizes < counts)[0]
+            sizes[rng.choice(room, min(n_samples - sizes.sum(), len(room)), replace=False)] += 1
+
+    # random quadrupoles of each array type: shuffles quadrupoles within each type and keeps the first ones
+    order = np.lexsort((rng.random(len(sequence)), labels))
+    rank = np.arange(len(sequence)) - (np.cumsum(counts) - counts)[labels[order]]
+    selected = order[rank < sizes[labels[order]]]
+    quads = sequence[selected]
+    if return_labels:
+        return quads, labels[selected], array_types
     return quads